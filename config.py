@@ -8,6 +8,19 @@ load_dotenv(path.join(BASE_DIR, '.env'))
 SAVE_DIR = fr'C:\Temp\dash_example\dashboards'
 makedirs(SAVE_DIR, exist_ok=True)
 
+# MongoDB holding the prices, memory:// for an in-memory database seeded with synthetic prices, e.g. for load tests
+MONGO_URI = environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+
+# SQLite file of the results kept across workers and restarts, set to an empty value to disable it
+RESULT_CACHE_FILE = environ.get('RESULT_CACHE_FILE', path.join(SAVE_DIR, 'results.sqlite'))
+RESULT_CACHE_MAX_MB = int(environ.get('RESULT_CACHE_MAX_MB', 1024))
+
+# Set to 1 to import the analytics libraries before serving, instead of on first use, see gunicorn.conf.py
+WARM_UP = environ.get('WARM_UP') == '1'
+
+# Optional csv file of live prices followed by the pair monitor, history is replayed instead when not set
+MONITOR_FEED_FILE = environ.get('MONITOR_FEED_FILE')
+
 class Config:
     """Flask configuration variables."""
 
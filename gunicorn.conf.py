@@ -0,0 +1,24 @@
+"""
+Gunicorn settings, read by e.g. gunicorn wsgi:app.
+
+The analytics libraries are imported on first use. With WARM_UP=1 they are imported before serving: once in the master
+when the app is preloaded (PRELOAD_APP=1), so that all the workers share them, otherwise in every worker after it forks.
+"""
+from os import environ
+
+from config import WARM_UP
+
+preload_app = environ.get('PRELOAD_APP') == '1'
+
+
+def when_ready(server):
+    # the master has loaded the app, the workers are forked after this
+    if WARM_UP and preload_app:
+        from signals.utils.startup import warm_up
+        warm_up()
+
+
+def post_fork(server, worker):
+    if WARM_UP and not preload_app:
+        from signals.utils.startup import warm_up
+        warm_up()
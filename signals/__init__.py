@@ -2,6 +2,7 @@
 from flask import Flask
 from flask_assets import Environment
 from flask_login import LoginManager, login_required
+from pymongo.errors import PyMongoError
 from config import Config
 from signals.users import User
 
@@ -18,6 +19,15 @@ def init_app():
         from signals import routes
         from signals.assets import compile_static_assets
 
+        # The loaders rely on the indexes, created once at start-up rather than on every update
+        from signals.data.dataloader import DB_STOCK
+        from signals.data.schema import ensure_indexes
+        from signals.utils.dashlogger import logger
+        try:
+            ensure_indexes(DB_STOCK)
+        except PyMongoError as e:
+            logger.error(f'Could not create the indexes due to {e}.')
+
         # Import and initialize each Dash applications
         from signals.strategies.pair_trading import dashboard as signal1
         from signals.strategies.index_regression import dashboard as signal2
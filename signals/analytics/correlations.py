@@ -3,24 +3,23 @@ import os
 
 import numpy as np
 import pandas as pd
-import statsmodels.api as sm
-from pykalman import KalmanFilter
-from scipy import stats
-from statsmodels.tsa.stattools import coint
 
+# scipy, statsmodels and pykalman take seconds to import, each method imports its own on first use
 from config import SAVE_DIR
-from signals.data.dataloader import get_daily_data
+from signals.analytics.meanreversion import SPREAD_DYNAMICS_COLS, get_spread_dynamics
+from signals.data.panel import get_panel_data
 from signals.utils.dashlogger import logger
 from signals.utils.datahelper import ALL_STOCKS
 
 CORRELATION_SAVE_DIR = fr'{SAVE_DIR}\pair_trading'
 os.makedirs(CORRELATION_SAVE_DIR, exist_ok=True)
 
+# every method also reports the mean reversion of the spread, see meanreversion.py
 CORR_METHODS_TABLE_DICT = {
-    'pearson': ['Correlation', 'Correlation P-value'],
-    'ols': ['OLS RSquared', 'OLS Beta', 'OLS Mean Reversion Speed'],
-    'kalman': ['KF Beta', 'KF Mean Reversion Speed'],
-    'coint': ['Coint P-value', 'Coint t-stats'],
+    'pearson': ['Correlation', 'Correlation P-value'] + SPREAD_DYNAMICS_COLS,
+    'ols': ['OLS RSquared', 'OLS Beta'] + SPREAD_DYNAMICS_COLS,
+    'kalman': ['KF Beta'] + SPREAD_DYNAMICS_COLS,
+    'coint': ['Coint P-value', 'Coint t-stats'] + SPREAD_DYNAMICS_COLS,
 }
 CORR_METHODS_LIST = list(CORR_METHODS_TABLE_DICT.keys())
 
@@ -46,20 +45,24 @@ def get_correlation_metrics(stock1, stock2, ts_x, ts_y, method):
         res = {'Stocks Pair': stock1 + ' - ' + stock2}
 
         if method == 'pearson':
+            from scipy import stats
+
             # calculate the correlation and p-value
             corr, pvalue = stats.pearsonr(ts_x, ts_y)
             corr_res = {'Correlation': corr, 'Correlation P-value': pvalue, }
         elif method == 'ols':
-            # perform OLS regression to calculate the beta and mean reversion speed
+            import statsmodels.api as sm
+
+            # perform OLS regression to calculate the beta
             ts_x = sm.add_constant(ts_x)
             model = sm.OLS(ts_y, ts_x).fit()
             rsquared = model.rsquared
-            beta = model.params[1]
-            mean_reversion_speed_ols = -np.log(beta)
-            corr_res = {'OLS RSquared': rsquared, 'OLS Beta': beta,
-                        'OLS Mean Reversion Speed': mean_reversion_speed_ols, }
+            beta = model.params.iloc[1]
+            corr_res = {'OLS RSquared': rsquared, 'OLS Beta': beta, }
         elif method == 'kalman':
-            # perform Kalman filter to estimate the beta and mean reversion speed
+            from pykalman import KalmanFilter
+
+            # perform Kalman filter to estimate the beta
             delta = 1e-3
             trans_cov = delta / (1 - delta) * np.eye(2)
             obs_mat = np.vstack([ts_x, np.ones(len(ts_x))]).T[:, np.newaxis]
@@ -74,9 +77,10 @@ def get_correlation_metrics(stock1, stock2, ts_x, ts_y, method):
             slope = kalman_means[:, 0],
 
             beta = slope[0][-1]
-            mean_reversion_speed_kalman = -np.log(beta)
-            corr_res = {'KF Beta': beta, 'KF Mean Reversion Speed': mean_reversion_speed_kalman, }
+            corr_res = {'KF Beta': beta, }
         elif method == 'coint':
+            from statsmodels.tsa.stattools import coint
+
             result = coint(ts_x, ts_y)
             co_int_tstats = result[0]
             co_int_pvalue = result[1]
@@ -108,8 +112,9 @@ def get_correlation_full_res_helper(symbols, input_df, method):
     for symbol in symbols:
         stock1 = symbol[0]
         stock2 = symbol[1]
-        ts1 = input_df[stock1]
-        ts2 = input_df[stock2]
+        # metrics are calculated in double precision on the two selected series only
+        ts1 = input_df[stock1].astype(np.float64)
+        ts2 = input_df[stock2].astype(np.float64)
         res_l.append(get_correlation_metrics(stock1, stock2, ts1, ts2, method))
 
     return res_l
@@ -135,18 +140,62 @@ def get_correlation_full_res(start_date, end_date, method, topn):
     :return:
     :rtype: pd.DataFrame
     """
+    input_df = get_screening_data(start_date, end_date)
+    symbols = get_top_pairs_from_returns(input_df, topn)
+
+    res_l = get_correlation_full_res_helper(symbols, input_df, method)
+    # the spread dynamics are fitted for all the pairs at once, for the pairs with metrics
+    dynamics = get_spread_dynamics(input_df, symbols)
+    df = pd.DataFrame([res | dyn if res else res for res, dyn in zip(res_l, dynamics)])
+
+    df = sort_correlation_res(df, method)
+
+    # df.to_csv(fr'{CORRELATION_SAVE_DIR}\{method}_result.csv')
+
+    return df
+
+
+def get_screening_data(start_date, end_date):
+    """
+    Return data of all the stocks used to screen the pairs.
+    :param start_date:
+    :type start_date: str
+    :param end_date:
+    :type end_date: str
+    :return:
+    :rtype: pd.DataFrame
+    """
     # For those tickers with NaN within the selected window, we know they will not have high correlation with the other
     # stocks, fillna with zero will do the same and for later easier to process the data
-    input_df = get_daily_data('return', ALL_STOCKS, start_date, end_date).fillna(0)
+    return get_panel_data('return', ALL_STOCKS, start_date, end_date).fillna(0)
+
 
+def get_top_pairs_from_returns(input_df, topn):
+    """
+    Select the topn pairs with the highest correlation of returns, in the order of the correlation.
+    :param input_df: return data of all the stocks
+    :type input_df: pd.DataFrame
+    :param topn:
+    :type topn: int
+    :return: list of (stock1, stock2)
+    :rtype: list
+    """
     corr_matrix = input_df.corr()
     corr_matrix = corr_matrix.replace(1.0, 0)
     corr_pairs = corr_matrix.unstack().sort_values(ascending=False).drop_duplicates()
-    symbols = corr_pairs[:int(topn)].index.tolist()
+    return corr_pairs[:int(topn)].index.tolist()
 
-    res_l = get_correlation_full_res_helper(symbols, input_df, method)
-    df = pd.DataFrame(res_l)
 
+def sort_correlation_res(df, method):
+    """
+    Sort the correlation results by the main metric of the method.
+    :param df: correlation results
+    :type df: pd.DataFrame
+    :param method:
+    :type method: str
+    :return:
+    :rtype: pd.DataFrame
+    """
     sort_col = CORR_METHODS_TABLE_DICT[method][0]
     if method in ['coint']:
         df = df.sort_values(by=[sort_col])
@@ -157,7 +206,4 @@ def get_correlation_full_res(start_date, end_date, method, topn):
             print(1)
 
     df = df.reset_index().drop('index', axis=1)
-
-    # df.to_csv(fr'{CORRELATION_SAVE_DIR}\{method}_result.csv')
-
     return df
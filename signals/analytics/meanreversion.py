@@ -0,0 +1,70 @@
+"""
+Analytics for the mean reversion of pair spreads, estimated for all the candidate pairs at once.
+
+The spread of a pair is the log price of stock2 less its OLS hedge ratio times the log price of stock1, log prices being
+the cumulative sums of the log returns. The spread is fitted as an AR(1), s_t = a + b * s_t-1 + e_t, the discrete form
+of an Ornstein-Uhlenbeck process ds = kappa * (mu - s) * dt + sigma * dW, so that kappa = -ln(b) and the half-life is
+ln(2) / kappa. Spreads with b outside (0, 1) do not revert, their half-life and kappa are NaN.
+"""
+import numpy as np
+
+from signals.analytics.performance import ANNUAL_FACTOR
+
+SPREAD_DYNAMICS_COLS = ['Half-Life', 'Kappa', 'Spread Vol']
+# pairs fitted at once, bounding the memory of the dates x pairs arrays
+SPREAD_CHUNK_PAIRS = 2000
+
+
+def fit_spread_dynamics(x, y):
+    """
+    Hedge ratio and AR(1) fit of the spreads of many pairs, all moments computed column-wise.
+    :param x: log prices of stock1 of each pair, dates x pairs
+    :type x: np.ndarray
+    :param y: log prices of stock2 of each pair, dates x pairs
+    :type y: np.ndarray
+    :return: half-life in trading days, annualized kappa and annualized sigma of the OU process, one per pair
+    :rtype: np.ndarray, np.ndarray, np.ndarray
+    """
+    x = x - x.mean(axis=0)
+    y = y - y.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = (x * y).sum(axis=0) / (x * x).sum(axis=0)
+        spread = y - beta * x
+
+        s0 = spread[:-1] - spread[:-1].mean(axis=0)
+        s1 = spread[1:] - spread[1:].mean(axis=0)
+        b = (s0 * s1).sum(axis=0) / (s0 * s0).sum(axis=0)
+        resid_var = ((s1 - b * s0) ** 2).sum(axis=0) / max(len(s0) - 2, 1)
+
+        reverting = (b > 0) & (b < 1)
+        kappa = np.where(reverting, -np.log(np.where(reverting, b, 0.5)), np.nan)
+        half_life = np.log(2) / kappa
+        # over a daily step the residual variance of the AR(1) is sigma^2 * (1 - b^2) / (2 * kappa)
+        sigma = np.sqrt(resid_var * 2 * kappa / (1 - b ** 2))
+
+    return half_life, kappa * ANNUAL_FACTOR, sigma * np.sqrt(ANNUAL_FACTOR)
+
+
+def get_spread_dynamics(input_df, symbols):
+    """
+    Mean reversion metrics of the spread of each pair.
+    :param input_df: log returns of the stocks, dates x stocks, without NaN
+    :type input_df: pd.DataFrame
+    :param symbols: list of (stock1, stock2)
+    :type symbols: list
+    :return: a dict of SPREAD_DYNAMICS_COLS per pair, in the order of the symbols
+    :rtype: list
+    """
+    if not symbols:
+        return []
+    log_prices = np.cumsum(input_df.to_numpy(dtype=np.float64), axis=0)
+    loc = {s: i for i, s in enumerate(input_df.columns)}
+    idx1 = np.array([loc[s1] for s1, s2 in symbols])
+    idx2 = np.array([loc[s2] for s1, s2 in symbols])
+
+    res = []
+    for i in range(0, len(symbols), SPREAD_CHUNK_PAIRS):
+        chunk = slice(i, i + SPREAD_CHUNK_PAIRS)
+        metrics = fit_spread_dynamics(log_prices[:, idx1[chunk]], log_prices[:, idx2[chunk]])
+        res.extend(dict(zip(SPREAD_DYNAMICS_COLS, m)) for m in zip(*[m.tolist() for m in metrics]))
+    return res
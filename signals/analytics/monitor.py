@@ -0,0 +1,388 @@
+"""
+Analytics for live monitoring of pair z-scores.
+
+Each dashboard session runs its own monitor in a background thread of the worker that started it. The state of the
+monitor is saved to the database, so that the worker serving the refreshes of the session, whichever it is, reads it,
+and a session starting a new monitor stops its former one, whichever worker runs it.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+
+from config import MONITOR_FEED_FILE
+from signals.data.dataloader import DB_STOCK, get_daily_data
+from signals.utils.dashlogger import logger
+
+# number of alerts kept for the dashboard
+MAX_ALERTS = 200
+# running sums are recomputed from the buffers every so many updates, to stop float errors from accumulating
+RESYNC_EVERY = 1000
+# seconds between two bars when replaying history as a feed
+REPLAY_INTERVAL = 1.0
+# seconds between two reads of the feed file
+FILE_POLL_INTERVAL = 1.0
+# seconds between two saves of the state of a monitor to the database
+MONITOR_SAVE_INTERVAL = 1.0
+# monitors running in a process, starting one more stops the oldest
+MAX_MONITORS = 8
+# seconds after its last save the state of a monitor is removed
+MONITOR_EXPIRY = 24 * 3600
+
+COLLECTION_MONITORS = DB_STOCK['monitors']
+
+
+class PairMonitor:
+    """
+    Keeps the rolling hedge ratio and spread z-score of many pairs up to date as prices arrive. It follows the same
+    definition as backtrader's OLS_TransformationN used by PairTradingStrategy: stock1 is regressed on stock2 over the
+    last `period` prices, and the z-score is that of the latest spread against the last `period` spreads.
+
+    All pairs are held in ring buffers of shape (n_pairs, period) together with their running sums, so an update costs
+    O(1) per pair and is vectorized across pairs.
+    """
+
+    def __init__(self, pairs, period=100, zs=2):
+        self.pairs = [tuple(p) for p in pairs]
+        self.period = period
+        self.zs = zs
+
+        self.tickers = sorted({t for p in self.pairs for t in p})
+        self.loc = {t: i for i, t in enumerate(self.tickers)}
+        self.i1 = np.array([self.loc[p[0]] for p in self.pairs], dtype=int)
+        self.i2 = np.array([self.loc[p[1]] for p in self.pairs], dtype=int)
+        self.last_price = np.full(len(self.tickers), np.nan)
+
+        n = len(self.pairs)
+        # prices of stock1 (y) and stock2 (x), and their running sums of y, x, x*x, x*y
+        self.buf_y = np.zeros((n, period))
+        self.buf_x = np.zeros((n, period))
+        self.sums = np.zeros((4, n))
+        self.count = np.zeros(n, dtype=int)
+        # spreads and their running sums of s, s*s
+        self.buf_s = np.zeros((n, period))
+        self.s_sums = np.zeros((2, n))
+        self.s_count = np.zeros(n, dtype=int)
+
+        self.beta = np.full(n, np.nan)
+        self.spread = np.full(n, np.nan)
+        self.zscore = np.full(n, np.nan)
+        # same status as the strategy: 1 when above the upper limit, 2 when below the lower limit
+        self.status = np.zeros(n, dtype=int)
+
+        self.n_updates = 0
+        self.last_update = None
+        self.alerts = deque(maxlen=MAX_ALERTS)
+        self.lock = threading.Lock()
+
+    def update(self, timestamp, prices):
+        """
+        Apply a new set of prices, pairs with none of their tickers in the update are left unchanged.
+        :param timestamp: time of the prices
+        :type timestamp: dt.datetime
+        :param prices: ticker to price
+        :type prices: dict
+        :return: alerts raised by this update
+        :rtype: list
+        """
+        updated = np.zeros(len(self.tickers), dtype=bool)
+        for ticker, price in prices.items():
+            i = self.loc.get(ticker)
+            if i is not None and price is not None and not np.isnan(price):
+                self.last_price[i] = price
+                updated[i] = True
+
+        y = self.last_price[self.i1]
+        x = self.last_price[self.i2]
+        rows = np.flatnonzero((updated[self.i1] | updated[self.i2]) & ~np.isnan(y) & ~np.isnan(x))
+        if not len(rows):
+            return []
+
+        n = self.period
+        with self.lock:
+            # buffers start with zeros, so the value dropped out of the window is zero until the window is full
+            y, x = y[rows], x[rows]
+            pos = self.count[rows] % n
+            old_y, old_x = self.buf_y[rows, pos], self.buf_x[rows, pos]
+            self.buf_y[rows, pos], self.buf_x[rows, pos] = y, x
+            self.count[rows] += 1
+            self.sums[:, rows] += np.vstack([y - old_y, x - old_x, x * x - old_x * old_x, x * y - old_x * old_y])
+
+            # hedge ratio and spread of the pairs with a full window of prices
+            ready = self.count[rows] >= n
+            rows, y, x = rows[ready], y[ready], x[ready]
+            sy, sx, sxx, sxy = self.sums[:, rows]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                beta = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+            alpha = (sy - beta * sx) / n
+            spread = y - (beta * x + alpha)
+            self.beta[rows] = beta
+            self.spread[rows] = spread
+
+            pos = self.s_count[rows] % n
+            old_s = self.buf_s[rows, pos]
+            self.buf_s[rows, pos] = spread
+            self.s_count[rows] += 1
+            self.s_sums[:, rows] += np.vstack([spread - old_s, spread * spread - old_s * old_s])
+
+            # z-score of the pairs with a full window of spreads, population std as bt.ind.StdDev
+            rows = rows[self.s_count[rows] >= n]
+            mean = self.s_sums[0, rows] / n
+            std = np.sqrt(np.maximum(self.s_sums[1, rows] / n - mean * mean, 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.zscore[rows] = (self.spread[rows] - mean) / std
+
+            alerts = self._check_alerts(rows, timestamp)
+
+            self.n_updates += 1
+            self.last_update = timestamp
+            if self.n_updates % RESYNC_EVERY == 0:
+                self._resync()
+
+        return alerts
+
+    def _check_alerts(self, rows, timestamp):
+        z = self.zscore[rows]
+        new_status = np.where(z > self.zs, 1, np.where(z < -self.zs, 2, self.status[rows]))
+        crossed = rows[new_status != self.status[rows]]
+        self.status[rows] = new_status
+
+        alerts = []
+        for i in crossed:
+            stock1, stock2 = self.pairs[i]
+            alert = {'Time': str(timestamp), 'Stocks Pair': stock1 + ' - ' + stock2, 'Z-Score': self.zscore[i],
+                     'Signal': f'Long {stock1}' if self.status[i] == 1 else f'Long {stock2}'}
+            alerts.append(alert)
+            self.alerts.appendleft(alert)
+            logger.info(fr'Z-Score alert for {alert["Stocks Pair"]} at {timestamp}: {alert["Z-Score"]:.2f}, '
+                        fr'{alert["Signal"]}.')
+        return alerts
+
+    def _resync(self):
+        self.sums = np.vstack([self.buf_y.sum(axis=1), self.buf_x.sum(axis=1), (self.buf_x * self.buf_x).sum(axis=1),
+                               (self.buf_x * self.buf_y).sum(axis=1)])
+        self.s_sums = np.vstack([self.buf_s.sum(axis=1), (self.buf_s * self.buf_s).sum(axis=1)])
+
+    def warm_up(self, df):
+        """
+        Seed the windows from history, so the z-scores are available from the first live price.
+        :param df: close prices with the tickers as columns
+        :type df: pd.DataFrame
+        """
+        for timestamp, row in df.iterrows():
+            self.update(timestamp, row.to_dict())
+        # the alerts of the history are not news
+        self.alerts.clear()
+
+    def snapshot(self):
+        """
+        Current state of all the pairs.
+        :return: one row per pair
+        :rtype: pd.DataFrame
+        """
+        with self.lock:
+            return pd.DataFrame({
+                'Stocks Pair': [p[0] + ' - ' + p[1] for p in self.pairs],
+                'Hedge Ratio': self.beta.copy(),
+                'Spread': self.spread.copy(),
+                'Z-Score': self.zscore.copy(),
+                'Signal': [f'Long {p[0]}' if st == 1 else f'Long {p[1]}' if st == 2 else ''
+                           for p, st in zip(self.pairs, self.status)],
+            })
+
+
+class ReplayFeed:
+    """
+    Replays a DataFrame of prices bar by bar, the local stand-in of a live feed.
+    :param stop: function returning True once the feed is to end
+    :type stop: callable
+    """
+
+    def __init__(self, df, interval=REPLAY_INTERVAL, stop=None):
+        self.df = df
+        self.interval = interval
+        self.stop = stop or (lambda: False)
+
+    def __iter__(self):
+        for timestamp, row in self.df.iterrows():
+            if self.stop():
+                return
+            yield timestamp, row.dropna().to_dict()
+            if self.interval:
+                time.sleep(self.interval)
+
+
+class FileFeed:
+    """
+    Follows a csv file with a 'Date' column and one column per ticker, yielding rows as they are appended by another
+    process, until stopped.
+    :param stop: function returning True once the feed is to end, checked while waiting for new rows
+    :type stop: callable
+    """
+
+    def __init__(self, path, poll_interval=FILE_POLL_INTERVAL, stop=None):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.stop = stop or (lambda: False)
+
+    def __iter__(self):
+        with open(self.path) as handle:
+            header = handle.readline().strip().split(',')
+            partial = ''
+            while not self.stop():
+                partial += handle.readline()
+                if not partial.endswith('\n'):
+                    # nothing new, or a line still being written
+                    time.sleep(self.poll_interval)
+                    continue
+                values = partial.strip().split(',')
+                partial = ''
+                prices = {t: float(v) for t, v in zip(header[1:], values[1:]) if v}
+                yield pd.Timestamp(values[0]), prices
+
+
+def get_default_feed(tickers, start_date, end_date, stop=None):
+    """
+    The feed file if one is configured, otherwise a replay of the close prices between the dates.
+    """
+    if MONITOR_FEED_FILE:
+        return FileFeed(MONITOR_FEED_FILE, stop=stop)
+    return ReplayFeed(get_daily_data('close', tickers, start_date, end_date).sort_index(), stop=stop)
+
+
+def get_default_warm_up(tickers, period, start_date):
+    """
+    The close prices preceding the default feed, enough to fill the windows of the hedge ratios and of the spreads:
+    the latest ones for the feed file, those before the start date for the replay.
+    :param tickers: tickers of the pairs
+    :type tickers: list
+    :param period: rolling period of the hedge ratio and z-score
+    :type period: int
+    :param start_date: start date of the default replay feed
+    :type start_date: str
+    :rtype: pd.DataFrame
+    """
+    end = pd.Timestamp.now().normalize() if MONITOR_FEED_FILE else pd.Timestamp(start_date) - pd.Timedelta(days=1)
+    # calendar days spanning 2 * period trading days, with room for the holidays
+    start = end - pd.Timedelta(days=int(2 * period * 7 / 5) + 30)
+    df = get_daily_data('close', tickers, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+    return df.sort_index().tail(2 * period)
+
+
+# monitors running in this process, session key -> (monitor, stop event)
+_MONITORS = OrderedDict()
+_MONITORS_LOCK = threading.Lock()
+
+
+def save_monitor_state(key, run_id, monitor):
+    """
+    Save the pairs and alerts of the monitor for the workers serving the session.
+    :return: whether the monitor is still the current one of the session
+    :rtype: bool
+    """
+    state = {'updated': time.time(), 'last_update': str(monitor.last_update),
+             'pairs': monitor.snapshot().to_dict('records'), 'alerts': list(monitor.alerts)}
+    return COLLECTION_MONITORS.update_one({'key': key, 'run': run_id}, {'$set': state}).matched_count > 0
+
+
+def is_current_run(key, run_id):
+    """
+    Whether the run is still the monitor of the session, i.e. the session has not started another one since.
+    :rtype: bool
+    """
+    return COLLECTION_MONITORS.count_documents({'key': key, 'run': run_id}, limit=1) > 0
+
+
+def stop_monitor(key):
+    """
+    Stop the monitor of the session running in this process, if any.
+    :param key: session key
+    :type key: str
+    """
+    with _MONITORS_LOCK:
+        running = _MONITORS.pop(key, None)
+    if running is not None:
+        running[1].set()
+
+
+def start_monitor(key, pairs, period, zs, feed=None, start_date=None, end_date=None, warm_up=None):
+    """
+    Start monitoring the pairs in a background thread, replacing the monitor of the session.
+    :param key: session key
+    :type key: str
+    :param pairs: list of (stock1, stock2)
+    :type pairs: list
+    :param period: rolling period of the hedge ratio and z-score
+    :type period: int
+    :param zs: z-score limit raising the alerts
+    :type zs: float
+    :param feed: iterable of (timestamp, prices), the default feed if None
+    :type feed: iterable
+    :param start_date: start date of the default replay feed
+    :type start_date: str
+    :param end_date: end date of the default replay feed
+    :type end_date: str
+    :param warm_up: history to seed the windows with
+    :type warm_up: pd.DataFrame
+    :return: the monitor
+    :rtype: PairMonitor
+    """
+    monitor = PairMonitor(pairs, period, zs)
+    if warm_up is not None:
+        monitor.warm_up(warm_up)
+
+    # replacing the run of the session stops the former monitor, also when another worker runs it
+    run_id = uuid.uuid4().hex
+    COLLECTION_MONITORS.delete_many({'updated': {'$lt': time.time() - MONITOR_EXPIRY}})
+    COLLECTION_MONITORS.replace_one({'key': key}, {'key': key, 'run': run_id}, upsert=True)
+    save_monitor_state(key, run_id, monitor)
+
+    stopped = threading.Event()
+
+    def is_stopped():
+        return stopped.is_set() or not is_current_run(key, run_id)
+
+    if feed is None:
+        feed = get_default_feed(monitor.tickers, start_date, end_date, stop=is_stopped)
+
+    def run():
+        last_save = time.time()
+        for timestamp, prices in feed:
+            if stopped.is_set():
+                break
+            monitor.update(timestamp, prices)
+            if time.time() - last_save >= MONITOR_SAVE_INTERVAL:
+                last_save = time.time()
+                if not save_monitor_state(key, run_id, monitor):
+                    break
+        else:
+            save_monitor_state(key, run_id, monitor)
+        logger.info('Live monitor stopped.')
+
+    stop_monitor(key)
+    with _MONITORS_LOCK:
+        _MONITORS[key] = (monitor, stopped)
+        oldest = list(_MONITORS)[:-MAX_MONITORS]
+    for k in oldest:
+        stop_monitor(k)
+    threading.Thread(target=run, daemon=True).start()
+    logger.info(f'Live monitor started on {len(monitor.pairs)} pairs.')
+
+    return monitor
+
+
+def get_monitor_state(key):
+    """
+    The latest saved state of the monitor of the session.
+    :param key: session key
+    :type key: str
+    :return: one row per pair and the alerts, newest first, None if the session has no monitor
+    :rtype: pd.DataFrame, list
+    """
+    doc = COLLECTION_MONITORS.find_one({'key': key}, {'_id': 0, 'pairs': 1, 'alerts': 1}) if key else None
+    if doc is None:
+        return None
+    return pd.DataFrame(doc.get('pairs', [])), doc.get('alerts', [])
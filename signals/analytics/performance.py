@@ -0,0 +1,79 @@
+"""Analytics for performance metrics of an account value curve."""
+import numpy as np
+
+# trading days per year
+ANNUAL_FACTOR = 252
+# minimum acceptable daily return of the Sortino ratio, ~1% annually
+SORTINO_MAR = 0.00004
+# annual risk-free rate of the Sharpe ratio, the default of backtrader's SharpeRatio analyzer
+RISK_FREE_RATE = 0.01
+
+
+def get_max_drawdown(values):
+    """
+    Max drawdown in percentage of the value curve.
+    :param values: account values
+    :type values: np.ndarray
+    :return: max drawdown, e.g. 5.0 for 5%
+    :rtype: float
+    """
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return np.nan
+    peak = np.maximum.accumulate(values)
+    return float(np.max((peak - values) / peak) * 100)
+
+
+def get_sortino_ratio(log_returns, mar=SORTINO_MAR):
+    """
+    Annualized Sortino ratio of daily log returns, following the R package PerformanceAnalytics SortinoRatio function.
+    :param log_returns: daily log returns
+    :type log_returns: np.ndarray
+    :param mar: minimum acceptable return
+    :type mar: float
+    :return: Sortino ratio
+    :rtype: float
+    """
+    log_returns = np.asarray(log_returns, dtype=float)
+    mean = log_returns.mean() * ANNUAL_FACTOR - mar if len(log_returns) else np.nan
+    neg = log_returns[log_returns < 0]
+    std_neg = neg.std(ddof=1) * np.sqrt(ANNUAL_FACTOR) if len(neg) > 1 else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(mean / std_neg)
+
+
+def get_sharpe_ratio(returns, rate=RISK_FREE_RATE):
+    """
+    Annualized Sharpe ratio of daily returns, as backtrader's SharpeRatio analyzer computes it for the single-pair
+    backtests: the annual rate is converted to a daily one, and the deviation is that of the population.
+    :param returns: daily returns
+    :type returns: np.ndarray
+    :param rate: annual risk-free rate
+    :type rate: float
+    :return: Sharpe ratio
+    :rtype: float
+    """
+    returns = np.asarray(returns, dtype=float)
+    if len(returns) < 2:
+        return np.nan
+    excess = returns - ((1 + rate) ** (1 / ANNUAL_FACTOR) - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(excess.mean() / excess.std() * np.sqrt(ANNUAL_FACTOR))
+
+
+def get_performance_stats(values):
+    """
+    Performance metrics of the value curve, named as the columns of the backtest result tables.
+    :param values: daily account values
+    :type values: np.ndarray
+    :return: metrics
+    :rtype: dict
+    """
+    values = np.asarray(values, dtype=float)
+    log_returns = np.diff(np.log(values))
+    n = len(log_returns)
+    # annualized return in percentage, as 'rnorm100' of backtrader's Returns analyzer
+    rnorm100 = (np.exp(log_returns.sum() * ANNUAL_FACTOR / n) - 1) * 100 if n else np.nan
+
+    return {'Return': rnorm100, 'MaxDrawdown': get_max_drawdown(values),
+            'SharpeRatio': get_sharpe_ratio(np.expm1(log_returns)), 'SortinoRatio': get_sortino_ratio(log_returns)}
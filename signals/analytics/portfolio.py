@@ -0,0 +1,121 @@
+"""Analytics for backtesting many pairs as one portfolio."""
+import numpy as np
+import pandas as pd
+
+from signals.analytics.correlations import get_correlation_full_res
+from signals.analytics.performance import get_performance_stats
+from signals.analytics.rolling import get_rolling_zscores
+from signals.data.dataloader import get_daily_data
+from signals.data.resultcache import get_cached_result
+from signals.utils.dashlogger import logger
+
+PORTFOLIO_CASH = 1000000.0
+
+
+def get_pair_status(zscores, zs):
+    """
+    Holding status of each pair per date, following PairTradingStrategy: 1 holds stock1 once the z-score is above zs,
+    2 holds stock2 once it is below -zs, 0 before any signal.
+    :param zscores: z-scores, dates x pairs
+    :type zscores: np.ndarray
+    :param zs: z-score limit
+    :type zs: float
+    :return: status, dates x pairs
+    :rtype: np.ndarray
+    """
+    signal = np.where(zscores > zs, 1, np.where(zscores < -zs, 2, 0))
+    # carry the last signal forward, which is a loop over dates vectorized across pairs
+    status = np.zeros(signal.shape, dtype=int)
+    current = np.zeros(signal.shape[1], dtype=int)
+    for t in range(len(signal)):
+        current = np.where(signal[t] > 0, signal[t], current)
+        status[t] = current
+    return status
+
+
+def get_top_pairs(start_date, end_date, method, topn):
+    """
+    Top pairs of the correlation screen.
+    :return: list of (stock1, stock2)
+    :rtype: list
+    """
+    rdf = get_cached_result(get_correlation_full_res, start_date, end_date, method, topn)
+    return [tuple(p.split(' - ')) for p in rdf['Stocks Pair']]
+
+
+def run_portfolio_backtest(pairs, start_date, end_date, params, cash=PORTFOLIO_CASH, close=None, trade_start=None):
+    """
+    Backtest the z-score strategy on all the pairs at once. Capital is shared equally: each pair is a sleeve of
+    1/n_pairs of the current account value, held in stock1, stock2 or cash depending on its status. A signal at a close
+    is traded at that close and earns from the next bar, and each ticker is loaded once however many pairs it is in.
+
+    :param pairs: list of (stock1, stock2)
+    :type pairs: list
+    :param start_date: backtest start date
+    :type start_date: str
+    :param end_date: backtest end date
+    :type end_date: str
+    :param params: strategy parameters, i.e. 'period' and 'zs'
+    :type params: dict
+    :param cash: starting cash
+    :type cash: float
+    :param close: close prices with the tickers as columns, loaded from the database if None
+    :type close: pd.DataFrame
+    :param trade_start: first date of trading, the bars before only warm up the z-scores, start_date if None
+    :type trade_start: str
+    :return: portfolio metrics, per-pair attribution and the account value curve
+    :rtype: pd.DataFrame, pd.DataFrame, pd.DataFrame
+    """
+    pairs = [tuple(p) for p in pairs]
+    tickers = sorted({t for p in pairs for t in p})
+    if close is None:
+        close = get_daily_data('close', tickers, start_date, end_date)
+    close = close.sort_index().loc[start_date:end_date].ffill()
+
+    pairs = [p for p in pairs if p[0] in close.columns and p[1] in close.columns]
+    if not pairs or len(close) <= params['period']:
+        logger.warn('Not enough data to run the portfolio backtest, please check your inputs.')
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+    loc = {t: i for i, t in enumerate(close.columns)}
+    i1 = np.array([loc[p[0]] for p in pairs])
+    i2 = np.array([loc[p[1]] for p in pairs])
+    prices = close.to_numpy(dtype=float)
+
+    zscores = get_rolling_zscores(prices[:, i1], prices[:, i2], params['period'])
+    status = get_pair_status(zscores, params['zs'])
+
+    asset_returns = np.zeros(prices.shape)
+    asset_returns[1:] = prices[1:] / prices[:-1] - 1
+    asset_returns = np.nan_to_num(asset_returns)
+
+    if trade_start is not None:
+        t0 = close.index.searchsorted(pd.Timestamp(trade_start))
+        status, asset_returns, close = status[t0:], asset_returns[t0:], close.iloc[t0:]
+        if not len(close):
+            logger.warn('No data to trade after the warm-up, please check your inputs.')
+            return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    # return of each sleeve over the next bar, given its holding at the close
+    sleeve_returns = np.zeros(status.shape)
+    sleeve_returns[1:] = np.where(status[:-1] == 1, asset_returns[1:, i1],
+                                  np.where(status[:-1] == 2, asset_returns[1:, i2], 0))
+
+    weight = 1 / len(pairs)
+    portfolio_returns = sleeve_returns.sum(axis=1) * weight
+    values = cash * np.cumprod(1 + portfolio_returns)
+
+    # dollar pnl of each sleeve, based on the account value at the previous close
+    prev_values = np.concatenate([[cash], values[:-1]])
+    pnl = sleeve_returns * weight * prev_values[:, None]
+
+    stats_df = pd.DataFrame([{'Pairs': len(pairs)} | get_performance_stats(values)])
+    attribution_df = pd.DataFrame({
+        'Stocks Pair': [p[0] + ' - ' + p[1] for p in pairs],
+        'PnL': pnl.sum(axis=0),
+        'Contribution': pnl.sum(axis=0) / cash * 100,
+        'Trades': (np.diff(status, axis=0) != 0).sum(axis=0) + (status[0] > 0),
+        'Time in Market': (status > 0).mean(axis=0) * 100,
+    }).sort_values('PnL', ascending=False).reset_index(drop=True)
+    df_tv = pd.DataFrame({'Total_Value': values}, index=close.index)
+
+    return stats_df, attribution_df, df_tv
@@ -0,0 +1,240 @@
+"""
+Precomputed screening results for the standard windows.
+
+After each data refresh the top pairs with all metric families and the Lasso baskets of each index are materialized
+for the trailing 1Y, 2Y and 3Y windows ending at the last update, so the dashboards serve those windows without
+recomputing. Custom date ranges are still computed live.
+"""
+import argparse
+import datetime as dt
+import pickle
+import time
+import zlib
+
+import pandas as pd
+from bson.binary import Binary
+
+from signals.analytics.correlations import CORR_METHODS_LIST, CORR_METHODS_TABLE_DICT, get_correlation_metrics, \
+    get_screening_data, get_top_pairs_from_returns, sort_correlation_res
+from signals.analytics.meanreversion import get_spread_dynamics
+from signals.analytics.regressions import get_top_components_via_lasso
+from signals.data.dataloader import DB_STOCK, get_last_update, update_price_data, update_return_data
+from signals.data.panel import get_data_version
+from signals.data.schema import ensure_indexes
+from signals.utils.dashlogger import logger
+from signals.utils.datahelper import ALL_INDEXES, ALL_TICKERS
+
+COLLECTION_PRECOMPUTED = DB_STOCK['precomputed']
+
+STANDARD_WINDOWS = {'1Y': 1, '2Y': 2, '3Y': 3}
+# number of top pairs materialized per window, larger topn requests are computed live
+PRECOMPUTE_TOPN = 100
+# number of stocks of the precomputed Lasso baskets
+PRECOMPUTE_N_NONZERO = 10
+# time of the day the scheduled refresh runs, after the market close
+SCHEDULE_TIME = '18:00'
+
+# standard windows of the current data version
+_WINDOWS_CACHE = {}
+
+
+def get_standard_windows(last_update=None):
+    """
+    Standard windows ending at the last trading date of the prices. The 'last_update' value is the exclusive end date
+    passed to yfinance, the windows end on the business day before it.
+    :param last_update: the last update date, the current one if None
+    :type last_update: str
+    :return: window name to (start_date, end_date)
+    :rtype: dict
+    """
+    if last_update is None:
+        # asked by every request of the dashboards, read from the database once per data version
+        version = get_data_version()
+        windows = _WINDOWS_CACHE.get(version)
+        if windows is None:
+            windows = get_standard_windows(get_last_update())
+            _WINDOWS_CACHE.clear()
+            _WINDOWS_CACHE[version] = windows
+        return windows
+    if not last_update:
+        return {}
+    end_date = pd.Timestamp(last_update[:10]) - pd.offsets.BDay(1)
+    return {name: ((end_date - pd.DateOffset(years=years)).strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+            for name, years in STANDARD_WINDOWS.items()}
+
+
+def save_result(kind, key, payload, version):
+    """
+    Save a result to the store, as compressed pickle.
+    :param kind: 'correlation' or 'lasso'
+    :type kind: str
+    :param key: identifies the result within its kind
+    :type key: dict
+    :param payload: result
+    :type payload: object
+    :param version: data version the result is computed on
+    :type version: str
+    """
+    doc = {'kind': kind, 'key': key, 'version': version,
+           'data': Binary(zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)))}
+    COLLECTION_PRECOMPUTED.replace_one({'kind': kind, 'key': key}, doc, upsert=True)
+
+
+def load_result(kind, key):
+    """
+    Load a result from the store if it is computed on the current data version.
+    :return: result, None if not found or stale
+    :rtype: object
+    """
+    doc = COLLECTION_PRECOMPUTED.find_one({'kind': kind, 'key': key, 'version': get_data_version()})
+    if doc is None:
+        return None
+    return pickle.loads(zlib.decompress(doc['data']))
+
+
+def get_window_name(start_date, end_date):
+    """
+    Name of the standard window matching the dates, None for a custom range.
+    """
+    for name, window in get_standard_windows().items():
+        if window == (start_date, end_date):
+            return name
+    return None
+
+
+def precompute_correlations(start_date, end_date):
+    """
+    Top pairs with the metrics of all the methods, in the order of their correlation.
+    :return: correlation results of all methods
+    :rtype: pd.DataFrame
+    """
+    input_df = get_screening_data(start_date, end_date)
+    symbols = get_top_pairs_from_returns(input_df, PRECOMPUTE_TOPN)
+
+    res_l = []
+    for (stock1, stock2), dynamics in zip(symbols, get_spread_dynamics(input_df, symbols)):
+        res = {'Stocks Pair': stock1 + ' - ' + stock2}
+        for method in CORR_METHODS_LIST:
+            res |= get_correlation_metrics(stock1, stock2, input_df[stock1].astype(float),
+                                           input_df[stock2].astype(float), method)
+        res_l.append(res | dynamics)
+
+    # the spread dynamics columns are shared by the methods
+    columns = list(dict.fromkeys(c for m in CORR_METHODS_LIST for c in CORR_METHODS_TABLE_DICT[m]))
+    return pd.DataFrame(res_l, columns=['Stocks Pair'] + columns)
+
+
+def run_precompute():
+    """
+    Materialize the results of all the standard windows on the current data version.
+    :return: finish message
+    :rtype: str
+    """
+    version = get_data_version()
+    t1 = time.time()
+
+    for name, (start_date, end_date) in get_standard_windows().items():
+        logger.info(f'Precomputing correlations of window {name}: {start_date} to {end_date}.')
+        save_result('correlation', {'window': name}, precompute_correlations(start_date, end_date), version)
+
+        for index_value in ALL_INDEXES:
+            logger.info(f'Precomputing Lasso basket of {index_value} for window {name}.')
+            try:
+                rdf, plot, summary = get_top_components_via_lasso(
+                    index_value, start_date, end_date,
+                    fr'Plot on regression of best {PRECOMPUTE_N_NONZERO} stocks and {index_value[1:]}',
+                    n_nonzero=PRECOMPUTE_N_NONZERO)
+                save_result('lasso', {'window': name, 'index': index_value}, (rdf, plot, summary), version)
+            except Exception as e:
+                logger.error("Precomputing Lasso basket of %s failed due to %s. " % (index_value, e))
+
+    # results of older data versions are never served again
+    COLLECTION_PRECOMPUTED.delete_many({'version': {'$ne': version}})
+
+    logger.info('Total time used in precomputing: ' + '%0.2f' % (time.time() - t1) + ' seconds.')
+    return 'Results successfully precomputed.'
+
+
+def get_precomputed_correlation(start_date, end_date, method, topn):
+    """
+    Same as get_correlation_full_res, served from the store for the standard windows.
+    :return: correlation results, None if the request is not precomputed
+    :rtype: pd.DataFrame
+    """
+    name = get_window_name(start_date, end_date)
+    if name is None or int(topn) > PRECOMPUTE_TOPN:
+        return None
+
+    df = load_result('correlation', {'window': name})
+    columns = ['Stocks Pair'] + CORR_METHODS_TABLE_DICT[method]
+    # results stored before a column was added are computed live until the next precompute
+    if df is None or not set(columns) <= set(df.columns):
+        return None
+
+    # pairs are stored in the order of their correlation, as selected by get_correlation_full_res
+    df = df.iloc[:int(topn)][columns]
+    return sort_correlation_res(df, method)
+
+
+def get_precomputed_lasso(index_value, start_date, end_date, n_nonzero):
+    """
+    Same as get_top_components_via_lasso, served from the store for the standard windows.
+    :return: results of selected stocks, plot and summary, None if the request is not precomputed
+    :rtype: tuple
+    """
+    name = get_window_name(start_date, end_date)
+    if name is None or n_nonzero != PRECOMPUTE_N_NONZERO:
+        return None
+    return load_result('lasso', {'window': name, 'index': index_value})
+
+
+def refresh_data(start_date, end_date):
+    """
+    The full refresh pipeline: prices, returns, then the precomputed results.
+    :param start_date: start date of the prices to update
+    :type start_date: str
+    :param end_date: end date of the prices to update
+    :type end_date: str
+    """
+    # the upserts of the prices look up by Date
+    ensure_indexes(DB_STOCK)
+    for col in ['open', 'high', 'low', 'close', 'volume']:
+        update_price_data(ALL_TICKERS, col, start_date, end_date)
+    # the data version is stamped once the returns are rebuilt, until then every worker keeps serving the former data
+    if update_return_data() is None:
+        return 'Return data update failed, the data version is unchanged.'
+    return run_precompute()
+
+
+def run_scheduler(run_at=SCHEDULE_TIME, lookback_days=7):
+    """
+    Run the refresh pipeline every day at the given time, updating the prices of the last few days.
+    :param run_at: time of the day, format of '%H:%M'
+    :type run_at: str
+    :param lookback_days: number of days of prices to update each time
+    :type lookback_days: int
+    """
+    while True:
+        now = dt.datetime.now()
+        next_run = dt.datetime.combine(now.date(), dt.datetime.strptime(run_at, '%H:%M').time())
+        if next_run <= now:
+            next_run += dt.timedelta(days=1)
+        time.sleep((next_run - now).total_seconds())
+
+        today = dt.date.today()
+        try:
+            logger.info(refresh_data((today - dt.timedelta(days=lookback_days)).strftime('%Y-%m-%d'),
+                                     (today + dt.timedelta(days=1)).strftime('%Y-%m-%d')))
+        except Exception as e:
+            logger.error("Scheduled refresh failed due to %s. " % e)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute the results of the standard windows.')
+    parser.add_argument('--schedule', action='store_true', help='refresh the data and precompute every day')
+    args = parser.parse_args()
+
+    if args.schedule:
+        run_scheduler()
+    else:
+        print(run_precompute())
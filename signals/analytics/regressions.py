@@ -1,18 +1,23 @@
 """Analytics for regressions."""
+from collections import OrderedDict
 
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
-import statsmodels.api as sm
-from sklearn.feature_selection import SelectKBest, f_regression
-from sklearn.linear_model import Lasso
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler
-
-from signals.data.dataloader import get_daily_data
-from signals.utils.dashhelper import get_regression_plot
+
+from signals.data.context import get_index_context
+from signals.data.panel import get_data_version
+from signals.utils.dashhelper import get_cached_figure, get_regression_plot
 from signals.utils.dashlogger import logger
-from signals.utils.datahelper import INDEX_COMP
+
+# 'lars' follows the LARS path, 'forward' is greedy forward selection (orthogonal matching pursuit)
+SELECTION_METHODS = ['lars', 'forward']
+# stocks kept by the screening before the selection, per selected stock and at least
+SCREEN_FACTOR = 20
+SCREEN_MIN = 200
+# number of design matrices kept, one per index and date range
+DESIGN_CACHE_SIZE = 8
+_DESIGN_CACHE = OrderedDict()
 
 
 def get_regression_full_res(index_value, stock_values, start_date, end_date, title, add_plot=True):
@@ -37,10 +42,13 @@ def get_regression_full_res(index_value, stock_values, start_date, end_date, tit
     """
     tickers = [index_value] + stock_values
 
-    df = get_daily_data('return', tickers, start_date, end_date).fillna(0)
+    df = get_index_context(index_value, start_date, end_date).get(tickers).fillna(0).astype(np.float64)
     x = df[stock_values]
     y = df[index_value]
 
+    # statsmodels and sklearn take seconds to import, imported on first use
+    import statsmodels.api as sm
+
     model = sm.OLS(y, x).fit()
     predictions = model.predict(x)
     coef = model.params.values
@@ -51,23 +59,96 @@ def get_regression_full_res(index_value, stock_values, start_date, end_date, tit
     cols = cols[-1:] + cols[:-1]
     res_df = res_df[cols]
 
-    str_sum = str(model.summary())
-
     if add_plot:
         y_predict = (coef * x).sum(axis=1)
 
-        reg_plot = get_regression_plot(y_predict, y, title)
+        # y_predict is the fitted value, so the regression line against the actual index is the identity line
+        reg_plot = get_cached_figure(('regression_plot', index_value, tuple(stock_values), start_date, end_date, title),
+                                     get_regression_plot, y_predict, y, title, slope=1.0, intercept=0.0)
 
-        return res_df, reg_plot, str_sum
+        return res_df, reg_plot, str(model.summary())
     else:
-        return res_df, go.Figure(), str_sum
+        return res_df, go.Figure(), str(model.summary())
 
 
-def get_top_components_via_lasso(index_value, start_date, end_date, title, n_nonzero=10):
+def get_index_design(index_value, start_date, end_date):
+    """
+    Standardized float32 returns of the index components and of the index, along with the absolute correlation of each
+    component to the index. Cached by index and date range until the data is updated, so changing only the number of
+    selected stocks does not rebuild it.
+
+    :param index_value: stock index
+    :type index_value: str
+    :param start_date: regression start date
+    :type start_date: str
+    :param end_date: regression end date
+    :type end_date: str
+    :return: components, design matrix (dates x components), index returns and correlations
+    :rtype: list, np.ndarray, np.ndarray, np.ndarray
+    """
+    key = (index_value, start_date, end_date, get_data_version())
+    if key in _DESIGN_CACHE:
+        _DESIGN_CACHE.move_to_end(key)
+        return _DESIGN_CACHE[key]
+
+    # When selecting the top stocks, those with all NaN data within the selected time window will not be considered.
+    df = get_index_context(index_value, start_date, end_date).load().dropna(axis=1, how='all')
+    features = [c for c in df.columns if c != index_value]
+    x = np.nan_to_num(df[features].to_numpy(dtype=np.float32))
+    y = np.nan_to_num(df[index_value].to_numpy(dtype=np.float32))
+
+    x -= x.mean(axis=0)
+    std = x.std(axis=0)
+    x /= np.where(std > 0, std, 1)
+    y = (y - y.mean()) / (y.std() or 1)
+    corr = np.abs(x.T @ y) / max(len(y), 1)
+
+    _DESIGN_CACHE[key] = features, x, y, corr
+    if len(_DESIGN_CACHE) > DESIGN_CACHE_SIZE:
+        _DESIGN_CACHE.popitem(last=False)
+    return _DESIGN_CACHE[key]
+
+
+def select_components(x, y, corr, n_nonzero, method='lars'):
+    """
+    Select the n_nonzero columns of x that best explain y. The candidates are first screened by their correlation to
+    y (sure independence screening), then the selection runs on the screened columns only.
+
+    :param x: standardized design matrix
+    :type x: np.ndarray
+    :param y: standardized target
+    :type y: np.ndarray
+    :param corr: absolute correlation of each column to y
+    :type corr: np.ndarray
+    :param n_nonzero: number of columns to select
+    :type n_nonzero: int
+    :param method: one of SELECTION_METHODS
+    :type method: str
+    :return: positions of the selected columns, in the order of x
+    :rtype: np.ndarray
+    """
+    n_nonzero = min(n_nonzero, x.shape[1])
+    n_screen = min(max(SCREEN_FACTOR * n_nonzero, SCREEN_MIN), x.shape[1])
+    screened = np.argsort(-corr, kind='stable')[:n_screen]
+
+    from sklearn.linear_model import Lars, OrthogonalMatchingPursuit
+
+    if method == 'lars':
+        model = Lars(n_nonzero_coefs=n_nonzero, fit_intercept=False)
+    elif method == 'forward':
+        model = OrthogonalMatchingPursuit(n_nonzero_coefs=n_nonzero, fit_intercept=False)
+    else:
+        raise ValueError(f'Unknown selection method "{method}", expecting one of {SELECTION_METHODS}.')
+    model.fit(x[:, screened], y)
+
+    return np.sort(screened[np.flatnonzero(model.coef_)])
+
+
+def get_top_components_via_lasso(index_value, start_date, end_date, title, n_nonzero=10, method='lars'):
     """
     Function to identify the set of n(n_nonzero) securities that best explains the index given the certain date range.
-    We use Lasso to decrease the features/stocks in the regression. The parameters to run Lasso can be further
-    optimized by grid search in later version. Here we just use hard-coded ones.
+    The components are screened by their correlation to the index, then selected along the LARS (Lasso) path or by
+    greedy forward selection until exactly n_nonzero are in.
 
     :param index_value: stock index
     :type index_value: str
@@ -79,42 +160,19 @@ def get_top_components_via_lasso(index_value, start_date, end_date, title, n_non
     :type title: str
     :param n_nonzero: number of stocks to chose
     :type n_nonzero: int
+    :param method: one of SELECTION_METHODS
+    :type method: str
     :return: results of selected stocks and regression result vs the index
     :rtype: pd.DataFrame
     """
-    stocks = INDEX_COMP[index_value]
-    # When selecting the top stocks via Lasso, those with all NaN data within the selected time window
-    # will not be considered.
-    df = get_daily_data('return', [index_value] + stocks, start_date, end_date).dropna(axis=1, how='all').fillna(0)
-
-    features = list(df.columns)
-    features.remove(index_value)
-    X = df[features]
-    y = df[index_value]
-
-    scaler = StandardScaler()
-    selector = SelectKBest(f_regression, k=n_nonzero)
-    # we can do a grid search to get optimized parameters, here we use hard-coded one
-    lasso = Lasso(alpha=1e-6, max_iter=1000000)
-
-    pipeline = Pipeline([
-        ('scaler', scaler),
-        ('selector', selector),
-        ('model', lasso)
-    ])
-
-    pipeline.fit(X, y)
-
-    selected_feature_indices = selector.get_support(indices=True)
-    selected_features = [features[i] for i in selected_feature_indices]
-    coefficients = pipeline.named_steps['model'].coef_
+    features, x, y, corr = get_index_design(index_value, start_date, end_date)
+    selected_features = [features[i] for i in select_components(x, y, corr, n_nonzero, method)]
 
-    if np.count_nonzero(coefficients) == n_nonzero:
-        logger.info(f'Selected features: {selected_features, coefficients}')
+    if len(selected_features) == n_nonzero:
+        logger.info(f'Selected features: {selected_features}')
 
     else:
-        logger.warn(
-            f'Could not find {n_nonzero} non-zero coefficients, likely due to alpha step not small enough, still return the feature list.')
+        logger.warn(f'Could only select {len(selected_features)} of {n_nonzero} stocks, still return the feature list.')
 
     res, plot, summary = get_regression_full_res(index_value, selected_features, start_date, end_date, title)
 
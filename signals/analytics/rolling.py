@@ -0,0 +1,163 @@
+"""Analytics for rolling statistics of pairs, computed for many windows at once from cumulative sums."""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from signals.data.panel import get_data_version
+
+# number of pairs whose rolling statistics are kept
+ROLLING_CACHE_SIZE = 32
+
+_ROLLING_CACHE = OrderedDict()
+_ROLLING_LOCK = threading.Lock()
+
+
+def rolling_sum(a, n):
+    """
+    Rolling sum over the first axis via cumulative sums, NaN unless the window holds n valid values.
+    :param a: values, dates x series
+    :type a: np.ndarray
+    :param n: window length
+    :type n: int
+    :rtype: np.ndarray
+    """
+    valid = ~np.isnan(a)
+    c = np.cumsum(np.concatenate([np.zeros((1,) + a.shape[1:]), np.where(valid, a, 0)]), axis=0)
+    cnt = np.cumsum(np.concatenate([np.zeros((1,) + a.shape[1:], dtype=int), valid]), axis=0)
+    out = np.full(a.shape, np.nan)
+    out[n - 1:] = np.where(cnt[n:] - cnt[:-n] == n, c[n:] - c[:-n], np.nan)
+    return out
+
+
+def _center(a):
+    # centre each series on its mean, so the cumulative sums of squares do not grow with the price level
+    return a - np.nanmean(a, axis=0)
+
+
+class RollingMoments:
+    """
+    Cumulative sums of x, y, x*x, y*y and x*y of one or many pairs, computed once and shared by every window length.
+    Dates where either series is missing are excluded, and windows containing one are NaN.
+    """
+
+    def __init__(self, x, y):
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        valid = ~(np.isnan(x) | np.isnan(y))
+        x, y = np.where(valid, _center(x), 0), np.where(valid, _center(y), 0)
+
+        zeros = np.zeros((1,) + x.shape[1:])
+        self.cnt = np.cumsum(np.concatenate([zeros, valid]), axis=0)
+        self.sums = [np.cumsum(np.concatenate([zeros, v]), axis=0) for v in (x, y, x * x, y * y, x * y)]
+        self.shape = x.shape
+
+    def window(self, n):
+        """
+        Sums of x, y, x*x, y*y and x*y over the windows of length n ending at each date, NaN before a full window.
+        :rtype: list
+        """
+        full = self.cnt[n:] - self.cnt[:-n] == n
+        out = []
+        for c in self.sums:
+            s = np.full(self.shape, np.nan)
+            s[n - 1:] = np.where(full, c[n:] - c[:-n], np.nan)
+            out.append(s)
+        return out
+
+    def corr_beta(self, n):
+        """
+        Rolling correlation and rolling beta of y on x over windows of length n.
+        :rtype: np.ndarray, np.ndarray
+        """
+        sx, sy, sxx, syy, sxy = self.window(n)
+        cov = n * sxy - sx * sy
+        var_x = n * sxx - sx * sx
+        var_y = n * syy - sy * sy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.clip(cov / np.sqrt(var_x * var_y), -1, 1)
+            beta = cov / var_x
+        corr[(var_x <= 0) | (var_y <= 0)] = np.nan
+        return corr, beta
+
+
+def get_rolling_corr_beta(x, y, windows):
+    """
+    Rolling correlation and beta of y on x for all the window lengths, in one pass over the data.
+    :param x: values of the first series, dates or dates x pairs
+    :type x: np.ndarray
+    :param y: values of the second series, same shape as x
+    :type y: np.ndarray
+    :param windows: window lengths
+    :type windows: list
+    :return: window length to (correlation, beta)
+    :rtype: dict
+    """
+    moments = RollingMoments(x, y)
+    return {n: moments.corr_beta(n) for n in windows}
+
+
+def get_pair_rolling_corr(stock1, stock2, ts1, ts2, period, windows=()):
+    """
+    Rolling correlation of the pair, as ts1.rolling(period).corr(ts2). All the windows are computed together the first
+    time the pair is seen on these dates and cached, so another period of the same range is served without computing.
+    :param stock1: ticker of stock1
+    :type stock1: str
+    :param stock2: ticker of stock2
+    :type stock2: str
+    :param ts1: timeseries of stock1
+    :type ts1: pd.Series
+    :param ts2: timeseries of stock2, aligned with ts1
+    :type ts2: pd.Series
+    :param period: rolling period
+    :type period: int
+    :param windows: other rolling periods likely to be requested, e.g. the range of the slider
+    :type windows: iterable
+    :return: rolling correlation
+    :rtype: pd.Series
+    """
+    key = (stock1, stock2, ts1.index[0], ts1.index[-1], len(ts1), get_data_version()) if len(ts1) else None
+    with _ROLLING_LOCK:
+        cached = _ROLLING_CACHE.get(key)
+    if cached is None or period not in cached:
+        missing = sorted({period, *windows} - set(cached or {}))
+        corr = {n: c for n, (c, b) in get_rolling_corr_beta(ts1.to_numpy(), ts2.to_numpy(), missing).items()}
+        cached = (cached or {}) | corr
+        with _ROLLING_LOCK:
+            _ROLLING_CACHE[key] = cached
+            if len(_ROLLING_CACHE) > ROLLING_CACHE_SIZE:
+                _ROLLING_CACHE.popitem(last=False)
+    with _ROLLING_LOCK:
+        if key in _ROLLING_CACHE:
+            _ROLLING_CACHE.move_to_end(key)
+
+    return pd.Series(cached[period], index=ts1.index)
+
+
+def get_rolling_zscores(ys, xs, period):
+    """
+    Spread z-scores of many pairs at once, with the OLS_TransformationN definition used by PairTradingStrategy: y is
+    regressed on x over the last `period` prices, and the z-score is that of the spread against its last `period`
+    values.
+    :param ys: prices of stock1 of each pair, dates x pairs
+    :type ys: np.ndarray
+    :param xs: prices of stock2 of each pair, dates x pairs
+    :type xs: np.ndarray
+    :param period: rolling period
+    :type period: int
+    :return: z-scores, dates x pairs
+    :rtype: np.ndarray
+    """
+    n = period
+    sx, sy, sxx, syy, sxy = RollingMoments(xs, ys).window(n)
+    # the moments are of the centred prices, and so are the spreads, which leaves the z-scores unchanged
+    ys, xs = _center(ys), _center(xs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        alpha = (sy - beta * sx) / n
+        spread = ys - (beta * xs + alpha)
+
+        # population std, as bt.ind.StdDev
+        mean = rolling_sum(spread, n) / n
+        std = np.sqrt(np.maximum(rolling_sum(spread * spread, n) / n - mean * mean, 0))
+        return (spread - mean) / std
@@ -1,19 +1,34 @@
 """Analytics for backtest."""
+import array
 from collections import OrderedDict
 
 import backtrader as bt
 import backtrader.indicators as btind
 import numpy as np
 import pandas as pd
-import plotly.io
 from backtrader import Analyzer
-from backtrader_plotly.plotter import BacktraderPlotly
-from pandas import Series
 
+from signals.analytics.performance import ANNUAL_FACTOR, RISK_FREE_RATE, get_max_drawdown, get_sharpe_ratio, \
+    get_sortino_ratio
+from signals.analytics.rolling import get_pair_rolling_corr
 from signals.data.dataloader import get_full_data_for_bt
-from signals.utils.dashhelper import strategy_plot
+from signals.utils.dashhelper import get_cached_figure, strategy_plot
 from signals.utils.dashlogger import logger
 
+# backtrader date number of 1970-01-01
+UNIX_EPOCH_ORDINAL = 719163
+
+# parameter grids smaller than this are run in full, without pruning, e.g. the default 3 x 3 grid of the dashboard
+SWEEP_MIN_GRID = 32
+# fractions of the backtest period the combinations are first evaluated on
+SWEEP_PREFIXES = (0.25, 0.5)
+# share of the combinations kept after each prefix
+SWEEP_KEEP = 0.5
+# combinations with a drawdown beyond this percentage on a prefix are pruned
+SWEEP_MAX_DRAWDOWN = 50
+# bars left to trade on a prefix once the rolling windows are filled
+SWEEP_MIN_TRADING_BARS = 60
+
 
 class PairTradingStrategy(bt.Strategy):
     params = dict(
@@ -104,100 +119,288 @@ class PairTradingStrategy(bt.Strategy):
             logger.info('==================================================')
 
 
-class SortinoRatio(bt.Analyzer):
+class _ValueRecorder(Analyzer):
+    """
+    Records the date and account value of every bar into preallocated NumPy arrays, so the metrics are computed once in
+    stop() rather than bar by bar.
+    """
+
+    def start(self):
+        super(_ValueRecorder, self).start()
+        # preloaded feeds know their length up front, the arrays only grow for feeds that do not
+        size = max(self.datas[0].buflen(), 1)
+        self.dates = np.empty(size)
+        self.values = np.empty(size)
+        self.first_len = None
+        self.n = 0
+        self.acct_start = self.strategy.broker.get_value()
+
+    def next(self):
+        super(_ValueRecorder, self).next()
+        if self.n == len(self.values):
+            self.dates = np.concatenate([self.dates, np.empty(len(self.dates))])
+            self.values = np.concatenate([self.values, np.empty(len(self.values))])
+        if self.first_len is None:
+            self.first_len = len(self.data)
+        self.dates[self.n] = self.datas[0].datetime[0]
+        self.values[self.n] = self.strategy.broker.getvalue()
+        self.n += 1
+
+    def stop(self):
+        super(_ValueRecorder, self).stop()
+        self.dates = self.dates[:self.n]
+        self.values = self.values[:self.n]
+
+    def get_values(self):
+        """
+        Account values from the starting cash to the last bar.
+        :rtype: np.ndarray
+        """
+        return np.concatenate([[self.acct_start], self.values])
+
+
+class SharpeRatio(_ValueRecorder):
+    """
+    Annualized Sharpe ratio of the daily returns of the account, same as bt.analyzers.SharpeRatio with the Days
+    timeframe, a factor of 252 and annualize=True, without its per-bar TimeReturn sub-analyzer.
+    """
+    params = {'riskfreerate': RISK_FREE_RATE}
+
+    def stop(self):
+        super(SharpeRatio, self).stop()
+        values = self.get_values()
+        ratio = get_sharpe_ratio(values[1:] / values[:-1] - 1, self.params.riskfreerate)
+        # None as backtrader when the returns do not vary, e.g. without any trade
+        self.rets = {'sharperatio': ratio if np.isfinite(ratio) else None}
+
+    def get_analysis(self):
+        return self.rets
+
+
+class DrawDown(_ValueRecorder):
+    """
+    Max drawdown of the account in percentage, as ['max']['drawdown'] of bt.analyzers.DrawDown.
+    """
+
+    def stop(self):
+        super(DrawDown, self).stop()
+        self.rets = {'max': {'drawdown': get_max_drawdown(self.get_values())}}
+
+    def get_analysis(self):
+        return self.rets
+
+
+class Returns(_ValueRecorder):
+    """
+    Annualized return of the account in percentage, as 'rnorm100' of bt.analyzers.Returns.
+    """
+
+    def stop(self):
+        super(Returns, self).stop()
+        values = self.get_values()
+        n = len(values) - 1
+        rnorm100 = (np.exp(np.log(values[-1] / values[0]) * ANNUAL_FACTOR / n) - 1) * 100 if n else np.nan
+        self.rets = {'rnorm100': rnorm100}
+
+    def get_analysis(self):
+        return self.rets
+
+
+class SortinoRatio(_ValueRecorder):
     """
     Computes the Sortino ratio metric for the whole account using the strategy, based on the R package
     PerformanceAnalytics SortinoRatio function
     """
     params = {"MAR": 0}  # Minimum Acceptable Return
 
-    def __init__(self):
-        self.acct_return = dict()
-        self.acct_last = self.strategy.broker.get_value()
+    def start(self):
+        super(SortinoRatio, self).start()
         self.sortinodict = dict()
 
-    def next(self):
-        if len(self.data) > 1:
-            # I use log returns
-            curdate = self.strategy.datetime.date(0)
-            self.acct_return[curdate] = np.log(self.strategy.broker.get_value()) - np.log(self.acct_last)
-            self.acct_last = self.strategy.broker.get_value()
-
     def stop(self):
-        srs = Series(self.acct_return)  # Need to pass a time-series-like object to SortinoRatio
-        srs.sort_index(inplace=True)
-
-        mean = srs.mean() * 252 - self.params.MAR
-        std_neg = srs[srs < 0].std() * np.sqrt(252)
-        self.sortinodict['sortinoratio'] = mean / std_neg
-        del self.acct_return
+        super(SortinoRatio, self).stop()
+        # log returns from the starting value, without the very first bar of the data
+        values = self.values[1:] if self.first_len == 1 else self.values
+        log_returns = np.diff(np.log(np.concatenate([[self.acct_start], values])))
+        self.sortinodict['sortinoratio'] = get_sortino_ratio(log_returns, self.params.MAR)
 
     def get_analysis(self):
         return self.sortinodict
 
 
-class TotalValue(Analyzer):
+class TotalValue(_ValueRecorder):
     """
     This analyzer will get total value from every next. 
     """
 
     params = ()
 
-    def start(self):
-        super(TotalValue, self).start()
-        self.rets = OrderedDict()
-
-    def next(self):
-        # Calculate the return
-        super(TotalValue, self).next()
-        self.rets[self.datas[0].datetime.datetime()] = self.strategy.broker.getvalue()
+    def stop(self):
+        super(TotalValue, self).stop()
+        self.rets = None
 
     def get_analysis(self):
+        # only the selected run of a grid is ever read, so the dict is built on first access
+        if self.rets is None:
+            # same as bt.num2date, days since 0001-01-01 rounded to the microsecond
+            dates = pd.to_datetime(np.round((self.dates - UNIX_EPOCH_ORDINAL) * 86400e6).astype(np.int64), unit='us')
+            self.rets = OrderedDict(zip(dates.to_pydatetime(), self.values.tolist()))
         return self.rets
 
 
+class NumpyData(bt.feed.DataBase):
+    """
+    OHLCV feed backed by contiguous NumPy arrays, built once from a DataFrame with the date as the index, in the same
+    layout as bt.feeds.PandasData. Preloading copies each whole array into its line buffer at once instead of going
+    through the DataFrame bar by bar, and as every run of an optimization preloads the feed again, the conversion to
+    backtrader dates and doubles is done once and only the copy is repeated.
+    """
+
+    def __init__(self):
+        df = self.p.dataname
+        # backtrader date numbers, i.e. days since 0001-01-01, as bt.date2num
+        dates = df.index.values.astype('datetime64[us]').astype(np.int64) / 86400e6 + UNIX_EPOCH_ORDINAL
+        self._arrays = {'datetime': np.ascontiguousarray(dates, dtype=np.float64)}
+        for name in self.getlinealiases():
+            if name in df.columns:
+                self._arrays[name] = np.ascontiguousarray(df[name].to_numpy(dtype=np.float64))
+
+    def start(self):
+        super(NumpyData, self).start()
+        self._idx = -1
+
+    def preload(self):
+        dates = self._arrays['datetime']
+        keep = (dates >= self.fromdate) & (dates <= self.todate)
+        nan = np.full(int(keep.sum()), np.nan)
+        for name in self.getlinealiases():
+            values = self._arrays.get(name)
+            values = values[keep] if values is not None else nan
+            getattr(self.lines, name).array.extend(array.array('d', values.tobytes()))
+
+        self._last()
+        self.home()
+
+    def _load(self):
+        # bar by bar, when not preloading
+        self._idx += 1
+        if self._idx >= len(self._arrays['datetime']):
+            return False
+        for name, values in self._arrays.items():
+            getattr(self.lines, name)[0] = values[self._idx]
+        return True
+
+
 def get_cerebro_and_data(stock1, stock2, start_date, end_date, ):
-    cerebro = bt.Cerebro()
     df1 = get_full_data_for_bt(stock1, start_date, end_date)
     df2 = get_full_data_for_bt(stock2, start_date, end_date)
 
-    data0 = bt.feeds.PandasData(dataname=df1, name=stock1)
-    data1 = bt.feeds.PandasData(dataname=df2, name=stock2)
+    return get_cerebro(stock1, stock2, df1, df2), df1, df2
+
+
+def get_cerebro(stock1, stock2, df1, df2):
+    cerebro = bt.Cerebro()
+    data0 = NumpyData(dataname=df1, name=stock1)
+    data1 = NumpyData(dataname=df2, name=stock2)
 
     cerebro.adddata(data0)
     cerebro.adddata(data1)
     cerebro.broker.setcash(1000000.0)
 
     cerebro.addsizer(bt.sizers.PercentSizer, percents=10)
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name="sharpe", timeframe=bt.TimeFrame.Days, compression=1,
-                        factor=252, annualize=True)
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name="drawdown")
-    cerebro.addanalyzer(bt.analyzers.Returns, _name="returns")
+    # all the metrics are computed once in stop() from the values recorded bar by bar
+    cerebro.addanalyzer(SharpeRatio, _name="sharpe")
+    cerebro.addanalyzer(DrawDown, _name="drawdown")
+    cerebro.addanalyzer(Returns, _name="returns")
     cerebro.addanalyzer(SortinoRatio, MAR=0.00004,
                         _name="sortino")  # Sortino ratio with risk-free rate of 0.004% daily (~1% annually)
     cerebro.addanalyzer(TotalValue, _name='totalvalue')
 
-    return cerebro, df1, df2
+    return cerebro
 
 
-def get_bt_results(stock1, stock2, start_date, end_date, params_range, params=None):
-    cerebro, df1, df2 = get_cerebro_and_data(stock1, stock2, start_date, end_date, )
+def get_strategy_metrics(strat):
+    """
+    Metrics of a finished run, as a row of the backtest result table.
+    """
+    return [strat.params.period, strat.params.zs,
+            strat.analyzers.returns.get_analysis()['rnorm100'],
+            strat.analyzers.drawdown.get_analysis()['max']['drawdown'],
+            strat.analyzers.sharpe.get_analysis()['sharperatio'],
+            strat.analyzers.sortino.get_analysis()['sortinoratio']]
 
-    cerebro.optstrategy(
-        PairTradingStrategy,
-        period=range(params_range['rp_min'], params_range['rp_max'] + 1, params_range['rp_step']),
-        zs=range(params_range['zs_min'], params_range['zs_max'] + 1, params_range['zs_step']),
 
-    )
+def run_combinations(stock1, stock2, df1, df2, combos):
+    """
+    Run the strategy with each of the parameter combinations.
+    :param combos: list of params dict, i.e. 'period' and 'zs'
+    :type combos: list
+    :return: finished strategies, in the order of combos
+    :rtype: list
+    """
+    cerebro = get_cerebro(stock1, stock2, df1, df2)
+    cerebro.optstrategy(PairTradingStrategy, params=combos)
+    return [x[0] for x in cerebro.run(maxcpus=1)]
+
+
+def sweep_combinations(stock1, stock2, df1, df2, combos, keep=None):
+    """
+    Successive halving over the parameter combinations: all of them are first run on a prefix of the backtest period,
+    those beyond the drawdown limit and the bottom half by Sharpe ratio are pruned, and the survivors are run again on a
+    longer prefix, up to the full period. Grids smaller than SWEEP_MIN_GRID are run in full.
+    :param combos: list of params dict, i.e. 'period' and 'zs'
+    :type combos: list
+    :param keep: position of a combination never pruned
+    :type keep: int
+    :return: position in combos to the strategy run on the full period, for the combinations not pruned
+    :rtype: dict
+    """
+    survivors = list(range(len(combos)))
+    # the prefix must leave bars to trade once the rolling windows are filled
+    min_bars = 2 * max(c['period'] for c in combos) + SWEEP_MIN_TRADING_BARS
+
+    if len(combos) >= SWEEP_MIN_GRID:
+        for frac in SWEEP_PREFIXES:
+            n = int(len(df1) * frac)
+            if n < min_bars or len(survivors) < SWEEP_MIN_GRID:
+                continue
+            cut = df1.index[n - 1]
+            results = run_combinations(stock1, stock2, df1.loc[:cut], df2.loc[:cut], [combos[i] for i in survivors])
+
+            ranked = []
+            for i, strat in zip(survivors, results):
+                ret, drawdown, sharpe, sortino = get_strategy_metrics(strat)[2:]
+                if drawdown > SWEEP_MAX_DRAWDOWN and i != keep:
+                    continue
+                # runs without a Sharpe ratio, None or NaN e.g. with no trade yet, rank last
+                valid = sharpe is not None and not np.isnan(sharpe)
+                ranked.append((valid, sharpe if valid else 0, i))
+            ranked.sort(reverse=True)
+
+            n_run = len(survivors)
+            survivors = {i for _, _, i in ranked[:max(int(np.ceil(n_run * SWEEP_KEEP)), 1)]}
+            survivors = sorted(survivors | ({keep} if keep is not None else set()))
+            logger.info(f'Sweep of {stock1} - {stock2} kept {len(survivors)} of {n_run} combinations after '
+                        f'{n} bars.')
+
+    results = run_combinations(stock1, stock2, df1, df2, [combos[i] for i in survivors])
+    return dict(zip(survivors, results))
 
-    results = cerebro.run(maxcpus=1)
 
-    par_list = [[x[0].params.period, x[0].params.zs,
-                 x[0].analyzers.returns.get_analysis()['rnorm100'],
-                 x[0].analyzers.drawdown.get_analysis()['max']['drawdown'],
-                 x[0].analyzers.sharpe.get_analysis()['sharperatio'],
-                 x[0].analyzers.sortino.get_analysis()['sortinoratio']
-                 ] for x in results]
+def get_bt_results(stock1, stock2, start_date, end_date, params_range, params=None):
+    df1 = get_full_data_for_bt(stock1, start_date, end_date)
+    df2 = get_full_data_for_bt(stock2, start_date, end_date)
+
+    combos = [{'period': period, 'zs': zs}
+              for period in range(params_range['rp_min'], params_range['rp_max'] + 1, params_range['rp_step'])
+              for zs in range(params_range['zs_min'], params_range['zs_max'] + 1, params_range['zs_step'])]
+    selected = [i for i, c in enumerate(combos) if c['period'] == params['period'] and c['zs'] == params['zs']]
+
+    results = sweep_combinations(stock1, stock2, df1, df2, combos, keep=selected[0] if selected else None)
+
+    # pruned combinations keep their row, without metrics
+    par_list = [get_strategy_metrics(results[i]) if i in results else [c['period'], c['zs']] + [np.nan] * 4
+                for i, c in enumerate(combos)]
 
     total_df = pd.DataFrame(par_list, columns=['Rolling Period', 'ZS Limit', 'Return', 'MaxDrawdown', 'SharpeRatio',
                                                'SortinoRatio'])
@@ -207,26 +410,39 @@ def get_bt_results(stock1, stock2, start_date, end_date, params_range, params=No
     par_df.reset_index().drop(['index', 'Rolling Period', 'ZS Limit'], axis=1)
     total_df = total_df.sort_values('SharpeRatio', ascending=False).reset_index().drop(['index'], axis=1)
 
-    df_tv = pd.DataFrame([results[idx][0].analyzers.totalvalue.get_analysis()]).T
+    df_tv = pd.DataFrame([results[idx].analyzers.totalvalue.get_analysis()]).T
     df_tv.columns = ['Total_Value']
 
     df_ols = pd.DataFrame()
     df_ols[stock1] = df1['close']
     df_ols[stock2] = df2['close']
-    df_ols['Corr'] = df_ols[stock1].rolling(params['period']).corr(df_ols[stock2])
+    df_ols['Corr'] = get_pair_rolling_corr(stock1, stock2, df_ols[stock1], df_ols[stock2], params['period'],
+                                           windows=range(params_range['rp_min'], params_range['rp_max'] + 1,
+                                                         params_range['rp_step']))
 
-    plot_sub = strategy_plot(df_ols, df_tv, start_date, end_date, params['period'])
+    plot_sub = get_cached_figure(('strategy_plot', stock1, stock2, start_date, end_date, params['period'], params['zs']),
+                                 strategy_plot, df_ols, df_tv, start_date, end_date, params['period'])
 
     return par_df, plot_sub, total_df
 
 
-def get_bt_html_plot(stock1, stock2, start_date, end_date, params=None):
+def get_bt_trade_figure(stock1, stock2, start_date, end_date, params=None):
+    # only needed once the trade details are opened
+    from backtrader_plotly.plotter import BacktraderPlotly
+
     cerebro, df1, df2 = get_cerebro_and_data(stock1, stock2, start_date, end_date, )
     cerebro.addstrategy(PairTradingStrategy, params)
     results = cerebro.run(maxcpus=1)
 
     figs = cerebro.plot(BacktraderPlotly(show=False, ), )
-    # we just run one strategy, save the html of the plot to a variable
-    plot_html = plotly.io.to_html(figs[0][0], full_html=False)
+    # we just run one strategy
+    return figs[0][0]
+
 
-    return plot_html
+def get_bt_trade_plot(stock1, stock2, start_date, end_date, params=None):
+    """
+    Trade details plot of the strategy as figure JSON, cached by pair, dates and parameters.
+    :rtype: dict
+    """
+    plot_key = ('trade_plot', stock1, stock2, start_date, end_date, params['period'], params['zs'])
+    return get_cached_figure(plot_key, get_bt_trade_figure, stock1, stock2, start_date, end_date, params)
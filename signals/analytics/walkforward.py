@@ -0,0 +1,168 @@
+"""
+Walk-forward out-of-sample validation of the pair trading strategy.
+
+Each fold selects the top pairs by correlation on a training window, picks the strategy parameters with the best
+in-sample Sharpe ratio on those pairs, and backtests them on the following test window. The windows then roll forward
+by the length of the test window, so the test windows chain into one out-of-sample account value curve.
+
+Folds run in parallel processes, all reading the prices from the shared memory-mapped panels, so overlapping training
+windows never load the same data twice.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from signals.analytics.performance import get_performance_stats
+from signals.analytics.portfolio import PORTFOLIO_CASH, get_top_pairs, run_portfolio_backtest
+from signals.data.panel import get_panel_data
+from signals.utils.dashlogger import logger
+
+WALK_FORWARD_WORKERS = max((os.cpu_count() or 1) - 1, 1)
+WALK_FORWARD_TRAIN_MONTHS = 12
+WALK_FORWARD_TEST_MONTHS = 3
+
+
+def get_walk_forward_folds(start_date, end_date, train_months=WALK_FORWARD_TRAIN_MONTHS,
+                           test_months=WALK_FORWARD_TEST_MONTHS):
+    """
+    Rolling (train_start, train_end, test_start, test_end) windows between the dates.
+    :return: list of folds, dates as '%Y-%m-%d'
+    :rtype: list
+    """
+    folds = []
+    train_start, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    while True:
+        test_start = train_start + pd.DateOffset(months=train_months)
+        if test_start > end_date:
+            break
+        test_end = min(test_start + pd.DateOffset(months=test_months) - pd.Timedelta(days=1), end_date)
+        folds.append(tuple(d.strftime('%Y-%m-%d') for d in
+                           [train_start, test_start - pd.Timedelta(days=1), test_start, test_end]))
+        train_start += pd.DateOffset(months=test_months)
+    return folds
+
+
+def get_params_grid(params_range):
+    """
+    Parameter combinations of the ranges, as given to get_bt_results.
+    :rtype: list
+    """
+    return [{'period': period, 'zs': zs}
+            for period in range(params_range['rp_min'], params_range['rp_max'] + 1, params_range['rp_step'])
+            for zs in range(params_range['zs_min'], params_range['zs_max'] + 1, params_range['zs_step'])]
+
+
+def run_fold(fold, method, topn, params_grid):
+    """
+    Select the pairs and parameters on the training window and backtest them on the test window.
+    :param fold: (train_start, train_end, test_start, test_end)
+    :type fold: tuple
+    :param method: correlation method selecting the pairs
+    :type method: str
+    :param topn: number of pairs
+    :type topn: int
+    :param params_grid: parameter combinations
+    :type params_grid: list
+    :return: fold results and the account value curve of the test window
+    :rtype: dict, pd.DataFrame
+    """
+    train_start, train_end, test_start, test_end = fold
+    pairs = get_top_pairs(train_start, train_end, method, topn)
+    close = get_panel_data('close', sorted({t for p in pairs for t in p}), train_start, test_end).astype(np.float64)
+
+    sharpes = []
+    for params in params_grid:
+        stats_df, _, _ = run_portfolio_backtest(pairs, train_start, train_end, params, close=close)
+        sharpes.append(stats_df['SharpeRatio'].iloc[0] if len(stats_df) else np.nan)
+    sharpes = np.array(sharpes, dtype=float)
+    # combinations without a Sharpe ratio, e.g. without any trade, are only selected if none has one
+    i = 0 if np.isnan(sharpes).all() else int(np.nanargmax(sharpes))
+    best, best_sharpe = params_grid[i], sharpes[i]
+
+    # the training window warms up the z-scores of the test window
+    stats_df, _, df_tv = run_portfolio_backtest(pairs, train_start, test_end, best, close=close, trade_start=test_start)
+
+    res = {'Train Start': train_start, 'Train End': train_end, 'Test Start': test_start, 'Test End': test_end,
+           'Pairs': len(pairs), 'Rolling Period': best['period'], 'ZS Limit': best['zs'],
+           'In-Sample SharpeRatio': best_sharpe}
+    res |= stats_df.drop('Pairs', axis=1).iloc[0].to_dict() if len(stats_df) else {}
+    return res, df_tv
+
+
+def run_walk_forward(start_date, end_date, method, topn, params_range, train_months=WALK_FORWARD_TRAIN_MONTHS,
+                     test_months=WALK_FORWARD_TEST_MONTHS, workers=WALK_FORWARD_WORKERS):
+    """
+    Run all the folds between the dates and aggregate their out-of-sample results.
+    :param start_date: start date of the first training window
+    :type start_date: str
+    :param end_date: end date of the last test window
+    :type end_date: str
+    :param method: correlation method selecting the pairs
+    :type method: str
+    :param topn: number of pairs per fold
+    :type topn: int
+    :param params_range: ranges of the strategy parameters, as given to get_bt_results
+    :type params_range: dict
+    :param train_months: length of the training windows
+    :type train_months: int
+    :param test_months: length of the test windows, and the step between folds
+    :type test_months: int
+    :param workers: number of processes, folds run in this process if 1
+    :type workers: int
+    :return: results per fold, aggregated out-of-sample metrics and the chained account value curve
+    :rtype: pd.DataFrame, pd.DataFrame, pd.DataFrame
+    """
+    t1 = time.time()
+    folds = get_walk_forward_folds(start_date, end_date, train_months, test_months)
+    if not folds:
+        logger.warn('The period is too short for a walk-forward, please check your inputs.')
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+    args = [(fold, method, topn, get_params_grid(params_range)) for fold in folds]
+    if workers > 1 and len(folds) > 1:
+        # spawned processes open their own database connections, forked ones would share the parent's
+        with ProcessPoolExecutor(min(workers, len(folds)), mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(run_fold, *zip(*args)))
+    else:
+        results = [run_fold(*a) for a in args]
+
+    folds_df = pd.DataFrame([res for res, df_tv in results])
+
+    # chain the daily returns of the test windows into one curve, each window starts flat at its first bar
+    returns = pd.concat([df_tv['Total_Value'].pct_change().fillna(0) for res, df_tv in results if len(df_tv)])
+    df_tv = pd.DataFrame({'Total_Value': PORTFOLIO_CASH * (1 + returns).cumprod()})
+
+    summary_df = pd.DataFrame([{'Folds': len(folds_df)} | get_performance_stats(df_tv['Total_Value'].values) | {
+        'Profitable Folds': (folds_df['Return'] > 0).mean() * 100 if 'Return' in folds_df else np.nan,
+        'In-Sample SharpeRatio': folds_df['In-Sample SharpeRatio'].mean(),
+    }])
+
+    logger.info('Total time used in walk-forward: ' + '%0.2f' % (time.time() - t1) + ' seconds.')
+    return folds_df, summary_df, df_tv
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Walk-forward validation of the pair trading strategy.')
+    parser.add_argument('--start-date', required=True)
+    parser.add_argument('--end-date', required=True)
+    parser.add_argument('--method', default='pearson')
+    parser.add_argument('--topn', type=int, default=10)
+    parser.add_argument('--rp', default='50,150,50', help='rolling period min,max,step')
+    parser.add_argument('--zs', default='1,3,1', help='z-score limit min,max,step')
+    parser.add_argument('--train-months', type=int, default=WALK_FORWARD_TRAIN_MONTHS)
+    parser.add_argument('--test-months', type=int, default=WALK_FORWARD_TEST_MONTHS)
+    parser.add_argument('--workers', type=int, default=WALK_FORWARD_WORKERS)
+    args = parser.parse_args()
+
+    rp, zs = [int(v) for v in args.rp.split(',')], [int(v) for v in args.zs.split(',')]
+    folds_df, summary_df, df_tv = run_walk_forward(
+        args.start_date, args.end_date, args.method, args.topn,
+        {'rp_min': rp[0], 'rp_max': rp[1], 'rp_step': rp[2], 'zs_min': zs[0], 'zs_max': zs[1], 'zs_step': zs[2]},
+        args.train_months, args.test_months, args.workers)
+    print(folds_df.to_string())
+    print(summary_df.to_string())
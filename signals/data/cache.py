@@ -0,0 +1,184 @@
+"""
+Range-aware cache of the daily data queries.
+
+Fetched data is kept as blocks, each covering a date range for a set of tickers of one collection. A request inside a
+block is sliced from it, a request for tickers of a block over a wider range only fetches the missing dates, and a
+request over the dates of a block for a few more tickers only fetches those tickers. Blocks are evicted least recently
+used first once the cache holds more than CACHE_MAX_BYTES, and everything is dropped when the data version changes.
+"""
+import datetime as dt
+import threading
+import time
+
+import pandas as pd
+
+from signals.utils.dashlogger import logger
+
+CACHE_MAX_BYTES = 512 * 1024 ** 2
+# seconds between two checks of the data version
+VERSION_CHECK_INTERVAL = 30
+# missing tickers are added to a block only if the block range is at most this many times the requested range,
+# otherwise they would be fetched over far more dates than needed
+MAX_TICKER_DELTA_SPAN = 2
+# likewise, missing dates are added to a block only if it has at most this many times the requested tickers
+MAX_DATE_DELTA_WIDTH = 4
+# dates are stored to the millisecond, the bounds of a date delta exclude the block bounds by that much
+_MS = dt.timedelta(milliseconds=1)
+
+
+class _Block:
+
+    def __init__(self, start_dt, end_dt, tickers, df):
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        # tickers requested, those without any data are not in the columns of df
+        self.tickers = set(tickers)
+        self.df = df
+        self.last_used = time.time()
+
+    @property
+    def nbytes(self):
+        return int(self.df.memory_usage(index=True, deep=False).sum())
+
+    def covers(self, start_dt, end_dt):
+        return self.start_dt <= start_dt and end_dt <= self.end_dt
+
+    def slice(self, symbols, start_dt, end_dt):
+        self.last_used = time.time()
+        df = self.df.loc[start_dt:end_dt]
+        return df[[s for s in symbols if s in df.columns]].copy()
+
+
+class QueryCache:
+    """
+    Blocks of fetched data per collection, see the module docstring.
+    :param fetch: function(col, symbols, start_dt, end_dt) reading the database, Date as the index
+    :type fetch: callable
+    :param get_version: function returning the current data version
+    :type get_version: callable
+    """
+
+    def __init__(self, fetch, get_version, max_bytes=CACHE_MAX_BYTES):
+        self.fetch = fetch
+        self.get_version = get_version
+        self.max_bytes = max_bytes
+        self.blocks = {}
+        self.version = None
+        self.version_checked = 0
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.blocks = {}
+            self.version = None
+            self.version_checked = 0
+
+    def _check_version(self):
+        now = time.time()
+        if now - self.version_checked < VERSION_CHECK_INTERVAL:
+            return
+        version = self.get_version()
+        with self.lock:
+            if version != self.version:
+                if self.version is not None:
+                    logger.info('Data version changed, query cache cleared.')
+                self.blocks = {}
+                self.version = version
+            self.version_checked = now
+
+    def _fetch(self, col, symbols, start_dt, end_dt):
+        df = self.fetch(col, list(symbols), start_dt, end_dt)
+        return df.sort_index() if not df.empty else df
+
+    def get(self, col, symbols, start_dt, end_dt):
+        """
+        Data of the tickers between the dates, fetching only what is not cached.
+        :param col: The name of the collections, i.e. 'close', 'return'
+        :type col: str
+        :param symbols: tickers of indexes and stocks
+        :type symbols: list
+        :param start_dt: start date
+        :type start_dt: dt.datetime
+        :param end_dt: end date
+        :type end_dt: dt.datetime
+        :return: the corresponding data
+        :rtype: pd.DataFrame
+        """
+        self._check_version()
+        wanted = set(symbols)
+        with self.lock:
+            blocks = list(self.blocks.get(col, []))
+
+        # a block holding everything
+        for block in blocks:
+            if block.covers(start_dt, end_dt) and wanted <= block.tickers:
+                return block.slice(symbols, start_dt, end_dt)
+
+        block = self._extend_dates(col, blocks, wanted, start_dt, end_dt) or \
+            self._extend_tickers(col, blocks, wanted, start_dt, end_dt)
+        if block is None:
+            block = _Block(start_dt, end_dt, wanted, self._fetch(col, symbols, start_dt, end_dt))
+            self._swap(col, None, block)
+
+        self._evict()
+        return block.slice(symbols, start_dt, end_dt)
+
+    def _swap(self, col, old, new):
+        # blocks are never modified once cached, an extension replaces its block by a new one, so that two concurrent
+        # extensions of a block both end up cached whole rather than one losing the rows of the other
+        with self.lock:
+            blocks = self.blocks.setdefault(col, [])
+            if old is not None and old in blocks:
+                blocks[blocks.index(old)] = new
+            else:
+                blocks.append(new)
+
+    def _extend_dates(self, col, blocks, wanted, start_dt, end_dt):
+        # the tickers are in a block overlapping the dates, fetch the dates before and after it
+        overlapping = [b for b in blocks if wanted <= b.tickers and b.start_dt <= end_dt and start_dt <= b.end_dt
+                       and len(b.tickers) <= MAX_DATE_DELTA_WIDTH * len(wanted)]
+        if not overlapping:
+            return None
+        block = min(overlapping, key=lambda b: len(b.tickers))
+
+        parts = [block.df]
+        if start_dt < block.start_dt:
+            parts.append(self._fetch(col, block.tickers, start_dt, block.start_dt - _MS))
+        if block.end_dt < end_dt:
+            parts.append(self._fetch(col, block.tickers, block.end_dt + _MS, end_dt))
+        df = pd.concat([p for p in parts if not p.empty]) if any(not p.empty for p in parts) else block.df
+
+        extended = _Block(min(block.start_dt, start_dt), max(block.end_dt, end_dt), block.tickers, df.sort_index())
+        self._swap(col, block, extended)
+        return extended
+
+    def _extend_tickers(self, col, blocks, wanted, start_dt, end_dt):
+        # the dates are in a block, fetch the missing tickers over its range unless it is much wider than requested
+        span = (end_dt - start_dt) * MAX_TICKER_DELTA_SPAN
+        covering = [b for b in blocks if b.covers(start_dt, end_dt) and b.end_dt - b.start_dt <= span]
+        if not covering:
+            return None
+        block = max(covering, key=lambda b: len(wanted & b.tickers))
+
+        missing = sorted(wanted - block.tickers)
+        delta = self._fetch(col, missing, block.start_dt, block.end_dt)
+
+        df = block.df
+        if not delta.empty:
+            df = df.join(delta, how='outer') if not df.empty else delta
+        extended = _Block(block.start_dt, block.end_dt, block.tickers | set(missing), df)
+        self._swap(col, block, extended)
+        return extended
+
+    def _evict(self):
+        with self.lock:
+            all_blocks = [(b.last_used, col, b) for col, blocks in self.blocks.items() for b in blocks]
+            total = sum(b.nbytes for _, _, b in all_blocks)
+            n_left = len(all_blocks)
+            # the most recently used block is always kept
+            for _, col, block in sorted(all_blocks, key=lambda x: x[0]):
+                if total <= self.max_bytes or n_left == 1:
+                    break
+                self.blocks[col].remove(block)
+                total -= block.nbytes
+                n_left -= 1
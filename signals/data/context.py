@@ -0,0 +1,109 @@
+"""Data shared by the computations of one dashboard interaction, and the thread pool running them."""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+from signals.data.panel import get_data_version, get_panel_data
+from signals.utils.datahelper import INDEX_COMP
+
+# seconds a context is kept after its last use, long enough to span the callbacks fired by one interaction
+CONTEXT_TTL = 120
+# number of contexts kept
+CONTEXT_MAX = 8
+# threads running independent computations, NumPy and BLAS release the GIL in the heavy parts
+POOL_WORKERS = 4
+
+POOL = ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix='signals')
+
+_CONTEXTS = OrderedDict()
+_LOCK = threading.Lock()
+
+
+class IndexContext:
+    """
+    Returns of an index and all its components over a date range. They are read once, by whichever computation needs
+    them first, and every other computation of the same interaction waits for that read and slices it.
+    """
+
+    def __init__(self, index_value, start_date, end_date):
+        self.index_value = index_value
+        self.start_date = start_date
+        self.end_date = end_date
+        # the single read of the whole index, set by the first caller of load()
+        self.future = None
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Returns of the index and all its components. The first caller reads them, concurrent callers wait for it.
+        :rtype: pd.DataFrame
+        """
+        self.last_used = time.time()
+        with self.lock:
+            future, owner = self.future, self.future is None
+            if owner:
+                self.future = future = Future()
+        if owner:
+            try:
+                future.set_result(get_panel_data('return', [self.index_value] + INDEX_COMP.get(self.index_value, []),
+                                                 self.start_date, self.end_date))
+            except Exception as e:
+                future.set_exception(e)
+                # a later call reads again
+                with self.lock:
+                    self.future = None
+        return future.result()
+
+    def get(self, symbols):
+        """
+        Returns of the given tickers, sliced from the returns of the whole index if they are read or being read, read
+        on their own otherwise, so that a few picked tickers do not load the index universe. Those outside of the index
+        are read separately.
+        :param symbols: tickers of indexes and stocks
+        :type symbols: list
+        :rtype: pd.DataFrame
+        """
+        self.last_used = time.time()
+        future = self.future
+        if future is None:
+            return get_panel_data('return', symbols, self.start_date, self.end_date)
+        df = future.result()
+        missing = [s for s in symbols if s not in df.columns]
+        if missing:
+            df = pd.concat([df, get_panel_data('return', missing, self.start_date, self.end_date)], axis=1)
+        return df[[s for s in symbols if s in df.columns]]
+
+
+def get_index_context(index_value, start_date, end_date):
+    """
+    The context of the index and date range, created if it does not exist, has expired or the data has been updated
+    since.
+    :rtype: IndexContext
+    """
+    key = (index_value, start_date, end_date, get_data_version())
+    now = time.time()
+    with _LOCK:
+        for k in [k for k, ctx in _CONTEXTS.items() if now - ctx.last_used > CONTEXT_TTL]:
+            del _CONTEXTS[k]
+        if key not in _CONTEXTS:
+            _CONTEXTS[key] = IndexContext(index_value, start_date, end_date)
+            if len(_CONTEXTS) > CONTEXT_MAX:
+                _CONTEXTS.popitem(last=False)
+        _CONTEXTS.move_to_end(key)
+        return _CONTEXTS[key]
+
+
+def run_parallel(*calls):
+    """
+    Run independent calls on the thread pool and wait for all of them.
+    :param calls: (function, args) tuples
+    :type calls: tuple
+    :return: results, in the order of the calls
+    :rtype: list
+    """
+    futures = [POOL.submit(fn, *args) for fn, args in calls]
+    return [f.result() for f in futures]
@@ -1,18 +1,38 @@
 """Data set-up"""
 import datetime as dt
+import time
 
+import bson
 import numpy as np
 import pandas as pd
 import pymongo
-import yfinance as yf
 
+from config import MONGO_URI
+from signals.data.cache import VERSION_CHECK_INTERVAL, QueryCache
+from signals.data.memorydb import MEMORY_URI_SCHEME, get_memory_client
+from signals.data.schema import create_date_index, get_bucketed_data, get_field_names, is_bucketed, plan_query, \
+    rebuild_buckets
 from signals.utils.dashlogger import logger
 
-MCLIENT = pymongo.MongoClient("mongodb://localhost:27017/")
+MCLIENT = get_memory_client() if MONGO_URI.startswith(MEMORY_URI_SCHEME) else pymongo.MongoClient(MONGO_URI)
 DB_STOCK = MCLIENT['stock_prices']
 COLLECTION_CLOSE = DB_STOCK['close']
 COLLECTION_LAST_UPDATE = DB_STOCK['last_update']
 COLLECTION_RETURN = DB_STOCK['return']
+# the returns are rebuilt here, then swapped in for 'return' in one step
+COLLECTION_RETURN_STAGING = DB_STOCK['return_staging']
+
+# data version last read from the database, and when
+_DATA_VERSION = {'version': '', 'checked': 0.0}
+
+# number of documents per round trip when streaming a collection
+CURSOR_BATCH_SIZE = 1000
+# number of dates per chunk for consumers processing the history chunk by chunk
+CHUNK_SIZE = 500
+
+# pymongoarrow, optional, decodes BSON batches straight into Arrow buffers. Imported on the first read as it pulls in
+# pyarrow, False if it is not installed
+_ARROW_API = None
 
 
 def update_price_data(symbols, col, start_date, end_date):
@@ -30,6 +50,9 @@ def update_price_data(symbols, col, start_date, end_date):
     :rtype: str
     """
 
+    # only needed by the data refresh, not by the dashboards
+    import yfinance as yf
+
     df = pd.DataFrame()
 
     close_col = DB_STOCK[col]
@@ -60,8 +83,12 @@ def update_price_data(symbols, col, start_date, end_date):
         else:
             close_col.insert_many(new_data.to_dict(orient='records'))
 
+        if is_bucketed(DB_STOCK, col):
+            rebuild_buckets(DB_STOCK, col, symbols, sorted(set(new_data['Date'].dt.year)))
+
         # only update the info if end_date is newer
         COLLECTION_LAST_UPDATE.update_many({'last_update': {'$lt': end_date}}, {"$set": {'last_update': end_date}})
+        QUERY_CACHE.clear()
 
         return 'Data successfully saved.'
 
@@ -77,13 +104,38 @@ def update_return_data():
     :return: function finished message
     :rtype: str
     """
-    close_data = get_df_from_collection(COLLECTION_CLOSE)
-
-    log_returns = np.log(close_data) - np.log(close_data.shift(1))
-    log_returns = log_returns.reset_index()
     try:
-        COLLECTION_RETURN.delete_many({})
-        COLLECTION_RETURN.insert_many(log_returns.to_dict(orient='records'))
+        # readers keep the previous returns until the new ones are complete, a failure leaves them untouched
+        COLLECTION_RETURN_STAGING.drop()
+        create_date_index(COLLECTION_RETURN_STAGING)
+
+        # every document holds every ticker, NaN where there is no price, whatever the tickers of its chunk
+        tickers = get_field_names(COLLECTION_CLOSE)
+
+        # the close history is processed chunk by chunk, carrying over the last row for the first return of a chunk
+        last_log_close = None
+        for close_data in iter_df_chunks(COLLECTION_CLOSE):
+            log_close = np.log(close_data.reindex(columns=tickers))
+            prev_log_close = log_close.shift(1)
+            if last_log_close is not None:
+                prev_log_close.iloc[0] = last_log_close
+            last_log_close = log_close.iloc[-1]
+
+            log_returns = (log_close - prev_log_close).reset_index()
+            COLLECTION_RETURN_STAGING.insert_many(log_returns.to_dict(orient='records'))
+
+        COLLECTION_RETURN_STAGING.rename(COLLECTION_RETURN.name, dropTarget=True)
+
+        if is_bucketed(DB_STOCK, 'return'):
+            rebuild_buckets(DB_STOCK, 'return')
+        # prices and returns are consistent again, the caches of every worker refill from here on
+        set_data_version()
+        QUERY_CACHE.clear()
+
+        # refresh the shared panels the dashboards read from
+        from signals.data.panel import build_panels
+        build_panels()
+
         return 'Data successfully saved.'
 
     except Exception as e:
@@ -92,7 +144,8 @@ def update_return_data():
 
 def get_daily_data(col, symbols, start_date, end_date):
     """
-    Function to fetch the data from database, given the inputs.
+    Function to fetch the data from database, given the inputs. Served from the query cache when the dates and tickers
+    have already been fetched, only the missing ones are read otherwise.
     :param col: The name of the collections, i.e. 'close', 'return'
     :type col: str
     :param symbols: tickers of indexes and stocks
@@ -104,9 +157,32 @@ def get_daily_data(col, symbols, start_date, end_date):
     :return: the corresponding data
     :rtype: pd.DataFrame
     """
+    start_dt = dt.datetime.strptime(start_date, '%Y-%m-%d')
+    end_dt = dt.datetime.strptime(end_date, '%Y-%m-%d')
+    return QUERY_CACHE.get(col, symbols, start_dt, end_dt)
+
+
+def fetch_daily_data(col, symbols, start_dt, end_dt):
+    """
+    Read the data from database, bypassing the query cache.
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    :param symbols: tickers of indexes and stocks
+    :type symbols: list
+    :param start_dt: start date
+    :type start_dt: dt.datetime
+    :param end_dt: end date
+    :type end_dt: dt.datetime
+    :return: the corresponding data
+    :rtype: pd.DataFrame
+    """
     collection = DB_STOCK[col]
-    query = {'Date': {'$gte': dt.datetime.strptime(start_date, '%Y-%m-%d'),
-                      '$lte': dt.datetime.strptime(end_date, '%Y-%m-%d')}}
+
+    # narrow requests over long ranges are cheaper from the bucketed copy, if it has been built
+    if plan_query(DB_STOCK, col, symbols, start_dt, end_dt, get_data_version()) == 'bucket':
+        return get_bucketed_data(DB_STOCK, col, symbols, start_dt, end_dt)
+
+    query = {'Date': {'$gte': start_dt, '$lte': end_dt}}
 
     projection = {'Date': 1} | {s: 1 for s in symbols}
 
@@ -114,9 +190,175 @@ def get_daily_data(col, symbols, start_date, end_date):
     return df
 
 
-def get_df_from_collection(collection, query={}, projection={}):
+def get_last_update():
+    """
+    The 'last_update' value saved along with the prices, i.e. the end date of the last price update.
+    :rtype: str
+    """
+    doc = COLLECTION_LAST_UPDATE.find_one({}, {'_id': 0, 'last_update': 1})
+    return str(doc['last_update']) if doc else ''
+
+
+def read_data_version():
+    """
+    The data version token, stamped once the returns are rebuilt from the updated prices, so that no cache is filled
+    between the price update and the rebuild. The 'last_update' value for data saved before the token existed.
+    :return: data version
+    :rtype: str
+    """
+    doc = COLLECTION_LAST_UPDATE.find_one({}, {'_id': 0, 'last_update': 1, 'data_version': 1})
+    if not doc:
+        return ''
+    return str(doc.get('data_version') or doc.get('last_update', ''))
+
+
+def get_data_version():
+    """
+    The data version token, read from the database at most once per VERSION_CHECK_INTERVAL, as every cache lookup
+    asks for it.
+    :return: data version
+    :rtype: str
     """
-    Function to transfer cursor to DataFrame, with Date as the index
+    now = time.time()
+    if now - _DATA_VERSION['checked'] >= VERSION_CHECK_INTERVAL:
+        version = read_data_version()
+        # an empty database is not remembered, its data may be loaded any moment
+        _DATA_VERSION.update(version=version, checked=now if version else 0.0)
+        return version
+    return _DATA_VERSION['version']
+
+
+def set_data_version():
+    """
+    Stamp a new data version token, invalidating the query caches, panels and stored results of every worker.
+    :return: data version
+    :rtype: str
+    """
+    version = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+    COLLECTION_LAST_UPDATE.update_one({}, {'$set': {'data_version': version}}, upsert=True)
+    _DATA_VERSION.update(version=version, checked=time.time())
+    return version
+
+
+QUERY_CACHE = QueryCache(fetch_daily_data, read_data_version)
+
+
+class _ColumnBuilder:
+    """
+    Collects decoded documents straight into preallocated NumPy columns, one float column per field, so that no list
+    of documents for the whole cursor is ever held in memory.
+    """
+
+    def __init__(self, size, fields=()):
+        self.size = max(size, 1)
+        self.n = 0
+        self.dates = np.empty(self.size, dtype='datetime64[ms]')
+        self.columns = {f: np.full(self.size, np.nan) for f in fields}
+        self.seen = set()
+
+    def _grow(self, size):
+        self.dates = np.concatenate([self.dates, np.empty(size - self.size, dtype='datetime64[ms]')])
+        for f, values in self.columns.items():
+            self.columns[f] = np.concatenate([values, np.full(size - self.size, np.nan)])
+        self.size = size
+
+    def add(self, docs):
+        i0, i1 = self.n, self.n + len(docs)
+        if i1 > self.size:
+            # more documents than counted, e.g. inserted while reading
+            self._grow(max(i1, 2 * self.size))
+
+        self.dates[i0:i1] = [d['Date'] for d in docs]
+        # fields not in the projection, i.e. when reading the full collection, are discovered batch by batch
+        for d in docs:
+            self.seen.update(d.keys())
+        for f in self.seen - self.columns.keys() - {'Date', '_id'}:
+            self.columns[f] = np.full(self.size, np.nan)
+        for f, values in self.columns.items():
+            values[i0:i1] = np.array([d.get(f) for d in docs], dtype=float)
+        self.n = i1
+
+    def to_frame(self):
+        index = pd.DatetimeIndex(self.dates[:self.n].astype('datetime64[ns]'), name='Date')
+        # as with building the frame from the documents, fields missing from every document are not returned
+        return pd.DataFrame({f: values[:self.n] for f, values in self.columns.items() if f in self.seen}, index=index)
+
+
+def _get_fields(projection):
+    return [f for f, v in projection.items() if v and f not in ('Date', '_id')]
+
+
+def _server_projection(projection):
+    # _id is never used, skip it at the server
+    return projection | {'_id': 0} if projection else {'_id': 0}
+
+
+def iter_doc_batches(collection, query={}, projection={}, batch_size=CURSOR_BATCH_SIZE, sort=None):
+    """
+    Consume the cursor as raw BSON batches, yielding the decoded documents of one batch at a time.
+    :param collection:
+    :type collection: pymongo.collection.Collection
+    :param query:
+    :type query: dict
+    :param projection:
+    :type projection: dict
+    :param batch_size: number of documents per round trip
+    :type batch_size: int
+    :param sort: optional sort spec, e.g. [('Date', 1)]
+    :type sort: list
+    :return: documents of a batch
+    :rtype: generator
+    """
+    cursor = collection.find_raw_batches(query, _server_projection(projection), batch_size=batch_size)
+    if sort:
+        cursor = cursor.sort(sort)
+    for raw in cursor:
+        yield bson.decode_all(raw)
+
+
+def _get_arrow_api():
+    """
+    pyarrow and the pymongoarrow functions, imported on first use.
+    :return: (pyarrow, Schema, find_arrow_all), False if pymongoarrow is not installed
+    :rtype: tuple
+    """
+    global _ARROW_API
+    if _ARROW_API is None:
+        try:
+            import pyarrow as pa
+            from pymongoarrow.api import Schema, find_arrow_all
+            _ARROW_API = (pa, Schema, find_arrow_all)
+        except ImportError:
+            _ARROW_API = False
+    return _ARROW_API
+
+
+def get_arrow_df(collection, query, projection, batch_size=CURSOR_BATCH_SIZE):
+    """
+    Decode the raw BSON batches straight into Arrow columns with the schema of the projection, i.e. Date and one float
+    column per field, without any intermediate document. Fields missing from every document are not returned.
+    pymongoarrow nulls the values whose BSON type differs from the schema, e.g. the int volumes, so the server casts
+    every field to double in the projection (MongoDB 4.4+).
+    :return: dataframe with Date as the index
+    :rtype: pd.DataFrame
+    """
+    pa, Schema, find_arrow_all = _get_arrow_api()
+    fields = _get_fields(projection)
+    schema = Schema({'Date': pa.timestamp('ms')} | {f: pa.float64() for f in fields})
+    projection = {'_id': 0, 'Date': 1} | {f: {'$toDouble': '$' + f} for f in fields}
+    table = find_arrow_all(collection, query, schema=schema, projection=projection, batch_size=batch_size)
+    table = table.select(['Date'] + [f for f in fields if table.column(f).null_count < table.num_rows])
+
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    df.index = pd.DatetimeIndex(df.pop('Date').astype('datetime64[ns]'), name='Date')
+    return df
+
+
+def get_df_from_collection(collection, query={}, projection={}, batch_size=CURSOR_BATCH_SIZE):
+    """
+    Function to transfer cursor to DataFrame, with Date as the index. With a projection and pymongoarrow installed,
+    the batches are decoded into Arrow columns, otherwise the cursor is streamed in batches and decoded into
+    preallocated columns.
 
     :param collection:
     :type collection:
@@ -124,18 +366,57 @@ def get_df_from_collection(collection, query={}, projection={}):
     :type query:
     :param projection:
     :type projection:
+    :param batch_size: number of documents per round trip
+    :type batch_size: int
     :return: dataframe
     :rtype: pd.DataFrame
     """
     try:
-        df = pd.DataFrame(collection.find(query, projection))
-        df = df.drop('_id', axis=1).set_index('Date')
-        return df
+        # pymongoarrow reads pymongo collections only, not those of the in-memory database
+        if _get_fields(projection) and isinstance(collection, pymongo.collection.Collection) and _get_arrow_api():
+            return get_arrow_df(collection, query, projection, batch_size)
+
+        builder = _ColumnBuilder(collection.count_documents(query), _get_fields(projection))
+        for docs in iter_doc_batches(collection, query, projection, batch_size):
+            builder.add(docs)
+        return builder.to_frame()
     except Exception as e:
         logger.error("Failed to get df from the cursor due to %s. " % e)
         return pd.DataFrame()
 
 
+def iter_df_chunks(collection, query={}, projection={}, chunk_size=CHUNK_SIZE, batch_size=CURSOR_BATCH_SIZE):
+    """
+    Stream the collection in Date order as DataFrames of chunk_size dates, for consumers that only need a rolling
+    window of the history at a time.
+
+    :param collection:
+    :type collection: pymongo.collection.Collection
+    :param query:
+    :type query: dict
+    :param projection:
+    :type projection: dict
+    :param chunk_size: number of dates per chunk
+    :type chunk_size: int
+    :param batch_size: number of documents per round trip
+    :type batch_size: int
+    :return: chunks with Date as the index
+    :rtype: generator
+    """
+    fields = _get_fields(projection)
+    builder = _ColumnBuilder(chunk_size, fields)
+    for docs in iter_doc_batches(collection, query, projection, batch_size, sort=[('Date', pymongo.ASCENDING)]):
+        while docs:
+            take = chunk_size - builder.n
+            builder.add(docs[:take])
+            docs = docs[take:]
+            if builder.n == chunk_size:
+                yield builder.to_frame()
+                builder = _ColumnBuilder(chunk_size, fields)
+    if builder.n:
+        yield builder.to_frame()
+
+
 def get_full_data_for_bt(stock, start_date, end_date):
     """
     A function to collect a few data to make the OHLCV for use in backtesting.
@@ -0,0 +1,101 @@
+"""
+In-memory stand-in of the MongoDB database, selected with MONGO_URI=memory://, for load tests and demos without a
+server. It is backed by mongomock, an optional dependency, and seeded with synthetic prices.
+"""
+import bson
+import numpy as np
+import pandas as pd
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from signals.utils.dashlogger import logger
+from signals.utils.datahelper import ALL_INDEXES, INDEX_COMP
+
+MEMORY_URI_SCHEME = 'memory://'
+
+
+class _RawBatchCursor:
+    """Cursor of raw BSON batches over a mongomock collection, as returned by find_raw_batches of pymongo."""
+
+    def __init__(self, collection, query, projection, batch_size):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.batch_size = batch_size or 100
+        self.sort_spec = None
+
+    def sort(self, key_or_list, direction=None):
+        self.sort_spec = key_or_list if direction is None else [(key_or_list, direction)]
+        return self
+
+    def __iter__(self):
+        cursor = self.collection.find(self.query, self.projection)
+        if self.sort_spec:
+            cursor = cursor.sort(self.sort_spec)
+        batch = []
+        for doc in cursor:
+            batch.append(bson.encode(doc))
+            if len(batch) == self.batch_size:
+                yield b''.join(batch)
+                batch = []
+        if batch:
+            yield b''.join(batch)
+
+
+def _find_raw_batches(self, filter=None, projection=None, batch_size=0, **kwargs):
+    return _RawBatchCursor(self, filter or {}, projection, batch_size)
+
+
+def get_memory_client():
+    """
+    An empty in-memory client with the pymongo API used by the dataloader.
+    :rtype: mongomock.MongoClient
+    """
+    if mongomock is None:
+        raise ImportError('mongomock is required for MONGO_URI=memory://, please pip install mongomock.')
+    mongomock.collection.Collection.find_raw_batches = _find_raw_batches
+    return mongomock.MongoClient()
+
+
+def seed_synthetic_prices(db, n_stocks=200, n_days=800, start_date='2018-01-01', seed=0):
+    """
+    Fill the database with synthetic daily prices of the indexes and their first components: log returns driven by
+    one market factor plus idiosyncratic noise, so that correlations, pairs and regressions are all meaningful.
+    :param db: database, e.g. DB_STOCK
+    :type db: mongomock.database.Database
+    :param n_stocks: number of stocks, taken evenly from every index
+    :type n_stocks: int
+    :param n_days: number of business days
+    :type n_days: int
+    :param start_date: first date
+    :type start_date: str
+    :param seed: random seed
+    :type seed: int
+    :return: tickers of the stocks
+    :rtype: list
+    """
+    rng = np.random.default_rng(seed)
+    per_index = -(-n_stocks // len(ALL_INDEXES))
+    stocks = sorted({s for idx in ALL_INDEXES for s in sorted(INDEX_COMP[idx])[:per_index]})[:n_stocks]
+    tickers = stocks + list(ALL_INDEXES)
+
+    dates = pd.bdate_range(start_date, periods=n_days, name='Date')
+    factor = rng.standard_normal((n_days, 1)) * 0.01
+    loadings = rng.uniform(0.2, 1.2, len(tickers))
+    returns = factor * loadings + rng.standard_normal((n_days, len(tickers))) * 0.01
+    close = pd.DataFrame(100 * np.exp(np.cumsum(returns, axis=0)), index=dates, columns=tickers)
+
+    frames = {'open': close * 0.999, 'high': close * 1.01, 'low': close * 0.99, 'close': close,
+              'volume': close * 0 + 1e6, 'return': np.log(close).diff()}
+    for col, df in frames.items():
+        db[col].delete_many({})
+        db[col].insert_many(df.reset_index().to_dict('records'))
+    db['last_update'].delete_many({})
+    # as after a refresh, the last date versions the data
+    db['last_update'].insert_one({'last_update': dates[-1].strftime('%Y-%m-%d')})
+
+    logger.info(fr'Seeded {len(stocks)} stocks and {len(ALL_INDEXES)} indexes over {n_days} days of synthetic data.')
+    return stocks
@@ -0,0 +1,185 @@
+"""Shared read-only float32 panels of the daily data."""
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import SAVE_DIR
+from signals.data.dataloader import DB_STOCK, get_daily_data, get_data_version, get_df_from_collection
+from signals.utils.dashlogger import logger
+from signals.utils.datahelper import ALL_INDEXES, ALL_STOCKS
+
+PANEL_DIR = os.path.join(SAVE_DIR, 'panels')
+os.makedirs(PANEL_DIR, exist_ok=True)
+
+PANEL_COLS = ['close', 'return']
+
+# panels attached by this process, col -> (meta file mtime, Panel)
+_ATTACHED = {}
+
+
+class Panel:
+    """
+    A dates x tickers float32 matrix memory-mapped read-only from disk. Every gunicorn worker maps the same file, so
+    the data lives once in the OS page cache instead of once per worker.
+    Stocks are stored before indexes, both sorted, so that the full stock universe is one contiguous column block.
+    """
+
+    def __init__(self, meta):
+        self.version = meta['version']
+        self.dates = pd.DatetimeIndex(meta['dates'])
+        self.tickers = meta['tickers']
+        self.ticker_loc = {t: i for i, t in enumerate(self.tickers)}
+        self.values = np.memmap(os.path.join(PANEL_DIR, meta['file']), dtype=np.float32, mode='r',
+                                shape=(len(self.dates), len(self.tickers)))
+
+    def get(self, symbols, start_date, end_date):
+        """
+        Slice the panel given the inputs. The date range is always a view, the tickers are a view as well when they
+        form a contiguous block of the panel (e.g. all stocks), otherwise only the requested columns are copied.
+        :param symbols: tickers of indexes and stocks
+        :type symbols: list
+        :param start_date: start date, format of '%Y-%m-%d'
+        :type start_date: str
+        :param end_date: end date, format of '%Y-%m-%d'
+        :type end_date: str
+        :return: the corresponding data
+        :rtype: pd.DataFrame
+        """
+        r0 = self.dates.searchsorted(pd.Timestamp(start_date), side='left')
+        r1 = self.dates.searchsorted(pd.Timestamp(end_date), side='right')
+
+        symbols = [s for s in symbols if s in self.ticker_loc]
+        locs = np.array([self.ticker_loc[s] for s in symbols], dtype=int)
+
+        if len(locs) and np.array_equal(locs, np.arange(locs[0], locs[0] + len(locs))):
+            block = self.values[r0:r1, locs[0]:locs[0] + len(locs)]
+        else:
+            block = self.values[r0:r1][:, locs]
+
+        df = pd.DataFrame(np.asarray(block), index=self.dates[r0:r1], columns=symbols, copy=False)
+        df.index.name = 'Date'
+        return df
+
+
+def _meta_path(col):
+    return os.path.join(PANEL_DIR, f'{col}.json')
+
+
+def remove_old_panel_files(col):
+    """
+    Remove the data files of the collection other than the current one. The workers keep the file they mapped until
+    they re-attach to a newer panel, so the files replaced by a build are only removed by the next one, and a file
+    still mapped, which Windows does not let go, is left to a later build.
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    """
+    try:
+        with open(_meta_path(col)) as handle:
+            current = json.load(handle)['file']
+    except FileNotFoundError:
+        current = None
+
+    for f in os.listdir(PANEL_DIR):
+        if f.startswith(f'{col}_') and f.endswith('.f32') and f != current:
+            try:
+                os.remove(os.path.join(PANEL_DIR, f))
+            except PermissionError:
+                logger.info(f'Panel file {f} is still in use, removed by a later build.')
+
+
+def build_panel(col):
+    """
+    Read the full history of a collection and save it as a float32 panel for all workers to attach. The data file is
+    written under a new name and the meta file is replaced last, so readers never see a half-written panel.
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    :return: function finished message
+    :rtype: str
+    """
+    try:
+        remove_old_panel_files(col)
+
+        df = get_df_from_collection(DB_STOCK[col]).sort_index()
+        tickers = [t for t in sorted(ALL_STOCKS) if t in df.columns] + \
+                  [t for t in sorted(ALL_INDEXES) if t in df.columns]
+
+        fname = f'{col}_{int(time.time() * 1000)}.f32'
+        values = np.memmap(os.path.join(PANEL_DIR, fname), dtype=np.float32, mode='w+', shape=(len(df), len(tickers)))
+        values[:] = df[tickers].to_numpy(dtype=np.float32)
+        values.flush()
+        del values
+
+        meta = {'version': get_data_version(), 'file': fname, 'tickers': tickers,
+                'dates': [d.strftime('%Y-%m-%d') for d in df.index]}
+        tmp_path = _meta_path(col) + '.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump(meta, handle)
+        os.replace(tmp_path, _meta_path(col))
+
+        return 'Panel successfully saved.'
+
+    except Exception as e:
+        logger.error("Panel build of %s failed due to %s. " % (col, e))
+
+
+def build_panels():
+    """
+    Rebuild all the panels, called once per data refresh.
+    """
+    for col in PANEL_COLS:
+        build_panel(col)
+
+
+def get_panel(col):
+    """
+    Attach to the latest panel of the collection, re-attaching only when it has been rebuilt.
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    :return: panel, None if the panel has not been built
+    :rtype: Panel
+    """
+    try:
+        mtime = os.stat(_meta_path(col)).st_mtime
+    except FileNotFoundError:
+        return None
+
+    attached = _ATTACHED.get(col)
+    if attached is None or attached[0] != mtime:
+        with open(_meta_path(col)) as handle:
+            meta = json.load(handle)
+        attached = (mtime, Panel(meta))
+        _ATTACHED[col] = attached
+
+    return attached[1]
+
+
+def get_panel_data(col, symbols, start_date, end_date):
+    """
+    Same as get_daily_data, served from the shared panel when it is available. Noting the data is float32.
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    :param symbols: tickers of indexes and stocks
+    :type symbols: list
+    :param start_date: start date, format of '%Y-%m-%d'
+    :type start_date: str
+    :param end_date: end date, format of '%Y-%m-%d'
+    :type end_date: str
+    :return: the corresponding data
+    :rtype: pd.DataFrame
+    """
+    panel = get_panel(col) if col in PANEL_COLS else None
+    # a panel of an older data version is not served, until it is rebuilt
+    if panel is None or panel.version != get_data_version():
+        return get_daily_data(col, symbols, start_date, end_date)
+
+    missing = [s for s in symbols if s not in panel.ticker_loc]
+    if not missing:
+        return panel.get(symbols, start_date, end_date)
+    # tickers outside of the stock and index universe are not in the panel
+    logger.warn(f'Tickers not in the {col} panel, read from the database: {missing}.')
+    df = pd.concat([panel.get(symbols, start_date, end_date),
+                    get_daily_data(col, missing, start_date, end_date).astype(np.float32)], axis=1)
+    return df[[s for s in symbols if s in df.columns]]
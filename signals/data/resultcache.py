@@ -0,0 +1,252 @@
+"""
+Persistent cache of the results of the screens, backtests and regressions, shared by the workers and across restarts.
+
+Results are kept in a SQLite file as compressed pickles, addressed by a hash of the function, its arguments and the data
+version, so a result is served again to any worker until the data is refreshed. Entries are evicted least recently
+used first once the file holds more than RESULT_CACHE_MAX_MB, entries of older data versions first of all.
+
+Example, the content of the cache:
+    python -m signals.data.resultcache
+"""
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+import pandas as pd
+
+from config import MONGO_URI, RESULT_CACHE_FILE, RESULT_CACHE_MAX_MB
+from signals.data.cache import VERSION_CHECK_INTERVAL
+from signals.data.dataloader import read_data_version
+from signals.data.memorydb import MEMORY_URI_SCHEME
+from signals.utils.dashlogger import logger
+
+# bump when the results of the cached functions change, so that the results of the former code are not served
+RESULT_CACHE_FORMAT = 2
+# seconds within which the last use of an entry is not updated again, hits are reads only most of the time
+LAST_USED_RESOLUTION = 60
+# seconds a writer waits for the lock of the file held by another worker
+SQLITE_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+
+def get_result_key(fn, args, kwargs, version):
+    """
+    Content address of a result: the hash of the function, its arguments bound to their names, defaults included, so
+    that positional and keyword calls share the result, and the data version.
+    :param fn: the computation
+    :type fn: callable
+    :param args: positional arguments
+    :type args: tuple
+    :param kwargs: keyword arguments
+    :type kwargs: dict
+    :param version: data version
+    :type version: str
+    :rtype: str
+    """
+    bound = inspect.signature(fn).bind(*args, **kwargs)
+    bound.apply_defaults()
+    content = json.dumps([RESULT_CACHE_FORMAT, fn.__module__, fn.__qualname__, bound.arguments, version],
+                         sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def is_degenerate(res):
+    """
+    Whether the result is a failure rather than an outcome worth keeping: None, or an empty or all-NaN table, alone or
+    in a tuple. The loaders return an empty frame when the database cannot be read, such results are not stored.
+    :param res: result of a cached function
+    :rtype: bool
+    """
+    if res is None:
+        return True
+    if isinstance(res, pd.DataFrame):
+        return res.dropna(how='all').empty
+    if isinstance(res, tuple):
+        return any(is_degenerate(r) for r in res if r is None or isinstance(r, pd.DataFrame))
+    return False
+
+
+class ResultCache:
+    """
+    Results in a SQLite file, see the module docstring. Each thread of each worker has its own connection, and the
+    file is in WAL mode so that readers do not wait for the writers.
+    :param path: SQLite file, the cache is disabled if empty
+    :type path: str
+    :param max_bytes: size of the compressed results kept
+    :type max_bytes: int
+    :param get_version: function returning the current data version
+    :type get_version: callable
+    """
+
+    def __init__(self, path, max_bytes, get_version=read_data_version):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.get_version = get_version
+        self.version = None
+        self.version_checked = 0
+        self.local = threading.local()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        # connections are not shared with the forked workers either
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def _get_version(self):
+        now = time.time()
+        if now - self.version_checked >= VERSION_CHECK_INTERVAL:
+            self.version, self.version_checked = self.get_version(), now
+        return self.version
+
+    def load(self, key):
+        """
+        The result stored under the key.
+        :return: whether it is found, and the result
+        :rtype: bool, object
+        """
+        conn = self._connect()
+        row = conn.execute('SELECT data, last_used FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return False, None
+        data, last_used = row
+        now = time.time()
+        if now - last_used > LAST_USED_RESOLUTION:
+            conn.execute('UPDATE results SET last_used = ? WHERE key = ?', (now, key))
+        return True, pickle.loads(zlib.decompress(data))
+
+    def save(self, key, name, version, res):
+        """
+        Store the result under the key, then evict what is over the size of the cache.
+        """
+        data = zlib.compress(pickle.dumps(res, protocol=pickle.HIGHEST_PROTOCOL))
+        if len(data) > self.max_bytes:
+            logger.warn(fr'Result of {name} is {len(data)} bytes, larger than the whole result cache, not stored.')
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (key, name, version, len(data), now, now, data))
+        self._evict(conn, version)
+
+    def _evict(self, conn, version):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        # results of older data versions are never served again, they go first
+        for key, size in conn.execute('SELECT key, size FROM results ORDER BY version = ?, last_used', (version,)):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        conn.executemany('DELETE FROM results WHERE key = ?', evicted)
+        logger.info(fr'Evicted {len(evicted)} results from the result cache.')
+
+    def get(self, fn, args=(), kwargs=None, compute=None):
+        """
+        Result of the function from the cache, computed and stored if missing. The cache is skipped, and the result
+        computed, if the file cannot be used.
+        :param fn: the computation, its result must be picklable
+        :type fn: callable
+        :param args: positional arguments
+        :type args: tuple
+        :param kwargs: keyword arguments
+        :type kwargs: dict
+        :param compute: function computing the result, fn called with the arguments by default
+        :type compute: callable
+        :return: result of fn
+        """
+        kwargs = kwargs or {}
+        compute = compute or (lambda: fn(*args, **kwargs))
+        if not self.enabled:
+            return compute()
+
+        name = fn.__qualname__
+        try:
+            version = self._get_version()
+            key = get_result_key(fn, args, kwargs, version)
+            found, res = self.load(key)
+            if found:
+                logger.info(fr'Result of {name} served from the result cache.')
+                return res
+        except (sqlite3.Error, OSError, pickle.UnpicklingError, zlib.error) as e:
+            logger.warn(fr'Cannot read the result cache due to {e}, compute {name}.')
+            return compute()
+
+        res = compute()
+        if is_degenerate(res):
+            logger.warn(fr'Result of {name} is empty, not stored.')
+            return res
+        try:
+            self.save(key, name, version, res)
+        except (sqlite3.Error, OSError, pickle.PicklingError) as e:
+            logger.warn(fr'Cannot store the result of {name} due to {e}, pass.')
+        return res
+
+    def clear(self):
+        if self.enabled:
+            self._connect().execute('DELETE FROM results')
+
+    def stats(self):
+        """
+        Number and size of the results per function and data version.
+        :rtype: pd.DataFrame
+        """
+        if not self.enabled:
+            return pd.DataFrame()
+        return pd.read_sql('SELECT name AS Function, version AS Version, COUNT(*) AS Results, SUM(size) AS Bytes '
+                           'FROM results GROUP BY name, version ORDER BY name, version', self._connect())
+
+
+# the in-memory database is seeded anew by every process, its results are not kept
+RESULT_CACHE = ResultCache('' if MONGO_URI.startswith(MEMORY_URI_SCHEME) else RESULT_CACHE_FILE,
+                           RESULT_CACHE_MAX_MB * 1024 ** 2)
+
+
+def get_cached_result(fn, *args, **kwargs):
+    """
+    Result of fn from the persistent result cache, computed and stored if missing.
+    :param fn: the computation, its result must be picklable
+    :type fn: callable
+    :return: result of fn
+    """
+    return RESULT_CACHE.get(fn, args, kwargs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Content of the persistent result cache.')
+    parser.add_argument('--clear', action='store_true', help='remove all the results')
+    args = parser.parse_args()
+
+    if args.clear:
+        RESULT_CACHE.clear()
+    print(RESULT_CACHE.stats().to_string(index=False))
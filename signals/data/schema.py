@@ -0,0 +1,223 @@
+"""
+Schema of the price collections: indexes, the optional bucketed layout and the query planner between layouts.
+
+The default 'wide' layout holds one document per date with one field per ticker, which suits pulling the whole
+universe for a date range. The 'bucket' layout holds one document per ticker per year, with the dates and values as
+arrays, which suits pulling a few tickers over a long range.
+"""
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pymongo
+from pymongo import ReplaceOne
+
+from signals.utils.dashlogger import logger
+
+PRICE_COLS = ['open', 'high', 'low', 'close', 'volume', 'return']
+BUCKET_SUFFIX = '_bucket'
+COLLECTION_LAYOUTS = 'layouts'
+
+# rough number of values decoded per document of the bucket layout, i.e. trading days per year for dates and values
+BUCKET_DOC_SIZE = 2 * 252
+
+# layout documents read by this process, col -> (data version, layout)
+_LAYOUTS = {}
+
+
+def create_date_index(collection):
+    """
+    Create the unique Date index of a collection of the wide layout.
+    :param collection:
+    :type collection: pymongo.collection.Collection
+    """
+    collection.create_index([('Date', pymongo.ASCENDING)], unique=True, name='date_unique')
+
+
+def ensure_indexes(db):
+    """
+    Create the indexes the loaders rely on, it is safe to call repeatedly.
+    :param db: stock price database
+    :type db: pymongo.database.Database
+    """
+    for col in PRICE_COLS:
+        create_date_index(db[col])
+        db[col + BUCKET_SUFFIX].create_index([('ticker', pymongo.ASCENDING), ('year', pymongo.ASCENDING)],
+                                             unique=True, name='ticker_year_unique')
+    db[COLLECTION_LAYOUTS].create_index([('col', pymongo.ASCENDING)], unique=True, name='col_unique')
+
+
+def get_field_names(collection):
+    """
+    Fields of the documents of a collection of the wide layout, i.e. the tickers, listed by the server.
+    :param collection:
+    :type collection: pymongo.collection.Collection
+    :rtype: list
+    """
+    pipeline = [{'$project': {'_id': 0, 'fields': {'$objectToArray': '$$ROOT'}}}, {'$unwind': '$fields'},
+                {'$group': {'_id': '$fields.k'}}]
+    return sorted(doc['_id'] for doc in collection.aggregate(pipeline) if doc['_id'] not in ('Date', '_id'))
+
+
+def rebuild_buckets(db, col, symbols=None, years=None):
+    """
+    Rebuild the bucketed copy of a collection from its wide layout, either fully or only for the given tickers/years,
+    e.g. the ones touched by a price update.
+    :param db: stock price database
+    :type db: pymongo.database.Database
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    :param symbols: tickers to rebuild, all if None
+    :type symbols: list
+    :param years: years to rebuild, all if None
+    :type years: list
+    :return: number of buckets written
+    :rtype: int
+    """
+    query = {}
+    if years is not None:
+        query = {'Date': {'$gte': dt.datetime(min(years), 1, 1), '$lt': dt.datetime(max(years) + 1, 1, 1)}}
+    projection = {'_id': 0} if symbols is None else {'_id': 0, 'Date': 1} | {s: 1 for s in symbols}
+
+    df = pd.DataFrame(list(db[col].find(query, projection)))
+    if df.empty:
+        return 0
+    df = df.set_index('Date').sort_index()
+
+    requests = []
+    for year, ydf in df.groupby(df.index.year):
+        dates = list(ydf.index.to_pydatetime())
+        for ticker in ydf.columns:
+            requests.append(ReplaceOne({'ticker': ticker, 'year': int(year)},
+                                       {'ticker': ticker, 'year': int(year), 'dates': dates,
+                                        'values': ydf[ticker].astype(float).tolist()},
+                                       upsert=True))
+    if requests:
+        db[col + BUCKET_SUFFIX].bulk_write(requests, ordered=False)
+
+    n_fields = len(db[col].find_one({}, {'_id': 0}) or {})
+    db[COLLECTION_LAYOUTS].update_one({'col': col}, {'$set': {'col': col, 'bucketed': True, 'n_fields': n_fields}},
+                                      upsert=True)
+    _LAYOUTS.pop(col, None)
+    return len(requests)
+
+
+def get_layout(db, col, version=None):
+    """
+    The layout document of the collection. With a data version, it is read once per version, as the query planner
+    asks for it on every read, otherwise it is read from the database.
+    :param db: stock price database
+    :type db: pymongo.database.Database
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    :param version: current data version
+    :type version: str
+    :return: layout, empty if the collection has only the wide layout
+    :rtype: dict
+    """
+    cached = _LAYOUTS.get(col)
+    if version is None or cached is None or cached[0] != version:
+        cached = (version, db[COLLECTION_LAYOUTS].find_one({'col': col}, {'_id': 0}) or {})
+        _LAYOUTS[col] = cached
+    return cached[1]
+
+
+def is_bucketed(db, col, version=None):
+    """
+    Whether the bucketed copy of the collection has been built.
+    :param db: stock price database
+    :type db: pymongo.database.Database
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    :param version: current data version, the layout is read from the database if None
+    :type version: str
+    :rtype: bool
+    """
+    return bool(get_layout(db, col, version).get('bucketed'))
+
+
+def migrate(db, bucketed=True):
+    """
+    Migration step: create the indexes and, optionally, the bucketed copies of all the price collections.
+    :param db: stock price database
+    :type db: pymongo.database.Database
+    :param bucketed: whether to build the bucket layout
+    :type bucketed: bool
+    :return: finish message
+    :rtype: str
+    """
+    ensure_indexes(db)
+    if bucketed:
+        for col in PRICE_COLS:
+            logger.info(f'Building bucket layout of collection: {col}.')
+            rebuild_buckets(db, col)
+    return 'Schema successfully migrated.'
+
+
+def plan_query(db, col, symbols, start_date, end_date, version=None):
+    """
+    Pick the cheapest layout for the request. The cost is the number of values the server has to read: a wide document
+    is read in full whatever the projection, whereas a bucket holds one ticker-year only.
+    :param db: stock price database
+    :type db: pymongo.database.Database
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    :param symbols: tickers of indexes and stocks
+    :type symbols: list
+    :param start_date: start date
+    :type start_date: dt.datetime
+    :param end_date: end date
+    :type end_date: dt.datetime
+    :param version: current data version, the layout is read from the database if None
+    :type version: str
+    :return: 'wide' or 'bucket'
+    :rtype: str
+    """
+    layout = get_layout(db, col, version)
+    if not layout.get('bucketed'):
+        return 'wide'
+
+    n_days = np.busday_count(start_date.date(), end_date.date()) + 1
+    n_years = end_date.year - start_date.year + 1
+
+    wide_cost = n_days * layout['n_fields']
+    bucket_cost = len(symbols) * n_years * BUCKET_DOC_SIZE
+
+    return 'bucket' if bucket_cost < wide_cost else 'wide'
+
+
+def get_bucketed_data(db, col, symbols, start_date, end_date):
+    """
+    Read the data from the bucket layout, in the same shape as the wide layout returns.
+    :param db: stock price database
+    :type db: pymongo.database.Database
+    :param col: The name of the collections, i.e. 'close', 'return'
+    :type col: str
+    :param symbols: tickers of indexes and stocks
+    :type symbols: list
+    :param start_date: start date
+    :type start_date: dt.datetime
+    :param end_date: end date
+    :type end_date: dt.datetime
+    :return: the corresponding data with Date as the index
+    :rtype: pd.DataFrame
+    """
+    query = {'ticker': {'$in': list(symbols)}, 'year': {'$gte': start_date.year, '$lte': end_date.year}}
+    series = {}
+    for doc in db[col + BUCKET_SUFFIX].find(query, {'_id': 0}).sort('year', pymongo.ASCENDING):
+        s = pd.Series(doc['values'], index=pd.DatetimeIndex(doc['dates']), dtype=float)
+        series.setdefault(doc['ticker'], []).append(s)
+
+    if not series:
+        return pd.DataFrame()
+
+    df = pd.DataFrame({t: pd.concat(sl) for t, sl in series.items()})
+    df = df.loc[start_date:end_date, [s for s in symbols if s in df.columns]]
+    df.index.name = 'Date'
+    return df
+
+
+if __name__ == '__main__':
+    from signals.data.dataloader import DB_STOCK
+
+    print(migrate(DB_STOCK))
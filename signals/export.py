@@ -0,0 +1,241 @@
+"""
+Bulk export of screening, backtest and regression results as Arrow IPC streams or Parquet, for research notebooks.
+
+Results are computed (or served from the precomputed store or the result cache), only the requested columns and the
+rows passing the filters are kept, and the table is streamed out in record batches.
+
+Filters are given as 'column op value', with op one of ==, !=, >=, <=, >, <, e.g. 'Correlation >= 0.8'.
+
+Example, from a notebook:
+    pa.ipc.open_stream(requests.get(url + '/export/correlations?start_date=2020-01-01&end_date=2021-01-01'
+                                          '&method=ols&topn=500&format=arrow').content).read_all()
+or from the command line:
+    python -m signals.export correlations --start-date 2020-01-01 --end-date 2021-01-01 --method ols --topn 500
+        --columns "Stocks Pair,OLS Beta" --filter "OLS RSquared > 0.5" --format parquet --out ols.parquet
+"""
+import argparse
+import re
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from signals.analytics.correlations import get_correlation_full_res
+from signals.analytics.precompute import get_precomputed_correlation
+from signals.analytics.regressions import get_regression_full_res, get_top_components_via_lasso
+from signals.data.resultcache import get_cached_result
+from signals.utils.admission import estimate_backtest_cost, estimate_correlation_cost, run_admitted
+
+EXPORT_FORMATS = {'arrow': 'application/vnd.apache.arrow.stream', 'parquet': 'application/vnd.apache.parquet'}
+# number of rows per record batch / row group
+EXPORT_BATCH_ROWS = 10000
+
+_FILTER_PATTERN = re.compile(r'^\s*(.+?)\s*(==|!=|>=|<=|>|<)\s*(.+?)\s*$')
+_FILTER_OPS = {'==': lambda f, v: f == v, '!=': lambda f, v: f != v, '>=': lambda f, v: f >= v,
+               '<=': lambda f, v: f <= v, '>': lambda f, v: f > v, '<': lambda f, v: f < v}
+
+
+def parse_filters(filters, schema):
+    """
+    Parse the row filters into one Arrow expression, each value cast to the type of its column.
+    :param filters: filters as 'column op value'
+    :type filters: list
+    :param schema: schema of the table filtered
+    :type schema: pa.Schema
+    :return: expression, None if no filter
+    :rtype: pc.Expression
+    :raises ValueError: if a filter names an unknown column or its value does not fit the column type
+    """
+    expr = None
+    for f in filters or []:
+        match = _FILTER_PATTERN.match(f)
+        if match is None:
+            raise ValueError(f'Cannot parse filter "{f}", expecting "column op value".')
+        col, op, value = match.groups()
+        if col not in schema.names:
+            raise ValueError(f'Unknown column "{col}" in filter "{f}".')
+        col_type = schema.field(col).type
+        try:
+            value = pa.scalar(value.strip('\'"'), pa.string()).cast(col_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            raise ValueError(f'Value of filter "{f}" is not a valid {col_type} for column "{col}".')
+        cond = _FILTER_OPS[op](pc.field(col), value)
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def to_arrow_table(df, columns=None, filters=None):
+    """
+    Convert the result to an Arrow table, keeping only the requested columns and the rows passing the filters.
+    :param df: result
+    :type df: pd.DataFrame
+    :param columns: columns to keep, all if None
+    :type columns: list
+    :param filters: filters as 'column op value'
+    :type filters: list
+    :return: table
+    :rtype: pa.Table
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return ds.dataset(table).to_table(columns=columns or None, filter=parse_filters(filters, table.schema))
+
+
+class _ChunkSink:
+    """
+    Write-only file object handing the written bytes over chunk by chunk.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+        self.pos = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def readable(self):
+        return False
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_table_bytes(table, fmt='arrow', batch_rows=EXPORT_BATCH_ROWS):
+    """
+    Serialize the table batch by batch.
+    :param table: table
+    :type table: pa.Table
+    :param fmt: 'arrow' for Arrow IPC stream or 'parquet'
+    :type fmt: str
+    :param batch_rows: number of rows per record batch / row group
+    :type batch_rows: int
+    :return: bytes
+    :rtype: generator
+    """
+    sink = _ChunkSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, table.schema)
+        for batch in table.to_batches(max_chunksize=batch_rows):
+            writer.write_table(pa.Table.from_batches([batch], schema=table.schema), row_group_size=batch_rows)
+            yield sink.pop()
+    elif fmt == 'arrow':
+        writer = pa.ipc.new_stream(sink, table.schema)
+        for batch in table.to_batches(max_chunksize=batch_rows):
+            writer.write_batch(batch)
+            yield sink.pop()
+    else:
+        raise ValueError(f'Unknown format "{fmt}", expecting one of {list(EXPORT_FORMATS)}.')
+
+    writer.close()
+    yield sink.pop()
+
+
+def get_correlation_export(start_date, end_date, method, topn):
+    """
+    Correlation screen, from the precomputed store when available.
+    :rtype: pd.DataFrame
+    :raises AdmissionError: if the screen is too expensive to run now
+    """
+    df = get_precomputed_correlation(start_date, end_date, method, topn)
+    if df is None:
+        df = run_admitted(('correlation', start_date, end_date, method, topn),
+                          estimate_correlation_cost(start_date, end_date, method, topn),
+                          get_correlation_full_res, start_date, end_date, method, topn)
+    return df
+
+
+def get_backtest_export(stock1, stock2, start_date, end_date, params_range):
+    """
+    Full backtest grid of the pair.
+    :rtype: pd.DataFrame
+    :raises AdmissionError: if the backtests are too expensive to run now
+    """
+    from signals.analytics.strategyrunner import get_bt_results
+
+    params = {'period': params_range['rp_min'], 'zs': params_range['zs_min']}
+    par_df, plot_sub, total_df = run_admitted(
+        ('backtest_grid', stock1, stock2, start_date, end_date, *params_range.values()),
+        estimate_backtest_cost(start_date, end_date, params_range),
+        get_bt_results, stock1, stock2, start_date, end_date, params_range, params)
+    # the result may be shared with concurrent requests
+    total_df = total_df.copy()
+    total_df.insert(0, 'Stocks Pair', stock1 + ' - ' + stock2)
+    return total_df
+
+
+def get_regression_export(index_value, stock_values, start_date, end_date, n_nonzero=10):
+    """
+    Regression coefficients of the stocks against the index in long format, the Lasso selection if no stock is given.
+    :rtype: pd.DataFrame
+    """
+    if stock_values:
+        rdf, plot, summary = get_cached_result(get_regression_full_res, index_value, stock_values, start_date, end_date,
+                                               '', add_plot=False)
+    else:
+        rdf, plot, summary = get_cached_result(get_top_components_via_lasso, index_value, start_date, end_date, '',
+                                               n_nonzero=n_nonzero)
+
+    df = rdf.drop('Stocks', axis=1).T.reset_index()
+    df.columns = ['Ticker', 'Coefficient']
+    df.insert(0, 'Index', index_value)
+    return df
+
+
+def _split(value):
+    return [v.strip() for v in value.split(',') if v.strip()] if value else []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export results as Arrow IPC stream or Parquet.')
+    parser.add_argument('kind', choices=['correlations', 'backtest', 'regression'])
+    parser.add_argument('--start-date', required=True)
+    parser.add_argument('--end-date', required=True)
+    parser.add_argument('--method', default='pearson')
+    parser.add_argument('--topn', type=int, default=10)
+    parser.add_argument('--stock1')
+    parser.add_argument('--stock2')
+    parser.add_argument('--rp', default='50,150,50', help='rolling period min,max,step')
+    parser.add_argument('--zs', default='1,3,1', help='z-score limit min,max,step')
+    parser.add_argument('--index')
+    parser.add_argument('--stocks', default='', help='comma separated, the Lasso selection if empty')
+    parser.add_argument('--n-nonzero', type=int, default=10)
+    parser.add_argument('--columns', default='', help='comma separated, all if empty')
+    parser.add_argument('--filter', action='append', default=[])
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='parquet')
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+
+    if args.kind == 'correlations':
+        res = get_correlation_export(args.start_date, args.end_date, args.method, args.topn)
+    elif args.kind == 'backtest':
+        rp, zs = [int(v) for v in _split(args.rp)], [int(v) for v in _split(args.zs)]
+        res = get_backtest_export(args.stock1, args.stock2, args.start_date, args.end_date,
+                                  {'rp_min': rp[0], 'rp_max': rp[1], 'rp_step': rp[2],
+                                   'zs_min': zs[0], 'zs_max': zs[1], 'zs_step': zs[2]})
+    else:
+        res = get_regression_export(args.index, _split(args.stocks), args.start_date, args.end_date, args.n_nonzero)
+
+    with open(args.out, 'wb') as handle:
+        for chunk in iter_table_bytes(to_arrow_table(res, _split(args.columns), args.filter), args.format):
+            handle.write(chunk)
+    print(f'Results successfully exported to {args.out}.')
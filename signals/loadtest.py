@@ -0,0 +1,375 @@
+"""
+Concurrent load test of the Flask app and its Dash dashboards.
+
+Each worker process boots the app from signals.init_app, as a gunicorn worker would, and runs simulated users on
+threads. A user loads the page, firing the initial callbacks, then replays the steps of a scenario, e.g. screening the
+pairs, selecting one and moving the sliders. A step changes properties of the page and fires the callbacks depending on
+them, chained in the order of the Dash renderer and with the JSON it posts, then polls the dcc.Interval callbacks, e.g.
+the log console.
+
+Unless MONGO_URI is set, the workers read an in-memory database seeded with synthetic prices. With --url, the users hit
+a running server instead of booting the app, and the memory of its workers is not reported.
+
+Example:
+    python -m signals.loadtest --scenario pair_trading --workers 2 --users 4 --iterations 3
+reports the throughput, the p50/p95/p99 latencies per callback and per step, and the boot time and memory of every
+worker.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+LOADTEST_WORKERS = 2
+LOADTEST_USERS = 4
+LOADTEST_ITERATIONS = 2
+LOADTEST_PERCENTILES = [50, 95, 99]
+# synthetic data of the in-memory database
+LOADTEST_STOCKS = 200
+LOADTEST_DAYS = 800
+# correlation methods of the screens, kalman is left out as a single screen would dominate the run
+SCREEN_METHODS = ['pearson', 'coint']
+SCREEN_TOPN = [10, 50, 200]
+
+
+class _AppClient:
+    """The app in this process, through the Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, path, body=None):
+        r = self.client.post(path, json=body) if body is not None else self.client.get(path)
+        return r.status_code, r.data
+
+
+class _HttpClient:
+    """A running server."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req) as r:
+                return r.status, r.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def _parse_prop(s):
+    component_id, prop = s.rsplit('.', 1)
+    return component_id, prop
+
+
+class _Callback:
+    """A callback of the dependencies served by Dash."""
+
+    def __init__(self, dep):
+        self.output = dep['output']
+        self.multi = self.output.startswith('..')
+        self.outputs = [_parse_prop(o) for o in self.output.strip('.').split('...')] if self.multi \
+            else [_parse_prop(self.output)]
+        self.inputs = [(i['id'], i['property']) for i in dep['inputs']]
+        self.state = [(i['id'], i['property']) for i in dep['state']]
+        self.prevent_initial_call = dep.get('prevent_initial_call', False)
+        self.name = '%s.%s' % self.outputs[0]
+
+
+class DashPage:
+    """
+    A Dash app as seen by one browser: the properties of its components and the callbacks updating them.
+    :param client: client of the app
+    :type client: _AppClient or _HttpClient
+    :param prefix: routes pathname prefix of the app, e.g. '/pair_trading/'
+    :type prefix: str
+    :param record: function(name, seconds, ok) recording the latencies
+    :type record: callable
+    """
+
+    def __init__(self, client, prefix, record):
+        self.client = client
+        self.prefix = prefix
+        self.record = record
+        self.props = {}
+        self.intervals = []
+
+        t1 = time.perf_counter()
+        ok = self.client.request(prefix)[0] == 200
+        self._collect(self._get_json('_dash-layout'))
+        self.callbacks = self._sort([_Callback(d) for d in self._get_json('_dash-dependencies')])
+        self.record('page load', time.perf_counter() - t1, ok)
+
+        # callbacks without prevent_initial_call fire once the page is loaded
+        for cb in self.callbacks:
+            if not cb.prevent_initial_call and all(i in self.props for i in cb.inputs):
+                self.props.update(self.fire(cb, []))
+
+    def _get_json(self, path):
+        status, data = self.client.request(self.prefix + path)
+        return json.loads(data)
+
+    def _collect(self, node):
+        if isinstance(node, list):
+            for n in node:
+                self._collect(n)
+        elif isinstance(node, dict) and 'props' in node:
+            props = node['props']
+            if 'id' in props:
+                for k, v in props.items():
+                    self.props[(props['id'], k)] = v
+                if node.get('type') == 'Interval':
+                    self.intervals.append((props['id'], 'n_intervals'))
+            self._collect(props.get('children'))
+
+    @staticmethod
+    def _sort(callbacks):
+        # a callback fires after the callbacks updating its inputs, as in the Dash renderer
+        ordered, pending = [], list(callbacks)
+        while pending:
+            outputs = {o for cb in pending for o in cb.outputs}
+            ready = [cb for cb in pending if not (set(cb.inputs) - set(cb.outputs)) & outputs] or pending[:1]
+            ordered += ready
+            pending = [cb for cb in pending if cb not in ready]
+        return ordered
+
+    def fire(self, cb, changed):
+        """
+        Post the callback with the current properties.
+        :return: properties updated by the callback
+        :rtype: dict
+        """
+        def values(props):
+            return [{'id': i, 'property': p, 'value': self.props.get((i, p))} for i, p in props]
+
+        outputs = [{'id': i, 'property': p} for i, p in cb.outputs]
+        body = {'output': cb.output, 'outputs': outputs if cb.multi else outputs[0], 'inputs': values(cb.inputs),
+                'state': values(cb.state), 'changedPropIds': ['%s.%s' % c for c in changed]}
+
+        t1 = time.perf_counter()
+        status, data = self.client.request(self.prefix + '_dash-update-component', body)
+        self.record(cb.name, time.perf_counter() - t1, status in (200, 204))
+        if status != 200:
+            return {}
+        return {(i, p): v for i, props in json.loads(data)['response'].items() for p, v in props.items()}
+
+    def update(self, changes):
+        """
+        Change properties as the user would, and fire the callbacks depending on them, then on their outputs.
+        :param changes: (component id, property) to value
+        :type changes: dict
+        """
+        self.props.update(changes)
+        changed = set(changes)
+        for cb in self.callbacks:
+            trigger = [i for i in cb.inputs if i in changed]
+            if trigger:
+                updated = self.fire(cb, trigger)
+                self.props.update(updated)
+                changed |= set(updated)
+
+    def poll(self):
+        """Tick the intervals, e.g. the log console refresh."""
+        self.update({i: (self.props.get(i) or 0) + 1 for i in self.intervals})
+
+    def click(self, component_id):
+        return {(component_id, 'n_clicks'): (self.props.get((component_id, 'n_clicks')) or 0) + 1}
+
+
+def _select_pair(page, rng):
+    data = page.props.get(('regression_table', 'data')) or []
+    if not data:
+        return {}
+    row = rng.randrange(len(data))
+    return {('regression_table', 'active_cell'): {'row': row, 'column': 0, 'column_id': 'Stocks Pair',
+                                                  'row_id': data[row].get('id', data[row]['Stocks Pair'])}}
+
+
+def _next_page(page, rng):
+    if (page.props.get(('regression_table', 'page_count')) or 1) < 2:
+        return {}
+    return {('regression_table', 'page_current'): 1}
+
+
+def _select_stocks(page, rng):
+    options = page.props.get(('stock_dropdown', 'options')) or []
+    return {('stock_dropdown', 'value'): [o['value'] for o in rng.sample(options, min(3, len(options)))]}
+
+
+# scenario -> routes pathname prefix and steps, each step returning the changes of the user from the page
+SCENARIOS = {
+    'pair_trading': ('/pair_trading/', [
+        ('screen', lambda page, rng: {('method', 'value'): rng.choice(SCREEN_METHODS),
+                                      ('topnpairs', 'value'): rng.choice(SCREEN_TOPN)} | page.click('corr_button')),
+        ('next page', _next_page),
+        ('select pair', _select_pair),
+        ('rolling period', lambda page, rng: {('rp_slider', 'value'): rng.choice([50, 100, 150])}),
+        ('z-score limit', lambda page, rng: {('zs_slider', 'value'): rng.choice([1, 2, 3])}),
+        ('trade details', lambda page, rng: page.click('open-body-scroll')),
+        ('close details', lambda page, rng: page.click('close-body-scroll')),
+    ]),
+    'index_regression': ('/index_regression/', [
+        ('index', lambda page, rng: {('index_dropdown', 'value'): rng.choice(['^GSPC', '^NDX', '^RUT'])}),
+        ('search', lambda page, rng: {('stock_dropdown', 'search_value'): rng.choice('ABCMST')}),
+        ('select stocks', _select_stocks),
+        ('regression', lambda page, rng: page.click('reg_button')),
+    ]),
+}
+
+
+def run_user(client, scenario, iterations, think_time, seed, record):
+    """
+    Replay the scenario, loading the page again at every iteration.
+    """
+    rng = random.Random(seed)
+    prefix, steps = SCENARIOS[scenario]
+    for _ in range(iterations):
+        page = DashPage(client, prefix, record)
+        for label, step in steps:
+            changes = step(page, rng)
+            if not changes:
+                continue
+            t1 = time.perf_counter()
+            page.update(changes)
+            record(fr'step: {label}', time.perf_counter() - t1, True)
+            page.poll()
+            time.sleep(think_time)
+
+
+def _get_rss_mb():
+    with open('/proc/self/statm') as handle:
+        return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+
+def run_worker(worker_id, scenario, users, iterations, think_time, url=None, n_stocks=LOADTEST_STOCKS,
+               n_days=LOADTEST_DAYS):
+    """
+    One worker process: boot the app, unless a url is given, and run the users on threads.
+    :return: records (name, seconds, ok) and the worker stats
+    :rtype: list, dict
+    """
+    t1 = time.perf_counter()
+    if url:
+        clients = [_HttpClient(url) for _ in range(users)]
+    else:
+        from config import MONGO_URI
+        from signals import init_app
+        from signals.data.memorydb import MEMORY_URI_SCHEME, seed_synthetic_prices
+        from signals.utils.dashlogger import handler
+
+        handler.setLevel(logging.WARNING)
+        if MONGO_URI.startswith(MEMORY_URI_SCHEME):
+            from signals.data.dataloader import DB_STOCK
+            seed_synthetic_prices(DB_STOCK, n_stocks, n_days)
+        app = init_app()
+        clients = [_AppClient(app) for _ in range(users)]
+    boot = time.perf_counter() - t1
+
+    records, lock = [], threading.Lock()
+
+    def record(name, seconds, ok):
+        with lock:
+            records.append((name, seconds, ok))
+
+    threads = [threading.Thread(target=run_user, args=(c, scenario, iterations, think_time,
+                                                       worker_id * 1000 + i, record)) for i, c in enumerate(clients)]
+    t2 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = {'Worker': worker_id, 'Boot (s)': boot, 'Run (s)': time.perf_counter() - t2, 'Requests': len(records)}
+    if not url:
+        stats |= {'RSS (MB)': _get_rss_mb(), 'Peak RSS (MB)': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    return records, stats
+
+
+def get_report(records, elapsed):
+    """
+    Latencies per callback and per step.
+    :param records: (name, seconds, ok)
+    :type records: list
+    :param elapsed: wall time of the run
+    :type elapsed: float
+    :rtype: pd.DataFrame
+    """
+    by_name = defaultdict(list)
+    for name, seconds, ok in records:
+        by_name[name].append((seconds, ok))
+
+    rows = []
+    for name, values in sorted(by_name.items()):
+        seconds = np.array([s for s, ok in values]) * 1000
+        row = {'Name': name, 'Count': len(values), 'Errors': sum(not ok for s, ok in values),
+               'Per Second': len(values) / elapsed, 'Mean (ms)': seconds.mean()}
+        row |= {fr'p{q} (ms)': np.percentile(seconds, q) for q in LOADTEST_PERCENTILES}
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def run_load_test(scenario, workers=LOADTEST_WORKERS, users=LOADTEST_USERS, iterations=LOADTEST_ITERATIONS,
+                  think_time=0, url=None, n_stocks=LOADTEST_STOCKS, n_days=LOADTEST_DAYS):
+    """
+    Run the users of all the workers and aggregate their latencies.
+    :param scenario: name of the scenario, see SCENARIOS
+    :type scenario: str
+    :param workers: number of worker processes
+    :type workers: int
+    :param users: number of concurrent users per worker
+    :type users: int
+    :param iterations: times each user replays the scenario
+    :type iterations: int
+    :param think_time: seconds between two steps of a user
+    :type think_time: float
+    :param url: url of a running server, the app is booted in every worker otherwise
+    :type url: str
+    :return: latencies per callback and step, stats per worker
+    :rtype: pd.DataFrame, pd.DataFrame
+    """
+    os.environ.setdefault('MONGO_URI', 'memory://')
+    args = (scenario, users, iterations, think_time, url, n_stocks, n_days)
+
+    t1 = time.perf_counter()
+    # spawned workers boot the app from scratch, as gunicorn workers without preloading
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        results = list(pool.map(run_worker, range(workers), *zip(*[args] * workers)))
+    elapsed = time.perf_counter() - t1
+
+    records = [r for worker_records, stats in results for r in worker_records]
+    report = get_report(records, elapsed)
+    workers_df = pd.DataFrame([stats for worker_records, stats in results])
+    return report, workers_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent load test of the dashboards.')
+    parser.add_argument('--scenario', choices=list(SCENARIOS), default='pair_trading')
+    parser.add_argument('--workers', type=int, default=LOADTEST_WORKERS)
+    parser.add_argument('--users', type=int, default=LOADTEST_USERS, help='concurrent users per worker')
+    parser.add_argument('--iterations', type=int, default=LOADTEST_ITERATIONS)
+    parser.add_argument('--think-time', type=float, default=0)
+    parser.add_argument('--url', help='url of a running server, e.g. http://localhost:8001')
+    parser.add_argument('--stocks', type=int, default=LOADTEST_STOCKS, help='stocks of the synthetic data')
+    parser.add_argument('--days', type=int, default=LOADTEST_DAYS, help='days of the synthetic data')
+    args = parser.parse_args()
+
+    report, workers_df = run_load_test(args.scenario, args.workers, args.users, args.iterations, args.think_time,
+                                       args.url, args.stocks, args.days)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20, 'display.float_format', '{:.1f}'.format):
+        print(report.to_string(index=False))
+        print(workers_df.to_string(index=False))
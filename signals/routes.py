@@ -1,9 +1,10 @@
 """Routes for parent Flask app."""
 from flask import current_app as app
-from flask import flash, redirect, render_template, request, session, url_for
+from flask import Response, abort, flash, redirect, render_template, request, session, url_for
 from flask_login import login_required, login_user, logout_user
 
 from signals.users import User
+from signals.utils.admission import AdmissionError
 
 
 @app.route('/')
@@ -40,3 +41,67 @@ def logout():
     session.pop('username', None)
     flash('Logged out successfully.')
     return redirect(url_for('home'))
+
+
+def _export_response(df, name):
+    """Stream the result in the requested format, with the requested columns and row filters applied."""
+    # the exports import pyarrow, only on the first export rather than at start up
+    from signals.export import EXPORT_FORMATS, iter_table_bytes, to_arrow_table
+
+    fmt = request.args.get('format', 'arrow')
+    if fmt not in EXPORT_FORMATS:
+        abort(400, f'Unknown format "{fmt}", expecting one of {list(EXPORT_FORMATS)}.')
+    columns = [c for c in request.args.get('columns', '').split(',') if c]
+    try:
+        table = to_arrow_table(df, columns, request.args.getlist('filter'))
+    except (ValueError, KeyError) as e:
+        abort(400, str(e))
+
+    extension = 'arrows' if fmt == 'arrow' else 'parquet'
+    return Response(iter_table_bytes(table, fmt), mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={name}.{extension}'})
+
+
+@app.route('/export/correlations')
+@login_required
+def export_correlations():
+    """Correlation screen, e.g. /export/correlations?start_date=2020-01-01&end_date=2021-01-01&method=ols&topn=500"""
+    from signals.export import get_correlation_export
+
+    args = request.args
+    try:
+        df = get_correlation_export(args['start_date'], args['end_date'], args.get('method', 'pearson'),
+                                    args.get('topn', 10, type=int))
+    except AdmissionError as e:
+        abort(503, str(e))
+    return _export_response(df, 'correlations')
+
+
+@app.route('/export/backtest')
+@login_required
+def export_backtest():
+    """Backtest grid of a pair, e.g. /export/backtest?stock1=AAPL&stock2=MSFT&start_date=...&rp_min=50&rp_max=150"""
+    from signals.export import get_backtest_export
+
+    args = request.args
+    params_range = {'rp_min': args.get('rp_min', 50, type=int), 'rp_max': args.get('rp_max', 150, type=int),
+                    'rp_step': args.get('rp_step', 50, type=int), 'zs_min': args.get('zs_min', 1, type=int),
+                    'zs_max': args.get('zs_max', 3, type=int), 'zs_step': args.get('zs_step', 1, type=int)}
+    try:
+        df = get_backtest_export(args['stock1'], args['stock2'], args['start_date'], args['end_date'], params_range)
+    except AdmissionError as e:
+        abort(503, str(e))
+    return _export_response(df, 'backtest')
+
+
+@app.route('/export/regression')
+@login_required
+def export_regression():
+    """Regression coefficients, e.g. /export/regression?index=^GSPC&stocks=AAPL,MSFT&start_date=...&end_date=..."""
+    from signals.export import get_regression_export
+
+    args = request.args
+    stocks = [s for s in args.get('stocks', '').split(',') if s]
+    df = get_regression_export(args['index'], stocks, args['start_date'], args['end_date'],
+                               args.get('n_nonzero', 10, type=int))
+    return _export_response(df, 'regression')
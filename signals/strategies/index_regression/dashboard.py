@@ -5,16 +5,18 @@ import dash
 import plotly.graph_objs as go
 from dash import dash_table, dcc, html, Output, Input, State
 
+from signals.analytics.precompute import STANDARD_WINDOWS, get_precomputed_lasso, get_standard_windows
 from signals.analytics.regressions import get_regression_full_res, get_top_components_via_lasso
+from signals.data.context import get_index_context, run_parallel
+from signals.data.resultcache import get_cached_result
 from signals.strategies.index_regression.layout import html_layout
 from signals.utils.dashhelper import get_cols_from_reg_tbl
 from signals.utils.dashlogger import logger
-from signals.utils.datahelper import INDEX_COMP, ALL_INDEXES
+from signals.utils.datahelper import ALL_INDEXES
+from signals.utils.tickersearch import get_ticker_index
 
 INDEX_DROPDOWN_OPTIONS = [{'label': i[1:], 'value': i} for i in ALL_INDEXES]
-STOCK_DROPDOWN_OPTIONS = {}
-for k, v in INDEX_COMP.items():
-    STOCK_DROPDOWN_OPTIONS[k] = [{'label': i, 'value': i} for i in v]
+MAX_STOCK_SELECTIONS = 10
 
 
 def init_dashboard(server):
@@ -41,6 +43,12 @@ def init_dashboard(server):
                         start_date=dt.date(2020, 1, 1),
                         end_date=dt.date(2021, 1, 1),
                         display_format='D MMM YYYY',
+                    ),
+                    dcc.RadioItems(
+                        list(STANDARD_WINDOWS.keys()),
+                        id='standard_window',
+                        inline=True,
+                        inputStyle={'margin-right': '3px', 'margin-left': '10px'},
                     )],
                     style={'width': '25%', 'height': '30px', 'padding': 0, 'display': 'inline-block',
                            "margin-right": '15px', "verticalAlign": "top"}
@@ -62,6 +70,7 @@ def init_dashboard(server):
                     dcc.Dropdown(
                         id='stock_dropdown',
                         multi=True,
+                        placeholder='Type to search tickers',
                         style={'height': '40px', }
                     )],
                     style={'width': '50%', 'display': 'inline-block',
@@ -180,42 +189,44 @@ def init_dashboard(server):
     # Custom HTML layout
     app.index_string = html_layout
 
-    # Create Layout
-    app.layout = build_layout
+    # Create Layout, built once as it does not depend on the request
+    app.layout = build_layout()
+
+    @app.callback(
+        Output('regression_period', 'start_date'),
+        Output('regression_period', 'end_date'),
+        Input('standard_window', 'value'),
+        prevent_initial_call=True,
+    )
+    def set_standard_window(window):
+        """
+        Set the regression period to a standard window, the results of which are precomputed.
+        """
+        windows = get_standard_windows()
+        if window not in windows:
+            return dash.no_update, dash.no_update
+        return windows[window]
 
     @app.callback(
         Output('stock_dropdown', 'options'),
-        [Input('stock_dropdown', 'value'), ],
+        Input('stock_dropdown', 'search_value'),
         Input('index_dropdown', 'value'),
+        State('stock_dropdown', 'value'),
     )
-    def update_dropdown_options(values, index_dropdown_value):
+    def update_dropdown_options(search_value, index_dropdown_value, values):
         """
-        Define the callback to limit the number of selections in the second dropdown
+        Options of the stock dropdown: the selected stocks and the best matches of the typed text among the components
+        of the index, so the full list of components is never sent. Only the selected stocks are offered once the max
+        number of selections is reached.
         """
+        ticker_index = get_ticker_index(index_dropdown_value)
+        values = values or []
+        if len(values) >= MAX_STOCK_SELECTIONS:
+            return ticker_index.options(values)
 
-        stock_options = STOCK_DROPDOWN_OPTIONS.get(index_dropdown_value, [])
-        if values is None:
-            return stock_options
-        else:
-            if len(values) == 10:
-                return [option for option in stock_options if option['value'] in values]
-            else:
-                return stock_options
+        return ticker_index.options(list(dict.fromkeys(values + ticker_index.search(search_value))))
 
-    @app.callback(
-        Output('selection_table', 'data'),
-        Output('selection_table', 'columns'),
-        Output('selection_plot', 'figure'),
-        Output('selection_summary', 'children'),
-        Output('selection_output_container', 'children'),
-        Input('reg_button', 'n_clicks'),
-        State('index_dropdown', 'value'),
-        [State('stock_dropdown', 'value'), ],
-        State('regression_period', 'start_date'),
-        State('regression_period', 'end_date'),
-        prevent_initial_call=True,
-    )
-    def get_rg_tb_plot(n_clicks, index_value, stock_values, start_date, end_date):
+    def get_selection_panel(index_value, stock_values, start_date, end_date):
         """
         Generate regression table and plot.
         """
@@ -227,8 +238,9 @@ def init_dashboard(server):
             return [], [], go.Figure(), '', 'No index/stock value, please check!'
         else:
             try:
-                rdf, out_plot, summary = get_regression_full_res(index_value, stock_values, start_date, end_date,
-                                                                 fr'Plot on regression of {stock_values} and {index_value[1:]}')
+                rdf, out_plot, summary = get_cached_result(
+                    get_regression_full_res, index_value, stock_values, start_date, end_date,
+                    fr'Plot on regression of {stock_values} and {index_value[1:]}')
 
                 display_table_cols = get_cols_from_reg_tbl(rdf)
 
@@ -241,20 +253,10 @@ def init_dashboard(server):
 
                 return out_table, display_table_cols, out_plot, summary, reg_output_container_msg
             except Exception as e:
-                return [], [], go.Figure(), '', fr'Cannot get the regression result due to {e}, please check your inputs.'
+                return [], [], go.Figure(), '', \
+                    fr'Cannot get the regression result due to {e}, please check your inputs.'
 
-    @app.callback(
-        Output('opt_table', 'data'),
-        Output('opt_table', 'columns'),
-        Output('opt_plot', 'figure'),
-        Output('opt_str_sum', 'children'),
-        Output('opt_output_container', 'children'),
-        Input('index_dropdown', 'value'),
-        Input('regression_period', 'start_date'),
-        Input('regression_period', 'end_date'),
-        prevent_initial_call=True,
-    )
-    def get_opt_plot(index_value, start_date, end_date):
+    def get_opt_panel(index_value, start_date, end_date, res=None):
         """
         Generate the table containing 10 stocks that best explain the index and the coefficients from the regressions.
 
@@ -264,9 +266,11 @@ def init_dashboard(server):
             return [], [], go.Figure(), '', 'No index value, please check!'
         else:
             try:
-                rdf, plot, summary = get_top_components_via_lasso(index_value, start_date, end_date,
-                                                                  fr'Plot on regression of best 10 stocks and {index_value[1:]}',
-                                                                  n_nonzero=10)
+                if res is None:
+                    res = get_cached_result(get_top_components_via_lasso, index_value, start_date, end_date,
+                                            fr'Plot on regression of best 10 stocks and {index_value[1:]}',
+                                            n_nonzero=10)
+                rdf, plot, summary = res
 
                 display_table_cols = get_cols_from_reg_tbl(rdf)
 
@@ -281,4 +285,48 @@ def init_dashboard(server):
             except Exception as e:
                 return [], [], go.Figure(), '', fr'Cannot get best 10 stocks due to {e},  please check your inputs.'
 
+    @app.callback(
+        Output('selection_table', 'data'),
+        Output('selection_table', 'columns'),
+        Output('selection_plot', 'figure'),
+        Output('selection_summary', 'children'),
+        Output('selection_output_container', 'children'),
+        Output('opt_table', 'data'),
+        Output('opt_table', 'columns'),
+        Output('opt_plot', 'figure'),
+        Output('opt_str_sum', 'children'),
+        Output('opt_output_container', 'children'),
+        Input('reg_button', 'n_clicks'),
+        Input('index_dropdown', 'value'),
+        Input('regression_period', 'start_date'),
+        Input('regression_period', 'end_date'),
+        State('stock_dropdown', 'value'),
+        prevent_initial_call=True,
+    )
+    def get_regression_panels(n_clicks, index_value, start_date, end_date, stock_values):
+        """
+        Refresh the regression panels. The submit button refreshes the regression of the picked stocks only. A new index
+        or period refreshes the Lasso selection, along with the regression of the picked stocks once submitted, the two
+        built concurrently on the thread pool from a single read of the index returns.
+        """
+        triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+        if triggered == ['reg_button.n_clicks']:
+            return (*get_selection_panel(index_value, stock_values, start_date, end_date), *[dash.no_update] * 5)
+
+        try:
+            res = get_precomputed_lasso(index_value, start_date, end_date, 10) if index_value is not None else None
+        except Exception as e:
+            logger.warn(f'Cannot load the precomputed Lasso selection due to {e}, computing it instead.')
+            res = None
+        if not n_clicks or not stock_values:
+            return (*[dash.no_update] * 5, *get_opt_panel(index_value, start_date, end_date, res))
+
+        if res is None:
+            # the Lasso selection reads the whole index, read here first so that the picked stocks wait for and slice
+            # the same read rather than reading on their own
+            get_index_context(index_value, start_date, end_date).load()
+        selection, opt = run_parallel((get_selection_panel, (index_value, stock_values, start_date, end_date)),
+                                      (get_opt_panel, (index_value, start_date, end_date, res)))
+        return (*selection, *opt)
+
     return app.server
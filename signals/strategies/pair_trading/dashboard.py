@@ -1,17 +1,23 @@
 """Instantiate Dash app on pair-trading."""
 import datetime as dt
 import time
+import uuid
 
 import dash
 import dash_bootstrap_components as dbc
-import pandas as pd
+import plotly.graph_objs as go
 from dash import dash_table, dcc, html, Output, Input, State
 from dash.dash_table.Format import Format, Scheme
 
 from signals.analytics.correlations import CORR_METHODS_LIST, get_correlation_full_res
-from signals.analytics.strategyrunner import get_bt_results, get_bt_html_plot
+from signals.analytics.monitor import get_default_warm_up, get_monitor_state, start_monitor
+from signals.analytics.portfolio import run_portfolio_backtest
+from signals.analytics.precompute import STANDARD_WINDOWS, get_precomputed_correlation, get_standard_windows
 from signals.strategies.pair_trading.layout import html_layout
-from signals.utils.dashhelper import get_cols_from_bt_tbl
+from signals.utils.admission import AdmissionError, estimate_backtest_cost, estimate_correlation_cost, \
+    get_admitted_topn, run_admitted
+from signals.utils.dashhelper import TABLE_PAGE_SIZE, cache_table, get_cached_table, get_cols_from_bt_tbl, \
+    get_page_active_cell, get_table_page, get_table_view, value_plot
 from signals.utils.dashlogger import logger, dashLoggerHandler
 
 RP_MIN = 50
@@ -20,6 +26,9 @@ RP_STEP = 50
 ZS_MIN = 1
 ZS_MAX = 3
 ZS_STEP = 1
+PARAMS_RANGE = {'rp_min': RP_MIN, 'rp_max': RP_MAX, 'rp_step': RP_STEP, 'zs_min': ZS_MIN, 'zs_max': ZS_MAX,
+                'zs_step': ZS_STEP}
+MONITOR_REFRESH_SECONDS = 5
 
 
 def init_dashboard(server):
@@ -47,6 +56,12 @@ def init_dashboard(server):
                         start_date=dt.date(2020, 1, 1),
                         end_date=dt.date(2021, 1, 1),
                         display_format='D MMM YYYY',
+                    ),
+                    dcc.RadioItems(
+                        list(STANDARD_WINDOWS.keys()),
+                        id='standard_window',
+                        inline=True,
+                        inputStyle={'margin-right': '3px', 'margin-left': '10px'},
                     ), ],
                     style={'width': '25%', 'height': '30px', 'display': 'inline-block',
                            "margin-right": '0px', "verticalAlign": "top"}
@@ -94,11 +109,17 @@ def init_dashboard(server):
 
             html.Div(
                 children=[
+                    dcc.Store(id='regression_table_key'),
                     dash_table.DataTable(
                         id='regression_table',
-                        sort_action='native',
+                        sort_action='custom',
                         sort_mode='single',
-                        page_action='native',
+                        sort_by=[],
+                        filter_action='custom',
+                        filter_query='',
+                        page_action='custom',
+                        page_current=0,
+                        page_size=TABLE_PAGE_SIZE,
                         style_header={
                             'padding': '1px',
                             'minwidth': '200px',
@@ -120,10 +141,15 @@ def init_dashboard(server):
                             'overflowY': 'auto',
                             'overflowx': 'auto'
                         },
-                        export_format='xlsx',
-                        export_headers='display',
                         fill_width=True,
                     ),
+                    # the table is paged on the server, its export holds all the pages
+                    html.Button(
+                        'Export',
+                        id='regression_table_export',
+                        style={'font-size': '14px', 'height': '30px', 'width': '100px', "margin-top": '5px', }
+                    ),
+                    dcc.Download(id='regression_table_download'),
                 ],
                 style={'padding': '25px', 'flex': 1}
             ),
@@ -222,16 +248,16 @@ def init_dashboard(server):
                         [
                             dbc.ModalHeader(dbc.ModalTitle("Trade details of strategy backtesting")),
                             dbc.ModalBody([
-                                html.Iframe(
-                                    id='bt_plot',
-                                    style={
-                                        'border': 'none',
-                                        'height': '1400px',
-                                        'width': '100%',
-                                        'padding': '0',
-                                        'margin': '0'
-                                    }
-                                )]),
+                                dcc.Loading(
+                                    dcc.Graph(
+                                        id='bt_plot',
+                                        style={
+                                            'height': '1400px',
+                                            'width': '100%',
+                                            'padding': '0',
+                                            'margin': '0'
+                                        }
+                                    ))]),
                             dbc.ModalFooter(
                                 dbc.Button(
                                     "Close",
@@ -255,8 +281,162 @@ def init_dashboard(server):
 
             html.Div(
                 children=[
+                    dcc.Store(id='optimization_table_key'),
                     dash_table.DataTable(
                         id='optimization_table',
+                        sort_action='custom',
+                        sort_mode='single',
+                        sort_by=[],
+                        filter_action='custom',
+                        filter_query='',
+                        page_action='custom',
+                        page_current=0,
+                        page_size=TABLE_PAGE_SIZE,
+                        style_header={
+                            'padding': '1px',
+                            'minwidth': '200px',
+                            'whiteSpace': 'normal',
+                            'fontWeight': 'bold',
+                            'textOverflow': 'ellipsis',
+                            'overflow': 'hidden',
+                        },
+                        style_table={
+                            'overflowY': 'auto',
+                            'overflowx': 'auto'
+                        },
+                        style_cell={
+                            'textAlign': 'center',
+                            'height': 'auto',
+                            'whiteSpace': 'normal',
+                            'minwidth': '100px',
+                            'padding': '1px',
+                            'overflowY': 'auto',
+                            'overflowx': 'auto'
+                        },
+                        fill_width=True,
+                    ),
+                    # the table is paged on the server, its export holds all the pages
+                    html.Button(
+                        'Export',
+                        id='optimization_table_export',
+                        style={'font-size': '14px', 'height': '30px', 'width': '100px', "margin-top": '5px', }
+                    ),
+                    dcc.Download(id='optimization_table_download'),
+                ],
+                style={'padding': '25px', 'flex': 1}
+            ),
+
+            html.Div([
+                html.H4('Portfolio Backtest'),
+                html.Div('Backtest all pairs in the correlation table at once with equal shared capital, using the '
+                         'backtest period, rolling period and z-score limit above.'),
+                html.Button(
+                    'Start',
+                    id='portfolio_button',
+                    style={'font-size': '14px', 'height': '40px', 'width': '140px',
+                           'display': 'inline-block', "margin-bottom": '10px', "margin-top": '10px'}
+                ),
+                html.Div(id='portfolio_output_container',
+                         style={'color': 'blue', 'fontSize': 16, 'fontWeight': 'bold', 'margin-top': '10px',
+                                'margin-bottom': '10px'}),
+            ], style={'margin-left': '10px', }),
+
+            html.Div(
+                children=[
+                    dash_table.DataTable(
+                        id='portfolio_table',
+                        sort_action='native',
+                        sort_mode='single',
+                        page_action='native',
+                        style_header={
+                            'padding': '1px',
+                            'minwidth': '200px',
+                            'whiteSpace': 'normal',
+                            'fontWeight': 'bold',
+                            'textOverflow': 'ellipsis',
+                            'overflow': 'hidden',
+                        },
+                        style_table={
+                            'overflowY': 'auto',
+                            'overflowx': 'auto'
+                        },
+                        style_cell={
+                            'textAlign': 'center',
+                            'height': 'auto',
+                            'whiteSpace': 'normal',
+                            'minwidth': '100px',
+                            'padding': '1px',
+                            'overflowY': 'auto',
+                            'overflowx': 'auto'
+                        },
+                        export_format='xlsx',
+                        export_headers='display',
+                        fill_width=True,
+                    ),
+                ],
+                style={'padding': '25px', 'flex': 1}
+            ),
+
+            dcc.Graph(id='portfolio_plot', style={'padding': '1px', 'width': '100%'}),
+
+            html.Div(
+                children=[
+                    dash_table.DataTable(
+                        id='attribution_table',
+                        sort_action='native',
+                        sort_mode='single',
+                        page_action='native',
+                        style_header={
+                            'padding': '1px',
+                            'minwidth': '200px',
+                            'whiteSpace': 'normal',
+                            'fontWeight': 'bold',
+                            'textOverflow': 'ellipsis',
+                            'overflow': 'hidden',
+                        },
+                        style_table={
+                            'overflowY': 'auto',
+                            'overflowx': 'auto'
+                        },
+                        style_cell={
+                            'textAlign': 'center',
+                            'height': 'auto',
+                            'whiteSpace': 'normal',
+                            'minwidth': '100px',
+                            'padding': '1px',
+                            'overflowY': 'auto',
+                            'overflowx': 'auto'
+                        },
+                        export_format='xlsx',
+                        export_headers='display',
+                        fill_width=True,
+                    ),
+                ],
+                style={'padding': '25px', 'flex': 1}
+            ),
+
+            html.Div([
+                html.H4('Live Monitor'),
+                html.Div('Monitor the z-scores of all pairs in the correlation table, using the rolling period and '
+                         'z-score limit from the sliders.'),
+                html.Button(
+                    'Start',
+                    id='monitor_button',
+                    style={'font-size': '14px', 'height': '40px', 'width': '140px',
+                           'display': 'inline-block', "margin-bottom": '10px', "margin-top": '10px'}
+                ),
+                html.Div(id='monitor_output_container',
+                         style={'color': 'blue', 'fontSize': 16, 'fontWeight': 'bold', 'margin-top': '10px',
+                                'margin-bottom': '10px'}),
+                dcc.Interval(id='monitor-interval', interval=MONITOR_REFRESH_SECONDS * 1000, n_intervals=0),
+                # identifies the monitor of this browser session
+                dcc.Store(id='monitor_key', storage_type='session'),
+            ], style={'margin-left': '10px', }),
+
+            html.Div(
+                children=[
+                    dash_table.DataTable(
+                        id='monitor_table',
                         sort_action='native',
                         sort_mode='single',
                         page_action='native',
@@ -289,6 +469,31 @@ def init_dashboard(server):
                 style={'padding': '25px', 'flex': 1}
             ),
 
+            html.Div(
+                children=[
+                    html.H5('Alerts'),
+                    dash_table.DataTable(
+                        id='monitor_alerts_table',
+                        page_action='native',
+                        page_size=10,
+                        style_header={
+                            'padding': '1px',
+                            'whiteSpace': 'normal',
+                            'fontWeight': 'bold',
+                        },
+                        style_cell={
+                            'textAlign': 'center',
+                            'height': 'auto',
+                            'whiteSpace': 'normal',
+                            'minwidth': '100px',
+                            'padding': '1px',
+                        },
+                        fill_width=True,
+                    ),
+                ],
+                style={'padding': '25px', 'flex': 1}
+            ),
+
             html.Div([
                 dcc.Interval(id='log-interval', interval=10 * 1000, n_intervals=0),
                 html.H4(id='div_out', children='Log'),
@@ -307,19 +512,73 @@ def init_dashboard(server):
     app.layout = build_layout()
 
     @app.callback(
-        Output('regression_table', 'data'),
+        Output('regression_period', 'start_date'),
+        Output('regression_period', 'end_date'),
+        Input('standard_window', 'value'),
+        prevent_initial_call=True,
+    )
+    def set_standard_window(window):
+        """
+        Set the regression period to a standard window, the results of which are precomputed.
+        """
+        windows = get_standard_windows()
+        if window not in windows:
+            return dash.no_update, dash.no_update
+        return windows[window]
+
+    # identical computations requested concurrently, e.g. by analysts opening the dashboard after the morning
+    # refresh, run once, and all of them are admitted against their estimated cost
+    def get_correlation_df(start_date, end_date, method, topn):
+        rdf = get_precomputed_correlation(start_date, end_date, method, topn)
+        if rdf is None:
+            rdf = run_admitted(('correlation', start_date, end_date, method, topn),
+                               estimate_correlation_cost(start_date, end_date, method, topn),
+                               get_correlation_full_res, start_date, end_date, method, topn)
+        return rdf
+
+    def get_bt(stock1, stock2, start_date, end_date, rp_value, zs_value):
+        # backtrader is imported on the first backtest rather than at start up
+        from signals.analytics.strategyrunner import get_bt_results
+
+        params = {'period': rp_value, 'zs': zs_value, }
+        return run_admitted(('backtest', stock1, stock2, start_date, end_date, rp_value, zs_value),
+                            estimate_backtest_cost(start_date, end_date, PARAMS_RANGE),
+                            get_bt_results, stock1=stock1, stock2=stock2, start_date=start_date, end_date=end_date,
+                            params_range=PARAMS_RANGE, params=params)
+
+    def get_optimization_df(stock1, stock2, start_date, end_date, rp_value, zs_value):
+        return get_bt(stock1, stock2, start_date, end_date, rp_value, zs_value)[2]
+
+    # builders of the tables paged on the server, by the first item of their keys
+    table_builders = {'correlation': get_correlation_df, 'optimization': get_optimization_df}
+
+    def get_table(key):
+        """
+        Full result table of the key, rebuilt if this worker does not hold it.
+        """
+        return get_cached_table(key, table_builders[key[0]], *key[1:])
+
+    def get_selected_pair(active_cell):
+        """
+        Tickers of the pair selected in the correlation table, rows are identified by their pair on any page.
+        """
+        if not active_cell or not active_cell.get('row_id'):
+            return None
+        return active_cell['row_id'].split(' - ')
+
+    @app.callback(
+        Output('regression_table_key', 'data'),
         Output('regression_table', 'columns'),
-        Output('regression_table', 'active_cell'),
-        State('regression_table', 'active_cell'),
+        Output('regression_table', 'page_current'),
         Input('corr_button', 'n_clicks'),
         Input('method', 'value'),
         Input('topnpairs', 'value'),
         Input('regression_period', 'start_date'),
         Input('regression_period', 'end_date'),
         prevent_initial_call=True)
-    def get_correlation_table(active_cell, submit, method, topn, start_date, end_date):
+    def get_correlation_table(submit, method, topn, start_date, end_date):
         """
-        Get top correlated pairs in table.
+        Get top correlated pairs in table. The table is held on the server, which sends it page by page.
 
         """
 
@@ -329,6 +588,12 @@ def init_dashboard(server):
             logger.wanr(fr'Topn must be an int, got error of: {e}. Please check your input, using 10 as default.')
             topn = 10
 
+        admitted_topn = get_admitted_topn(start_date, end_date, method, topn)
+        if admitted_topn < topn:
+            logger.warn(fr'Finding {topn} pairs under the method of "{method}" is too expensive, finding the '
+                        fr'{admitted_topn} most correlated pairs instead.')
+            topn = admitted_topn
+
         logger.info(
             fr'Start calculation finding {topn} most correlated pairs between '
             f'{start_date} and {end_date}, showing metrics under the method of "{method}".'
@@ -336,7 +601,15 @@ def init_dashboard(server):
 
         t1 = time.time()
 
-        rdf = get_correlation_full_res(start_date, end_date, method, topn)
+        try:
+            rdf = get_correlation_df(start_date, end_date, method, topn)
+        except AdmissionError as e:
+            logger.error(str(e))
+            return [dash.no_update] * 3
+        if rdf.empty or 'Stocks Pair' not in rdf.columns:
+            logger.error(fr'No pairs found between {start_date} and {end_date}, please check the dates.')
+            return [dash.no_update] * 3
+        key = cache_table(['correlation', start_date, end_date, method, topn], rdf)
 
         display_table_cols = []
         for i in rdf.columns:
@@ -349,33 +622,96 @@ def init_dashboard(server):
                 display_table_cols.append({'name': i, 'id': i, 'hideable': True, 'type': 'numeric',
                                            'format': {'specifier': '.4f'}})
 
-        out_table = rdf.to_dict('records')
-        if active_cell is None:
-            active_cell = {'row': 0, 'column': 0, 'column_id': 'Stocks Pair', 'row_id': out_table[0]['Stocks Pair']}
-
         logger.info('Finished calculation finding the most correlated pairs.')
 
         t2 = time.time()
         dlt = t2 - t1
         logger.info('Total time used in finding most correlated pairs: ' + '%0.2f' % dlt + ' seconds.')
 
-        return out_table, display_table_cols, active_cell
+        return key, display_table_cols, 0
+
+    @app.callback(
+        Output('regression_table', 'data'),
+        Output('regression_table', 'page_count'),
+        Output('regression_table', 'active_cell'),
+        Input('regression_table_key', 'data'),
+        Input('regression_table', 'page_current'),
+        Input('regression_table', 'page_size'),
+        Input('regression_table', 'sort_by'),
+        Input('regression_table', 'filter_query'),
+        State('regression_table', 'active_cell'),
+        prevent_initial_call=True)
+    def get_correlation_page(key, page_current, page_size, sort_by, filter_query, active_cell):
+        """
+        The visible page of the correlation table. A new table selects its first pair unless the selected one is in
+        it, and the selected pair is highlighted at its row of the page, if on it.
+        """
+        if key is None:
+            return [], 1, dash.no_update
+        try:
+            table = get_table(key)
+        except AdmissionError as e:
+            logger.error(str(e))
+            return dash.no_update, dash.no_update, dash.no_update
+        records, page_count = get_table_page(table, page_current, page_size, sort_by, filter_query,
+                                             row_id='Stocks Pair')
+
+        new_table = 'regression_table_key.data' in [t['prop_id'] for t in dash.callback_context.triggered]
+        if new_table and records and (not active_cell or active_cell.get('row_id') not in set(table['Stocks Pair'])):
+            new_active_cell = {'row': 0, 'column': 0, 'column_id': 'Stocks Pair', 'row_id': records[0]['id']}
+        else:
+            new_active_cell = get_page_active_cell(records, active_cell)
+        return records, page_count, dash.no_update if new_active_cell == active_cell else new_active_cell
+
+    def export_table(key, sort_by, filter_query, filename):
+        """
+        All the pages of a table paged on the server, filtered and sorted as shown, as an Excel file.
+        """
+        if key is None:
+            return dash.no_update
+        try:
+            df = get_table_view(get_table(key), sort_by, filter_query)
+        except AdmissionError as e:
+            logger.error(str(e))
+            return dash.no_update
+        return dcc.send_data_frame(df.to_excel, filename, sheet_name=key[0], index=False)
+
+    @app.callback(
+        Output('regression_table_download', 'data'),
+        Input('regression_table_export', 'n_clicks'),
+        State('regression_table_key', 'data'),
+        State('regression_table', 'sort_by'),
+        State('regression_table', 'filter_query'),
+        prevent_initial_call=True)
+    def export_correlation_table(n_clicks, key, sort_by, filter_query):
+        return export_table(key, sort_by, filter_query, 'correlations.xlsx')
+
+    @app.callback(
+        Output('optimization_table_download', 'data'),
+        Input('optimization_table_export', 'n_clicks'),
+        State('optimization_table_key', 'data'),
+        State('optimization_table', 'sort_by'),
+        State('optimization_table', 'filter_query'),
+        prevent_initial_call=True)
+    def export_optimization_table(n_clicks, key, sort_by, filter_query):
+        return export_table(key, sort_by, filter_query, 'optimization.xlsx')
 
     @app.callback(
         Output('slider-output-container', 'children'),
         Input('regression_table', 'active_cell'),
-        State('regression_table', 'data'),
         Input('rp_slider', 'value'),
         Input('zs_slider', 'value'),
         prevent_initial_call=True,
     )
-    def update_slider_output(active_cell, tdf, rp_value, zs_value):
+    def update_slider_output(active_cell, rp_value, zs_value):
         """
         Callback function to update the sliders outputs.
 
         """
-        tdf = pd.DataFrame(tdf)
-        [stock1, stock2] = tdf.loc[active_cell['row'], 'Stocks Pair'].split(' - ')
+        pair = get_selected_pair(active_cell)
+        if pair is None:
+            return dash.no_update
+        [stock1, stock2] = pair
 
         return fr'You have selected pair of "{stock1}" and "{stock2}" to backtest with parameter of ' \
                fr'Rolling Period: "{rp_value}", Z-Score limit: "{zs_value}".'
@@ -384,44 +720,42 @@ def init_dashboard(server):
         Output('strategy_table', 'data'),
         Output('strategy_table', 'columns'),
         Output('strategy_plot', 'figure'),
-        Output('bt_plot', 'srcDoc'),
-        Output('optimization_table', 'data'),
+        Output('optimization_table_key', 'data'),
         Output('optimization_table', 'columns'),
+        Output('optimization_table', 'page_current'),
         # Input('bt_button', 'n_clicks'),
         Input('regression_table', 'active_cell'),
-        State('regression_table', 'data'),
         Input('backtest_period', 'start_date'),
         Input('backtest_period', 'end_date'),
         Input('rp_slider', 'value'),
         Input('zs_slider', 'value'),
         prevent_initial_call=True,
     )
-    def get_bt_plot(active_cell, tdf, start_date, end_date, rp_value, zs_value):
+    def get_bt_plot(active_cell, start_date, end_date, rp_value, zs_value):
         """
-        Backtesting results in table and plot.
+        Backtesting results in table and plot, the table of all the parameters is held on the server.
 
         """
+        pair = get_selected_pair(active_cell)
+        if pair is None:
+            return [dash.no_update] * 6
 
         logger.info(fr'Start generating results of backtesting between {start_date} and {end_date}.')
         t1 = time.time()
 
-        params_range = {'rp_min': RP_MIN, 'rp_max': RP_MAX, 'rp_step': RP_STEP, 'zs_min': ZS_MIN, 'zs_max': ZS_MAX,
-                        'zs_step': ZS_STEP}
-        params = {'period': rp_value, 'zs': zs_value, }
-
-        tdf = pd.DataFrame(tdf)
-        [stock1, stock2] = tdf.loc[active_cell['row'], 'Stocks Pair'].split(' - ')
-        par_df, plot_sub, total_df = get_bt_results(stock1=stock1, stock2=stock2, start_date=start_date,
-                                                    end_date=end_date, params_range=params_range, params=params)
+        [stock1, stock2] = pair
+        try:
+            par_df, plot_sub, total_df = get_bt(stock1, stock2, start_date, end_date, rp_value, zs_value)
+        except AdmissionError as e:
+            logger.error(str(e))
+            return [dash.no_update] * 6
         display_table_cols = get_cols_from_bt_tbl(par_df)
 
         out_table = par_df.to_dict('records')
 
         display_table_cols_total = get_cols_from_bt_tbl(total_df)
 
-        out_table_total = total_df.to_dict('records')
-
-        html_plot = get_bt_html_plot(stock1, stock2, start_date, end_date, params=params)
+        key = cache_table(['optimization', stock1, stock2, start_date, end_date, rp_value, zs_value], total_df)
 
         logger.info('Finished generating results of backtesting.')
 
@@ -429,7 +763,55 @@ def init_dashboard(server):
         dlt = t2 - t1
         logger.info('Total time used in running backtest: ' + '%0.2f' % dlt + ' seconds.')
 
-        return out_table, display_table_cols, plot_sub, html_plot, out_table_total, display_table_cols_total
+        return out_table, display_table_cols, plot_sub, key, display_table_cols_total, 0
+
+    @app.callback(
+        Output('optimization_table', 'data'),
+        Output('optimization_table', 'page_count'),
+        Input('optimization_table_key', 'data'),
+        Input('optimization_table', 'page_current'),
+        Input('optimization_table', 'page_size'),
+        Input('optimization_table', 'sort_by'),
+        Input('optimization_table', 'filter_query'),
+        prevent_initial_call=True)
+    def get_optimization_page(key, page_current, page_size, sort_by, filter_query):
+        """
+        The visible page of the table of all the parameters.
+        """
+        if key is None:
+            return [], 1
+        try:
+            table = get_table(key)
+        except AdmissionError as e:
+            logger.error(str(e))
+            return dash.no_update, dash.no_update
+        return get_table_page(table, page_current, page_size, sort_by, filter_query)
+
+    @app.callback(
+        Output('bt_plot', 'figure'),
+        Input('modal-body-scroll', 'is_open'),
+        State('regression_table', 'active_cell'),
+        State('backtest_period', 'start_date'),
+        State('backtest_period', 'end_date'),
+        State('rp_slider', 'value'),
+        State('zs_slider', 'value'),
+        prevent_initial_call=True,
+    )
+    def get_trade_plot(is_open, active_cell, start_date, end_date, rp_value, zs_value):
+        """
+        Trade details of the selected pair, only rendered once the dialog is opened.
+
+        """
+        pair = get_selected_pair(active_cell)
+        if not is_open or pair is None:
+            return dash.no_update
+
+        from signals.analytics.strategyrunner import get_bt_trade_plot
+
+        [stock1, stock2] = pair
+        params = {'period': rp_value, 'zs': zs_value, }
+
+        return get_bt_trade_plot(stock1, stock2, start_date, end_date, params=params)
 
     @app.callback(
         Output("modal-body-scroll", "is_open"),
@@ -448,6 +830,113 @@ def init_dashboard(server):
             return not is_open
         return is_open
 
+    @app.callback(
+        Output('portfolio_table', 'data'),
+        Output('portfolio_table', 'columns'),
+        Output('portfolio_plot', 'figure'),
+        Output('attribution_table', 'data'),
+        Output('attribution_table', 'columns'),
+        Output('portfolio_output_container', 'children'),
+        Input('portfolio_button', 'n_clicks'),
+        State('regression_table_key', 'data'),
+        State('backtest_period', 'start_date'),
+        State('backtest_period', 'end_date'),
+        State('rp_slider', 'value'),
+        State('zs_slider', 'value'),
+        prevent_initial_call=True,
+    )
+    def get_portfolio_plot(n_clicks, key, start_date, end_date, rp_value, zs_value):
+        """
+        Portfolio backtest of all the pairs in the correlation table, with per-pair attribution.
+
+        """
+        try:
+            tdf = get_table(key).to_dict('records') if key is not None else []
+        except AdmissionError as e:
+            logger.error(str(e))
+            return [], [], go.Figure(), [], [], str(e)
+        if not tdf:
+            return [], [], go.Figure(), [], [], 'No pairs to backtest, please get the correlations first.'
+
+        logger.info(fr'Start portfolio backtest of {len(tdf)} pairs between {start_date} and {end_date}.')
+        t1 = time.time()
+
+        pairs = [row['Stocks Pair'].split(' - ') for row in tdf]
+        params = {'period': rp_value, 'zs': zs_value, }
+        stats_df, attribution_df, df_tv = run_portfolio_backtest(pairs, start_date, end_date, params)
+        if stats_df.empty:
+            return [], [], go.Figure(), [], [], 'Failed to get portfolio results, please check your inputs.'
+
+        t2 = time.time()
+        dlt = t2 - t1
+        logger.info('Total time used in running portfolio backtest: ' + '%0.2f' % dlt + ' seconds.')
+
+        return stats_df.to_dict('records'), get_cols_from_bt_tbl(stats_df), value_plot(df_tv, start_date, end_date), \
+            attribution_df.to_dict('records'), get_cols_from_bt_tbl(attribution_df), ''
+
+    @app.callback(
+        Output('monitor_output_container', 'children'),
+        Output('monitor_key', 'data'),
+        Input('monitor_button', 'n_clicks'),
+        State('monitor_key', 'data'),
+        State('regression_table_key', 'data'),
+        State('backtest_period', 'start_date'),
+        State('backtest_period', 'end_date'),
+        State('rp_slider', 'value'),
+        State('zs_slider', 'value'),
+        prevent_initial_call=True,
+    )
+    def start_pair_monitor(n_clicks, monitor_key, key, start_date, end_date, rp_value, zs_value):
+        """
+        Start monitoring the pairs of the correlation table, replacing the monitor of the session. The windows are
+        warmed up from the preceding close prices, then, unless a live feed file is configured, the close prices of the
+        backtest period are replayed as the feed.
+        """
+        try:
+            tdf = get_table(key).to_dict('records') if key is not None else []
+        except AdmissionError as e:
+            logger.error(str(e))
+            return str(e), dash.no_update
+        if not tdf:
+            return 'No pairs to monitor, please get the correlations first.', dash.no_update
+
+        monitor_key = monitor_key or uuid.uuid4().hex
+        pairs = [row['Stocks Pair'].split(' - ') for row in tdf]
+        warm_up = get_default_warm_up(sorted({t for p in pairs for t in p}), rp_value, start_date)
+        start_monitor(monitor_key, pairs, rp_value, zs_value, start_date=start_date, end_date=end_date,
+                      warm_up=warm_up)
+
+        return fr'Monitoring {len(pairs)} pairs with Rolling Period: "{rp_value}", Z-Score limit: "{zs_value}".', \
+            monitor_key
+
+    @app.callback(
+        Output('monitor_table', 'data'),
+        Output('monitor_table', 'columns'),
+        Output('monitor_alerts_table', 'data'),
+        Output('monitor_alerts_table', 'columns'),
+        Input('monitor-interval', 'n_intervals'),
+        State('monitor_key', 'data'),
+    )
+    def update_monitor_table(n, monitor_key):
+        """
+        Refresh the live monitor table of the session, pairs beyond the z-score limit first, and its alerts, newest
+        first.
+        """
+        state = get_monitor_state(monitor_key)
+        if state is None:
+            return [], [], [], []
+
+        rdf, alerts = state
+        if not rdf.empty:
+            rdf = rdf.reindex(rdf['Z-Score'].abs().sort_values(ascending=False).index)
+        display_table_cols = [{'name': i, 'id': i, 'hideable': True, } if i in ['Stocks Pair', 'Signal'] else
+                              {'name': i, 'id': i, 'hideable': True, 'type': 'numeric',
+                               'format': {'specifier': '.4f'}} for i in rdf.columns]
+        alert_cols = [{'name': i, 'id': i, 'type': 'numeric', 'format': {'specifier': '.2f'}} if i == 'Z-Score' else
+                      {'name': i, 'id': i} for i in ['Time', 'Stocks Pair', 'Z-Score', 'Signal']]
+
+        return rdf.to_dict('records'), display_table_cols, alerts, alert_cols
+
     @app.callback(
         Output('console-out', 'srcDoc'),
         Input('log-interval', 'n_intervals')
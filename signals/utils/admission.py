@@ -0,0 +1,183 @@
+"""
+Coalescing of identical computations and admission control of expensive ones.
+
+Concurrent requests for the same result share a single computation: the first caller runs it and the others wait for
+its result. Each computation is admitted against an estimate of its cost, in seconds of computing. Computations wait in
+a queue while the running ones use up the capacity, and are rejected if the queue is full, if they wait too long, or if
+they alone cost more than MAX_REQUEST_COST. The correlation screen is degraded to fewer pairs rather than rejected.
+Results found in the persistent result cache are served without admission.
+"""
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+
+from signals.data.resultcache import RESULT_CACHE
+from signals.utils.dashlogger import logger
+from signals.utils.datahelper import ALL_STOCKS
+
+# estimated seconds of computing running at once
+MAX_RUNNING_COST = 120
+# estimated seconds of computing of a single request
+MAX_REQUEST_COST = 600
+# computations waiting for capacity, further ones are rejected
+MAX_QUEUED = 16
+# seconds a computation waits for capacity before being rejected
+ADMISSION_TIMEOUT = 60
+# pairs of a correlation screen, whatever its cost, the table of results is held in memory
+MAX_TOPN_PAIRS = 50000
+
+# seconds per stock pair per bar of the correlation matrix screening all the stocks
+SCREEN_COST = 2.5e-9
+# seconds per pair per bar of the correlation methods, measured on one core
+METHOD_COSTS = {'pearson': 2e-6, 'ols': 6e-6, 'kalman': 2e-4, 'coint': 3e-5}
+# seconds per bar of one parameter combination of the pair trading backtest
+BACKTEST_COST = 3e-4
+
+
+class AdmissionError(Exception):
+    """The computation is rejected, as too expensive or waiting too long for capacity."""
+
+
+class SingleFlight:
+    """
+    One computation per key at a time, concurrent callers of the key share its result or its exception. The result
+    is shared, callers must not modify it.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            logger.info(fr'Waiting for the same computation of {key} in progress.')
+            return future.result()
+
+        try:
+            res = fn(*args, **kwargs)
+            future.set_result(res)
+            return res
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+class AdmissionControl:
+    """
+    Capacity shared by the running computations, weighted by their estimated cost.
+    :param capacity: estimated seconds of computing running at once
+    :type capacity: float
+    :param max_queued: computations waiting for capacity
+    :type max_queued: int
+    :param timeout: seconds a computation waits for capacity
+    :type timeout: float
+    """
+
+    def __init__(self, capacity=MAX_RUNNING_COST, max_queued=MAX_QUEUED, timeout=ADMISSION_TIMEOUT):
+        self.capacity = capacity
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.running = 0.0
+        self.queued = 0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def admit(self, cost, name=''):
+        # a computation costing more than the capacity runs alone
+        cost = min(cost, self.capacity)
+        with self.cond:
+            if self.running + cost > self.capacity:
+                if self.queued >= self.max_queued:
+                    raise AdmissionError(fr'Too many computations waiting, {name} rejected, please retry later.')
+                self.queued += 1
+                try:
+                    admitted = self.cond.wait_for(lambda: self.running + cost <= self.capacity, timeout=self.timeout)
+                finally:
+                    self.queued -= 1
+                if not admitted:
+                    raise AdmissionError(fr'No capacity for {name} after {self.timeout} seconds, please retry later.')
+            self.running += cost
+
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.running -= cost
+                self.cond.notify_all()
+
+
+FLIGHTS = SingleFlight()
+ADMISSION = AdmissionControl()
+
+
+def run_admitted(key, cost, fn, *args, **kwargs):
+    """
+    Run the computation once for all the concurrent callers of the key, once admitted, unless its result is in the
+    persistent result cache.
+    :param key: hashable key identifying the result, its first item naming the computation
+    :type key: tuple
+    :param cost: estimated seconds of computing
+    :type cost: float
+    :param fn: the computation
+    :type fn: callable
+    :return: result of fn
+    :raises AdmissionError: if the computation is rejected
+    """
+    # only computations are limited, a result served from the result cache never is
+    def compute():
+        if cost > MAX_REQUEST_COST:
+            raise AdmissionError(fr'{key[0]} is estimated to take {cost:.0f} seconds, over the limit of '
+                                 fr'{MAX_REQUEST_COST} seconds, please narrow the inputs.')
+        with ADMISSION.admit(cost, key[0]):
+            return fn(*args, **kwargs)
+
+    return FLIGHTS.do(key, RESULT_CACHE.get, fn, args, kwargs, compute)
+
+
+def get_bars(start_date, end_date):
+    """
+    Number of business days between the dates.
+    :rtype: int
+    """
+    return max(int(np.busday_count(str(start_date)[:10], str(end_date)[:10])), 1)
+
+
+def estimate_correlation_cost(start_date, end_date, method, topn):
+    """
+    Estimated seconds of a correlation screen: the correlation matrix of all the stocks, then the method on the pairs.
+    :rtype: float
+    """
+    bars = get_bars(start_date, end_date)
+    return SCREEN_COST * len(ALL_STOCKS) ** 2 * bars + METHOD_COSTS.get(method, 0) * topn * bars
+
+
+def get_admitted_topn(start_date, end_date, method, topn):
+    """
+    Number of pairs of the correlation screen, reduced to what fits in MAX_REQUEST_COST and MAX_TOPN_PAIRS.
+    :rtype: int
+    """
+    bars = get_bars(start_date, end_date)
+    screen = SCREEN_COST * len(ALL_STOCKS) ** 2 * bars
+    per_pair = METHOD_COSTS.get(method, 0) * bars
+    admitted = int((MAX_REQUEST_COST - screen) / per_pair) if per_pair else topn
+    return max(min(topn, admitted, MAX_TOPN_PAIRS), 1)
+
+
+def estimate_backtest_cost(start_date, end_date, params_range):
+    """
+    Estimated seconds of the backtests of a pair over the parameter grid.
+    :rtype: float
+    """
+    n_combos = len(range(params_range['rp_min'], params_range['rp_max'] + 1, params_range['rp_step'])) * \
+        len(range(params_range['zs_min'], params_range['zs_max'] + 1, params_range['zs_step']))
+    return BACKTEST_COST * n_combos * get_bars(start_date, end_date)
@@ -1,10 +1,40 @@
 import datetime as dt
+import json
+import threading
+from collections import OrderedDict
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objs as go
+import plotly.io
 from dash.dash_table.Format import Format, Scheme
 from plotly.subplots import make_subplots
 
+from signals.data.panel import get_data_version
+from signals.data.resultcache import RESULT_CACHE
+
+# Line plots longer than this are downsampled before being sent to the browser
+PLOT_MAX_POINTS = 1500
+# Number of serialized figures kept in memory
+FIGURE_CACHE_SIZE = 64
+
+_FIGURE_CACHE = OrderedDict()
+# Rows per page of the tables paged, sorted and filtered on the server
+TABLE_PAGE_SIZE = 20
+# Number of result tables kept in memory for paging
+TABLE_CACHE_SIZE = 32
+
+_TABLE_CACHE = OrderedDict()
+# guards both caches, the callbacks of the threaded server read and evict them concurrently
+_CACHE_LOCK = threading.Lock()
+
+# operators of the dash table filter query, the first of each list is the one matched on
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+                    ['contains '], ['datestartswith ']]
+
+# columns of the backtest result tables shown without the 4 decimals format
+BT_TBL_TEXT_COLS = ['Rolling Period', 'ZS Limit', 'Stocks Pair', 'Pairs', 'Trades']
+
 
 def get_cols_from_reg_tbl(rdf):
     """
@@ -29,15 +59,267 @@ def get_cols_from_bt_tbl(rdf):
     :rtype: list
     """
     display_table_cols = [{'name': i, 'id': i, 'hideable': True, 'type': 'numeric',
-                           'format': {'specifier': '.4f'}} if i not in ['Rolling Period', 'ZS Limit'] else {
+                           'format': {'specifier': '.4f'}} if i not in BT_TBL_TEXT_COLS else {
         'name': i, 'id': i,
         'hideable': True, } for i in rdf.columns]
     return display_table_cols
 
 
+def downsample_lttb(x, y, n_out=PLOT_MAX_POINTS):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a line series. The first and last points are always kept, and within
+    each bucket the point forming the largest triangle with its neighbours is selected, so peaks and troughs survive.
+    NaN values are dropped before the downsampling.
+    :param x: x values, e.g. a DatetimeIndex
+    :type x: pd.Index or np.ndarray
+    :param y: y values
+    :type y: pd.Series or np.ndarray
+    :param n_out: max number of points to keep
+    :type n_out: int
+    :return: downsampled x and y
+    :rtype: tuple
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    mask = ~np.isnan(y)
+    x, y = x[mask], y[mask]
+
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # work on a float axis, so that dates are handled the same way as numbers
+    xf = x.astype('datetime64[ns]').astype(np.int64).astype(float) if np.issubdtype(x.dtype, np.datetime64) \
+        else x.astype(float)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    idx = np.empty(n_out, dtype=int)
+    idx[0] = 0
+    idx[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # average point of the next bucket
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = xf[nlo:nhi].mean()
+        avg_y = y[nlo:nhi].mean()
+
+        area = np.abs((xf[a] - avg_x) * (y[lo:hi] - y[a]) - (xf[a] - xf[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+
+    return x[idx], y[idx]
+
+
+def get_cached_figure(key, builder, *args, **kwargs):
+    """
+    Return the figure for the given key as a plain dict, building it only once per data version. The figure is cached
+    in its serialized JSON form, which is what dash sends to the browser anyway, so the cache is compact and cheap to
+    hand back.
+    :param key: hashable key identifying the result the figure is built from
+    :type key: tuple
+    :param builder: function returning a go.Figure
+    :type builder: callable
+    :return: figure
+    :rtype: dict
+    """
+    key = (*key, get_data_version())
+    with _CACHE_LOCK:
+        fig_json = _FIGURE_CACHE.get(key)
+        if fig_json is not None:
+            _FIGURE_CACHE.move_to_end(key)
+    if fig_json is None:
+        fig_json = plotly.io.to_json(builder(*args, **kwargs), validate=False)
+        with _CACHE_LOCK:
+            _FIGURE_CACHE[key] = fig_json
+            if len(_FIGURE_CACHE) > FIGURE_CACHE_SIZE:
+                _FIGURE_CACHE.popitem(last=False)
+
+    return json.loads(fig_json)
+
+
+def get_cached_table(key, builder, *args, **kwargs):
+    """
+    Return the result table for the given key, building it only if it is neither held in memory nor in the result
+    cache, e.g. when the key was stored by another worker or the data has been updated since.
+    :param key: key identifying the result, as kept in a dcc.Store
+    :type key: list
+    :param builder: function returning the table
+    :type builder: callable
+    :return: table
+    :rtype: pd.DataFrame
+    """
+    key = (*key, get_data_version())
+    with _CACHE_LOCK:
+        df = _TABLE_CACHE.get(key)
+        if df is not None:
+            _TABLE_CACHE.move_to_end(key)
+    if df is None:
+        # kept in the persistent result cache, so that a worker without the table does not recompute it for a page
+        df = RESULT_CACHE.get(builder, args, kwargs)
+        with _CACHE_LOCK:
+            _TABLE_CACHE[key] = df
+            if len(_TABLE_CACHE) > TABLE_CACHE_SIZE:
+                _TABLE_CACHE.popitem(last=False)
+
+    return df
+
+
+def cache_table(key, df):
+    """
+    Hold a freshly computed result table in memory, replacing any previous result of the key.
+    :param key: key identifying the result
+    :type key: list
+    :param df: table
+    :type df: pd.DataFrame
+    :return: the key, to be kept in a dcc.Store
+    :rtype: list
+    """
+    versioned_key = (*key, get_data_version())
+    with _CACHE_LOCK:
+        _TABLE_CACHE[versioned_key] = df
+        _TABLE_CACHE.move_to_end(versioned_key)
+        if len(_TABLE_CACHE) > TABLE_CACHE_SIZE:
+            _TABLE_CACHE.popitem(last=False)
+    return list(key)
+
+
+def split_filter_part(filter_part):
+    """
+    Split one condition of a dash table filter query, e.g. '{Stocks Pair} contains AAPL'.
+    :param filter_part: condition
+    :type filter_part: str
+    :return: column, operator and value, all None if the condition is not understood
+    :rtype: tuple
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[:1]
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                return name, operator_type[0].strip(), value
+
+    return None, None, None
+
+
+def filter_table(df, filter_query):
+    """
+    Rows of the table matching all the conditions of a dash table filter query.
+    :param df: table
+    :type df: pd.DataFrame
+    :param filter_query: conditions joined by ' && '
+    :type filter_query: str
+    :rtype: pd.DataFrame
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for part in (filter_query or '').split(' && '):
+        col_name, operator, value = split_filter_part(part)
+        if col_name not in df.columns:
+            continue
+
+        values = df[col_name]
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            if isinstance(value, float) and not pd.api.types.is_numeric_dtype(values):
+                value = str(value).removesuffix('.0')
+            try:
+                mask &= getattr(values, operator)(value).to_numpy()
+            except TypeError:
+                mask &= False
+        elif operator == 'contains':
+            mask &= values.astype(str).str.contains(str(value), case=False, regex=False).to_numpy()
+        elif operator == 'datestartswith':
+            mask &= values.astype(str).str.startswith(str(value)).to_numpy()
+
+    return df[mask]
+
+
+def get_table_view(df, sort_by=None, filter_query=''):
+    """
+    Rows of a table passing the filter, in the sort order, as shown across all the pages of the dash table.
+    :param df: full table
+    :type df: pd.DataFrame
+    :param sort_by: sort_by of the dash table, list of {'column_id': col, 'direction': 'asc' or 'desc'}
+    :type sort_by: list
+    :param filter_query: filter_query of the dash table
+    :type filter_query: str
+    :rtype: pd.DataFrame
+    """
+    if filter_query:
+        df = filter_table(df, filter_query)
+
+    sort_by = [s for s in sort_by or [] if s['column_id'] in df.columns]
+    if sort_by:
+        # stable, so the rank of the result is kept among equal values
+        df = df.sort_values([s['column_id'] for s in sort_by], ascending=[s['direction'] == 'asc' for s in sort_by],
+                            kind='mergesort', na_position='last')
+    return df
+
+
+def get_page_active_cell(records, active_cell):
+    """
+    The active cell on a new page of a table with row ids: the same cell at the row of its id on this page, None if
+    the row is on another page, so that the row index of the former page does not highlight another row.
+    :param records: records of the page, with their id
+    :type records: list
+    :param active_cell: active_cell of the dash table
+    :type active_cell: dict
+    :rtype: dict
+    """
+    if not active_cell:
+        return None
+    ids = [r.get('id') for r in records]
+    if active_cell.get('row_id') not in ids:
+        return None
+    return active_cell | {'row': ids.index(active_cell['row_id'])}
+
+
+def get_table_page(df, page_current, page_size, sort_by=None, filter_query='', row_id=None):
+    """
+    One page of a table paged, sorted and filtered on the server, so only the visible rows are sent to the browser.
+    :param df: full table
+    :type df: pd.DataFrame
+    :param page_current: page number, from 0
+    :type page_current: int
+    :param page_size: rows per page
+    :type page_size: int
+    :param sort_by: sort_by of the dash table, list of {'column_id': col, 'direction': 'asc' or 'desc'}
+    :type sort_by: list
+    :param filter_query: filter_query of the dash table
+    :type filter_query: str
+    :param row_id: column used as the id of the rows, so that the active cell identifies a row on any page
+    :type row_id: str
+    :return: records of the page and the number of pages
+    :rtype: list, int
+    """
+    page_current, page_size = page_current or 0, page_size or TABLE_PAGE_SIZE
+    df = get_table_view(df, sort_by, filter_query)
+
+    page_count = max(-(-len(df) // page_size), 1)
+    # a narrower filter can leave fewer pages than the current one, show the last page then
+    page_current = min(page_current, page_count - 1)
+    page = df.iloc[page_current * page_size: (page_current + 1) * page_size]
+    if row_id is not None:
+        page = page.assign(id=page[row_id])
+
+    return page.to_dict('records'), page_count
+
+
 def strategy_plot(df1, df2, start_date, end_date, rolling_period):
     """
     Util function to generate pair-trading strategy performance plot in dash,subplot of rolling ols and total value.
+    Uses WebGL traces, and long series are downsampled via LTTB.
     :param df1:
     :type df1:
     :param df2:
@@ -56,8 +338,10 @@ def strategy_plot(df1, df2, start_date, end_date, rolling_period):
     fig = make_subplots(rows=2, cols=1, shared_xaxes=True, horizontal_spacing=0, vertical_spacing=0.01,
                         row_heights=[1, 1])
 
-    fig.add_scatter(x=df1.index, y=df1['Corr'], mode='lines', row=1, col=1, name='ols')
-    fig.add_scatter(x=df2.index, y=df2['Total_Value'], mode='lines', row=2, col=1, name='Total_Value')
+    x1, y1 = downsample_lttb(df1.index, df1['Corr'])
+    x2, y2 = downsample_lttb(df2.index, df2['Total_Value'])
+    fig.add_trace(go.Scattergl(x=x1, y=y1, mode='lines', name='ols'), row=1, col=1)
+    fig.add_trace(go.Scattergl(x=x2, y=y2, mode='lines', name='Total_Value'), row=2, col=1)
 
     fig.update_xaxes(range=[start_date + dt.timedelta(days=int(rolling_period / 5 * 7)), end_date],
                      rangeslider_visible=False, rangebreaks=[dict(bounds=['sat', 'mon'])])
@@ -76,23 +360,64 @@ def strategy_plot(df1, df2, start_date, end_date, rolling_period):
     return fig
 
 
-def get_regression_plot(xs, ys, title):
+def value_plot(df, start_date, end_date):
+    """
+    Util function to generate the account value plot of a backtest.
+    :param df: account values in column 'Total_Value'
+    :type df: pd.DataFrame
+    :param start_date:
+    :type start_date: str
+    :param end_date:
+    :type end_date: str
+    :return:
+    :rtype: go.Figure
+    """
+    start_date = dt.datetime.strptime(start_date, '%Y-%m-%d').date()
+    end_date = dt.datetime.strptime(end_date, '%Y-%m-%d').date()
+
+    x, y = downsample_lttb(df.index, df['Total_Value'])
+    fig = go.Figure(go.Scattergl(x=x, y=y, mode='lines', name='Total_Value'))
+
+    fig.update_xaxes(range=[start_date, end_date], rangeslider_visible=False,
+                     rangebreaks=[dict(bounds=['sat', 'mon'])])
+    fig.update_yaxes(title_text='Total Value')
+
+    fig.update_layout(
+        margin=dict(l=60, r=60, t=5, b=5),
+        paper_bgcolor='white',
+        showlegend=False,
+    )
+
+    return fig
+
+
+def get_regression_plot(xs, ys, title, slope=1.0, intercept=0.0):
     """
-    Function to generate regression scatter plot with ols trendline.
+    Function to generate regression scatter plot with ols trendline. The trendline is drawn from the coefficients that
+    are already computed by the caller instead of refitting an OLS, e.g. when xs is the fitted value of the regression
+    the trendline is the identity line.
     :param xs:
     :type xs: pd.Series
     :param ys:
     :type ys: pd.Series
     :param title: plot title
     :type title: str
+    :param slope: slope of the trendline
+    :type slope: float
+    :param intercept: intercept of the trendline
+    :type intercept: float
     :return:
     :rtype: go.Figure
     """
-    df = pd.concat([xs, ys], axis=1)
-    df.columns = ['x', 'y']
+    x = np.asarray(xs, dtype=float)
+    y = np.asarray(ys, dtype=float)
 
-    fig = px.scatter(df, x='x', y='y', color_discrete_sequence=['blue'], trendline='ols',
-                     trendline_color_override='red')
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(x=x, y=y, mode='markers', marker=dict(color='blue'), name='y'))
+    if len(x):
+        x_line = np.array([np.nanmin(x), np.nanmax(x)])
+        fig.add_trace(go.Scattergl(x=x_line, y=intercept + slope * x_line, mode='lines', line=dict(color='red'),
+                                   name='trendline'))
 
     fig.update_xaxes(title_text='Regression Result via OLS')
     fig.update_yaxes(title_text='Actual Index Performance')
@@ -100,6 +425,7 @@ def get_regression_plot(xs, ys, title):
     fig.update_layout(
         title=dict(text=title, automargin=True, yref='paper', x=0.5),
         paper_bgcolor='white',
+        showlegend=False,
     )
 
     return fig
@@ -0,0 +1,89 @@
+"""
+Start-up of the workers: a profile of the import time of the app, and the warm-up of the analytics libraries.
+
+The analytics libraries are imported on first use, so that workers boot fast and idle workers stay small. A preloaded
+gunicorn master can warm them up before forking, so every worker shares them copy-on-write and no first request pays
+for the imports, see gunicorn.conf.py.
+
+Example, the 30 slowest imports of the app:
+    python -m signals.utils.startup --top 30
+"""
+import argparse
+import importlib
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from config import BASE_DIR
+from signals.utils.dashlogger import logger
+
+# modules imported on first use by the dashboards and the exports, yfinance is left out as only the refresh uses it
+WARM_UP_MODULES = ['scipy.stats', 'statsmodels.api', 'statsmodels.tsa.stattools', 'sklearn.linear_model', 'pykalman',
+                   'backtrader_plotly.plotter', 'pyarrow.dataset', 'pyarrow.parquet', 'pymongoarrow.api',
+                   'signals.analytics.strategyrunner', 'signals.export']
+
+
+def warm_up(modules=WARM_UP_MODULES):
+    """
+    Import the modules imported on first use otherwise.
+    :param modules: module names
+    :type modules: list
+    :return: seconds taken by each module
+    :rtype: dict
+    """
+    timings = {}
+    for module in modules:
+        t1 = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.warn(fr'Cannot warm up {module} due to {e}, pass.')
+        timings[module] = time.perf_counter() - t1
+    logger.info('Warmed up the analytics libraries in ' + '%0.2f' % sum(timings.values()) + ' seconds.')
+    return timings
+
+
+def get_import_profile(module='wsgi'):
+    """
+    Import time of every module imported by the given one, measured with python -X importtime in a new process.
+    :param module: module to import, wsgi builds the app as a gunicorn worker does
+    :type module: str
+    :return: module, depth in the import tree, own and cumulative milliseconds, slowest first
+    :rtype: pd.DataFrame
+    """
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=BASE_DIR,
+                         capture_output=True, text=True, env=os.environ | {'PYTHONPATH': BASE_DIR})
+    rows = []
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        rows.append({'Module': name.strip(), 'Depth': (len(name) - len(name.lstrip()) - 1) // 2,
+                     'Self (ms)': int(own) / 1000, 'Cumulative (ms)': int(cumulative) / 1000})
+    return pd.DataFrame(rows).sort_values('Cumulative (ms)', ascending=False, ignore_index=True)
+
+
+def get_package_profile(profile):
+    """
+    Own import time summed per top-level package.
+    :param profile: as returned by get_import_profile
+    :type profile: pd.DataFrame
+    :rtype: pd.DataFrame
+    """
+    packages = profile['Module'].str.split('.').str[0]
+    return profile.groupby(packages)['Self (ms)'].sum().sort_values(ascending=False).rename('Total (ms)').to_frame()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time profile of the app.')
+    parser.add_argument('--module', default='wsgi')
+    parser.add_argument('--top', type=int, default=30)
+    args = parser.parse_args()
+
+    profile = get_import_profile(args.module)
+    print(profile.head(args.top).to_string(index=False))
+    print(get_package_profile(profile).head(args.top).to_string())
+    print('Total: ' + '%0.2f' % (profile.loc[profile['Depth'] == 0, 'Cumulative (ms)'].sum() / 1000) + ' seconds.')
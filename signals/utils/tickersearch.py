@@ -0,0 +1,104 @@
+"""
+Search of the tickers of an index, so that dropdowns only receive the best matches of what is typed.
+
+Tickers, and names where known, are kept sorted for prefix matches by bisection, and indexed by their trigrams for
+partial and misspelt queries.
+"""
+import bisect
+from collections import defaultdict
+
+from signals.utils.datahelper import INDEX_COMP
+
+# number of options returned for a query
+SEARCH_MAX_RESULTS = 20
+# share of the trigrams of the query a ticker or name must have to be a trigram match, and at least two of them
+TRIGRAM_MIN_SCORE = 0.4
+
+_TICKER_INDEXES = {}
+
+
+def get_trigrams(text):
+    """
+    Trigrams of the text, padded so that the start and end of short words are trigrams too.
+    :param text: upper case text
+    :type text: str
+    :rtype: set
+    """
+    padded = fr'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TickerIndex:
+    """
+    Prefix and trigram index over tickers and their names.
+    :param tickers: tickers
+    :type tickers: list
+    :param names: ticker to company name, if available
+    :type names: dict
+    """
+
+    def __init__(self, tickers, names=None):
+        self.tickers = sorted(set(tickers))
+        self.names = names or {}
+        # (key, ticker) sorted by key, a ticker appears under itself and under its name
+        self.keys = sorted([(t.upper(), t) for t in self.tickers] +
+                           [(self.names[t].upper(), t) for t in self.tickers if self.names.get(t)])
+        self.grams = defaultdict(set)
+        for key, ticker in self.keys:
+            for gram in get_trigrams(key):
+                self.grams[gram].add(ticker)
+
+    def label(self, ticker):
+        name = self.names.get(ticker)
+        return fr'{ticker} - {name}' if name else ticker
+
+    def options(self, tickers):
+        """
+        Dropdown options of the tickers.
+        :rtype: list
+        """
+        return [{'label': self.label(t), 'value': t} for t in tickers]
+
+    def search(self, query, limit=SEARCH_MAX_RESULTS):
+        """
+        Tickers best matching the query: the exact ticker, then tickers and names starting with the query, shortest
+        first, then those sharing most of its trigrams.
+        :param query: typed text
+        :type query: str
+        :param limit: max number of tickers
+        :type limit: int
+        :return: tickers
+        :rtype: list
+        """
+        query = (query or '').strip().upper()
+        if not query:
+            return self.tickers[:limit]
+
+        lo = bisect.bisect_left(self.keys, (query,))
+        hi = bisect.bisect_left(self.keys, (query + '\uffff',))
+        prefix = sorted(self.keys[lo:hi], key=lambda k: (k[0] != query, k[0] != k[1].upper(), len(k[0]), k[0]))
+        res = list(dict.fromkeys(ticker for key, ticker in prefix))[:limit]
+        if len(res) >= limit:
+            return res
+
+        grams = get_trigrams(query)
+        scores = defaultdict(int)
+        for gram in grams:
+            for ticker in self.grams.get(gram, ()):
+                scores[ticker] += 1
+        found = set(res)
+        min_score = max(TRIGRAM_MIN_SCORE * len(grams), 2)
+        matches = sorted((-n, t) for t, n in scores.items() if n >= min_score and t not in found)
+        return res + [t for n, t in matches[:limit - len(res)]]
+
+
+def get_ticker_index(index_value):
+    """
+    Ticker index of the components of the index, built on first use.
+    :param index_value: ticker of the index, e.g. '^RUT'
+    :type index_value: str
+    :rtype: TickerIndex
+    """
+    if index_value not in _TICKER_INDEXES:
+        _TICKER_INDEXES[index_value] = TickerIndex(INDEX_COMP.get(index_value, []))
+    return _TICKER_INDEXES[index_value]